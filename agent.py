@@ -1,7 +1,6 @@
-from langgraph.checkpoint.memory import MemorySaver 
 from typing import Annotated, Optional
 from typing_extensions import TypedDict
-from langchain_core.messages import BaseMessage, HumanMessage, AIMessage
+from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, SystemMessage
 
 from langchain_openai import ChatOpenAI
 from langchain_community.tools.tavily_search import TavilySearchResults
@@ -16,8 +15,14 @@ from langchain_google_community.gmail.utils import (
 
 from langchain_community.tools import YouTubeSearchTool
 from sound_tool import SoundTool
-from bus_tool import BusQueryTool, NearestBusStopQueryTool
+from bus_tool import BusQueryTool, NearestBusStopQueryTool, PlaceBusStopQueryTool
 from image_tool import StickerReactionTool
+from chinese_tool import PinyinTool, ChineseTranslationTool, quick_answer
+from compaction import FetchToolOutputTool, compact_tool_outputs, release_fetched_outputs
+from metrics import TurnTracer
+from prompt_cache import dynamic_context, prefix_hash, prefix_monitor, sort_tools
+from resilient_llm import LLM_DEADLINE_SECONDS, ResilientChatModel, build_fallback
+from store import get_checkpointer
 import json
 
 from langgraph.graph import StateGraph, START, END
@@ -37,7 +42,8 @@ with open('busstop_mapping.json', 'r') as f:
 # Format bus stop mappings for the prompt
 bus_stop_prompt = "\n".join([f"{location}: {code}" for location, code in bus_stop_mappings.items()])
 
-# Define the system prompt
+# Define the system prompt. It is the static prefix of every request, so it
+# must not change between turns: put per-turn details in dynamic_context()
 SYSTEM_PROMPT = f"""
 You are Gianna, a witty, cheerful, and helpful AI assistant living inside a Telegram bot. Your job is to make {os.getenv("MY_NAME")}'s life smoother, happier, and more fun. You're smart, quirky, and always ready with a good-natured joke (but never overdo it). You know when to be serious and when to lighten the mood.
 
@@ -63,6 +69,10 @@ Teaching Chinese:
 {os.getenv("MY_NAME")} occasionally asks you to teach him chinese. 
 If {os.getenv("MY_NAME")} provides an English phrase / sentence, translate it into Chinese and include pinyin so he knows how to pronounce it. 
 If {os.getenv("MY_NAME")} provides a Chinese phrase / sentence, translate it into English and include pinyin so he knows how to pronounce it. 
+Always use the chinese_translation tool for translations and the chinese_pinyin tool when only pinyin is needed. Don't write pinyin from memory.
+
+
+Long tool outputs (emails, search results, calendar listings) are shortened. If you need the part that was cut off, use the fetch_tool_output tool with the ref from the truncation note.
 
 
 Bus Stop Information:
@@ -72,6 +82,8 @@ Here are the known bus stop codes:
 
 If {os.getenv("MY_NAME")} provides a latitude and longitude, use the nearest_bus_stop_tool to get the nearest bus stops.
 
+If {os.getenv("MY_NAME")} names a place (a landmark, MRT station, building or road) instead of sharing a location, use the place_bus_stop_query tool to find the nearest bus stops. If it returns several candidates, ask which one he means.
+
 if not enough information is provided, ask for a location and use the nearest_bus_stop_tool to get the nearest bus stops.
 
 Reaction to stickers:
@@ -94,20 +106,27 @@ class State(TypedDict):
     messages: Annotated[list, add_messages]
 
 def chatbot(state: State):
-    # Add system message at the start of the messages list
+    # Static system prompt first and per-turn context last, so everything up to
+    # the newest messages is a prefix the provider can serve from its cache
     messages = [
-        ("system", SYSTEM_PROMPT)
-    ] + state["messages"]
+        SystemMessage(content=SYSTEM_PROMPT)
+    ] + state["messages"] + [
+        SystemMessage(content=dynamic_context())
+    ]
     
     return {"messages": [llm_with_tools.invoke(messages)]}
 
-# Initialize LLM
-llm = ChatOpenAI(
-    model="gpt-4o-mini",
-    temperature=0,
-    api_key=os.environ.get("OPENAI_API_KEY")
-).bind(
-    system_message=SYSTEM_PROMPT
+# Initialize LLM, with a deadline, hedged requests and a fallback model for slow or failed calls
+llm = ResilientChatModel(
+    primary=ChatOpenAI(
+        model="gpt-4o-mini",
+        temperature=0,
+        api_key=os.environ.get("OPENAI_API_KEY"),
+        request_timeout=LLM_DEADLINE_SECONDS,
+        # Retries happen within the deadline as hedges or the fallback instead
+        max_retries=0,
+    ),
+    fallback=build_fallback(temperature=0),
 )
 
 # Create the search tool with API key from environment
@@ -170,9 +189,16 @@ def create_agent():
     # Initialize the bus query tool
     bus_tool = BusQueryTool()
     nearest_bus_stop_tool = NearestBusStopQueryTool()   
+    place_bus_stop_tool = PlaceBusStopQueryTool()
     sticker_reaction_tool = StickerReactionTool()
-    # Combine all tools
-    tools = [search_tool, youtube_search_tool, sound_tool, bus_tool, nearest_bus_stop_tool, sticker_reaction_tool] + calendar_tools + gmail_tools
+    pinyin_tool = PinyinTool()
+    chinese_translation_tool = ChineseTranslationTool()
+    fetch_tool_output_tool = FetchToolOutputTool()
+    # Combine all tools, in a fixed order so their schemas are a stable prompt prefix
+    tools = sort_tools([search_tool, youtube_search_tool, sound_tool, bus_tool, nearest_bus_stop_tool,
+                        place_bus_stop_tool, sticker_reaction_tool, pinyin_tool, chinese_translation_tool,
+                        fetch_tool_output_tool] + calendar_tools + gmail_tools)
+    prefix_monitor.check(prefix_hash(SYSTEM_PROMPT, tools))
     global llm_with_tools
     llm_with_tools = llm.bind_tools(tools)
     
@@ -182,19 +208,25 @@ def create_agent():
     # Add tool node
     tool_node = ToolNode(tools=tools)
     graph_builder.add_node("tools", tool_node)
+    graph_builder.add_node("compact", compact_tool_outputs)
+    graph_builder.add_node("release", release_fetched_outputs)
     
     # Add conditional edges
     graph_builder.add_conditional_edges(
         source="chatbot",
         path=tools_condition,
     )
-    # Any time a tool is called, we return to the chatbot to decide the next step
-    graph_builder.add_edge("tools", "chatbot")
+    # Any time a tool is called, its output is compacted and we return to the
+    # chatbot to decide the next step
+    graph_builder.add_edge("tools", "compact")
+    graph_builder.add_edge("compact", "chatbot")
     
-    graph_builder.add_edge(START, "chatbot")
+    # Each turn starts by dropping pages fetched in earlier turns
+    graph_builder.add_edge(START, "release")
+    graph_builder.add_edge("release", "chatbot")
     graph_builder.add_edge("chatbot", END)
     
-    memory = MemorySaver()
+    memory = get_checkpointer()
     return graph_builder.compile(checkpointer=memory)
 
 def get_agent_response(message: str, chat_id: str, context_message: Optional[str] = None) -> str:
@@ -213,6 +245,25 @@ def get_agent_response(message: str, chat_id: str, context_message: Optional[str
     if chat_id not in chat_memories:
         chat_memories[chat_id] = create_agent()
     
+    # Trace LLM, tool and node timings for this turn
+    tracer = TurnTracer(chat_id)
+
+    # Pinyin requests and memoized translations don't need the LLM. The
+    # exchange is still recorded so the conversation reads naturally later.
+    if not context_message:
+        quick_response = quick_answer(message)
+        if quick_response:
+            tracer.route = "fast_path"
+            try:
+                chat_memories[chat_id].update_state(
+                    {"configurable": {"thread_id": chat_id}},
+                    {"messages": [HumanMessage(content=message), AIMessage(content=quick_response)]},
+                    as_node="chatbot",
+                )
+            finally:
+                tracer.finish()
+            return quick_response
+
     # Create the input messages
     messages = []
     if context_message:
@@ -220,19 +271,22 @@ def get_agent_response(message: str, chat_id: str, context_message: Optional[str
         messages.append(AIMessage(content="I understand you're referring to this previous message."))
     
     messages.append(HumanMessage(content=message))
-    
+
     # Get response from the agent
     events = chat_memories[chat_id].stream(
         input={"messages": messages},
-        config={"configurable": {"thread_id": chat_id}},
+        config={"configurable": {"thread_id": chat_id}, "callbacks": [tracer]},
         stream_mode="values",
     )
     
     # Get the last response
     final_response = None
-    for event in events:
-        if event["messages"]:
-            final_response = event["messages"][-1].content
+    try:
+        for event in events:
+            if event["messages"]:
+                final_response = event["messages"][-1].content
+    finally:
+        tracer.finish()
     
     return final_response or "I apologize, but I couldn't generate a response."
 
@@ -0,0 +1,240 @@
+"""
+Offline component benchmarks for the bot.
+
+Runs against a fake chat model and a local fake LTA DataMall server, so no
+network access or credentials are needed. Results are written as JSON so runs
+from different commits can be compared:
+
+    python benchmark.py --output bench_before.json
+    git checkout <other commit>
+    python benchmark.py --output bench_after.json --compare bench_before.json
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import fakes
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def summarize(samples):
+    """Summarize a list of durations (seconds) in milliseconds."""
+    ordered = sorted(samples)
+
+    def pct(p):
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))] * 1000
+
+    return {
+        "n": len(ordered),
+        "mean_ms": statistics.fmean(ordered) * 1000,
+        "p50_ms": pct(50),
+        "p95_ms": pct(95),
+        "p99_ms": pct(99),
+        "min_ms": ordered[0] * 1000,
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+def timed(fn, iterations, warmup=1):
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def bench_nearest_stops(iterations):
+    from bus_tool import get_nearest_stops
+    return timed(lambda: get_nearest_stops(1.330638, 103.842668), iterations)
+
+
+def bench_geocode(iterations):
+    from geocoder import get_index
+    index = get_index()
+    return timed(lambda: index.geocode("Thomson Road mall"), iterations)
+
+
+def bench_bus_query_tool(iterations):
+    """The DataMall call plus formatting: the arrival cache is cleared before each query."""
+    from bus_tool import BusQueryTool
+    from prefetch import arrival_cache
+    tool = BusQueryTool()
+
+    def query():
+        arrival_cache.invalidate("52071")
+        tool._run("52071")
+
+    return timed(query, iterations)
+
+
+def bench_bus_query_tool_cached(iterations):
+    """A query answered from the arrival cache."""
+    from bus_tool import BusQueryTool
+    tool = BusQueryTool()
+    return timed(lambda: tool._run("52071"), iterations)
+
+
+def bench_create_agent(iterations):
+    import agent
+    return timed(agent.create_agent, iterations)
+
+
+def bench_checkpoint_growth(sizes):
+    """Time checkpoint writes and reads as a thread's message history grows."""
+    import agent
+    from langchain_core.messages import AIMessage, HumanMessage
+
+    graph = agent.create_agent()
+    config = {"configurable": {"thread_id": "bench-checkpoint"}}
+    results = {}
+    count = 0
+    for size in sizes:
+        write_samples = []
+        while count < size:
+            batch = [HumanMessage(content=f"message {count} " + "lorem ipsum " * 20),
+                     AIMessage(content=f"reply {count} " + "dolor sit amet " * 20)]
+            start = time.perf_counter()
+            graph.update_state(config, {"messages": batch}, as_node="chatbot")
+            write_samples.append(time.perf_counter() - start)
+            count += len(batch)
+        read = timed(lambda: graph.get_state(config), 20)
+        checkpoint = graph.checkpointer.get_tuple(config).checkpoint
+        _, blob = graph.checkpointer.serde.dumps_typed(checkpoint)
+        results[str(size)] = {
+            "write": summarize(write_samples[-20:]),
+            "read": read,
+            "checkpoint_bytes": len(blob),
+        }
+    return results
+
+
+def bench_agent_turn(iterations):
+    import agent
+    from prefetch import arrival_cache
+    chat_id = "bench-turn"
+
+    def turn():
+        # Comparable with runs from before the arrival cache: every turn calls DataMall
+        arrival_cache.invalidate("52071")
+        agent.get_agent_response("when is the next bus at 52071?", chat_id)
+
+    return timed(turn, iterations)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return None
+
+
+def run_benchmarks(iterations, llm_latency, lta_latency):
+    sys.path.insert(0, REPO_DIR)
+    workdir = tempfile.mkdtemp(prefix="giannabot-bench-")
+    bus_stops = fakes.fake_bus_stops()
+    fakes.write_fake_data(workdir, bus_stops)
+
+    with fakes.FakeLTAServer(latency=lta_latency, bus_stops=bus_stops) as lta:
+        fakes.install_fakes(workdir, lta.url)
+        import agent
+        agent.llm = fakes.FakeChatModel(latency=llm_latency)
+
+        results = {
+            "nearest_stops": bench_nearest_stops(iterations),
+            "geocode": bench_geocode(iterations),
+            "bus_query_tool": bench_bus_query_tool(iterations),
+            "bus_query_tool_cached": bench_bus_query_tool_cached(iterations),
+            "create_agent": bench_create_agent(iterations),
+            "checkpoint_growth": bench_checkpoint_growth([10, 50, 200]),
+            "agent_turn": bench_agent_turn(iterations),
+        }
+        results["agent_turn"]["lta_requests"] = lta.request_count
+
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "iterations": iterations,
+            "llm_latency_s": llm_latency,
+            "lta_latency_s": lta_latency,
+        },
+        "results": results,
+    }
+
+
+def flatten(results, prefix=""):
+    """Yield (name, p50_ms) for every timing summary in a results tree."""
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict) and "p50_ms" in value:
+            yield name, value["p50_ms"]
+        elif isinstance(value, dict):
+            yield from flatten(value, name + ".")
+
+
+def compare(current, baseline, threshold):
+    """Print p50 changes against a baseline run. Returns the names that regressed past threshold."""
+    previous = dict(flatten(baseline["results"]))
+    regressions = []
+    print(f"Comparing {current['meta']['commit']} against {baseline['meta'].get('commit')}")
+    for name, p50 in flatten(current["results"]):
+        if name not in previous:
+            continue
+        ratio = p50 / previous[name] if previous[name] else float("inf")
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  <-- regression"
+            regressions.append(name)
+        print(f"  {name:40s} {previous[name]:10.3f} ms -> {p50:10.3f} ms  ({ratio:5.2f}x){flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run offline component benchmarks.")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="Injected fake LLM latency in seconds")
+    parser.add_argument("--lta-latency", type=float, default=0.0, help="Injected fake LTA latency in seconds")
+    parser.add_argument("--output", help="Write results JSON to this path (default: stdout)")
+    parser.add_argument("--compare", help="Baseline results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Relative p50 slowdown counted as a regression")
+    args = parser.parse_args()
+
+    if args.output:
+        args.output = os.path.abspath(args.output)
+    if args.compare:
+        args.compare = os.path.abspath(args.compare)
+
+    # Tools print debugging output; keep stdout clean for the JSON report
+    with contextlib.redirect_stdout(sys.stderr):
+        report = run_benchmarks(args.iterations, args.llm_latency, args.lta_latency)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(report, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,26 @@
+import asyncio
 import os
 import logging
+import random
+import time
+from typing import Optional
 from dotenv import load_dotenv
 from telegram import Update
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
+from telegram.request import BaseRequest
+from telegram.ext import Application, CommandHandler, Defaults, MessageHandler, TypeHandler, filters, ContextTypes
 from agent import get_agent_response, chat_memories
 import json
 from image_tool import get_photo_description
+from metrics import QUEUE_WAIT_SECONDS, TELEGRAM_SEND_SECONDS, start_metrics_server
+from update_processor import ChatOrderedUpdateProcessor, queue_wait
+from scheduler import AgentScheduler, SchedulerBusy, PRIORITY_HIGH, PRIORITY_NORMAL
+from sharding import ShardRouter
+from store import STATE_DB_PATH, clear_thread, get_checkpointer, get_set
+from bus_watch import BusWatcher
+from prefetch import prefetcher
+from debounce import MessageCoalescer, PendingMessage, merge
+from recorder import RECORD_UPDATES_PATH, UpdateRecorder
+from outbound import outbound
 # Load environment variables
 load_dotenv()
 
@@ -20,9 +35,63 @@ logger = logging.getLogger(__name__)
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 AUTHORIZED_USER_ID = int(os.getenv('AUTHORIZED_USER_ID'))
 MAX_HISTORY_LENGTH = int(os.getenv('MAX_HISTORY_LENGTH', '10'))
+DEBUG_LOG_SAMPLE_RATE = float(os.getenv('DEBUG_LOG_SAMPLE_RATE', '0.1'))
 
-# Authorized groups (add group IDs here)
-AUTHORIZED_GROUPS = set()
+# Concurrency: updates from different chats are handled in parallel, agent
+# turns run on a bounded pool of worker threads so they don't block the event loop
+AGENT_WORKERS = int(os.getenv('AGENT_WORKERS', '4'))
+MAX_CONCURRENT_UPDATES = int(os.getenv('MAX_CONCURRENT_UPDATES', '64'))
+
+# Webhook mode is enabled by setting WEBHOOK_URL (the public URL Telegram posts to)
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', 'telegram')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+
+# Load shedding: per-chat and global token buckets (turns per minute, burst size)
+# and a bounded queue in front of the agent workers
+CHAT_RATE_PER_MINUTE = float(os.getenv('CHAT_RATE_PER_MINUTE', '6'))
+CHAT_BURST = float(os.getenv('CHAT_BURST', '3'))
+GLOBAL_RATE_PER_MINUTE = float(os.getenv('GLOBAL_RATE_PER_MINUTE', '30'))
+GLOBAL_BURST = float(os.getenv('GLOBAL_BURST', '10'))
+AGENT_QUEUE_SIZE = int(os.getenv('AGENT_QUEUE_SIZE', '20'))
+BUSY_MESSAGE = "I'm a bit swamped right now, please try again in a minute!"
+
+scheduler = AgentScheduler(
+    workers=AGENT_WORKERS,
+    max_queue=AGENT_QUEUE_SIZE,
+    chat_rate=CHAT_RATE_PER_MINUTE / 60,
+    chat_burst=CHAT_BURST,
+    global_rate=GLOBAL_RATE_PER_MINUTE / 60,
+    global_burst=GLOBAL_BURST,
+)
+
+# Messages from the same chat arriving within DEBOUNCE_MS of each other are
+# answered together in one agent turn. Off by default, since every reply then
+# waits out the window (e.g. 1500)
+DEBOUNCE_MS = int(os.getenv('DEBOUNCE_MS', '0'))
+
+# Bus arrival watches (/watch): poll interval and how long a watch lasts
+WATCH_INTERVAL_SECONDS = float(os.getenv('WATCH_INTERVAL_SECONDS', '30'))
+WATCH_TIMEOUT_MINUTES = float(os.getenv('WATCH_TIMEOUT_MINUTES', '30'))
+
+bus_watcher = BusWatcher(interval=WATCH_INTERVAL_SECONDS, timeout=WATCH_TIMEOUT_MINUTES * 60)
+
+# Sharded mode: a front process receives updates and routes each chat to one
+# of SHARD_WORKERS worker processes. Requires STATE_DB_PATH for shared state.
+SHARD_WORKERS = int(os.getenv('SHARD_WORKERS', '1'))
+# This process's shard (set by sharding._serve); shard 0 also runs the shared background jobs
+shard_index = 0
+
+# Authorized groups (add group IDs here), persisted when STATE_DB_PATH is set
+AUTHORIZED_GROUPS = get_set('authorized_groups')
+
+# Received stickers are saved here for the sticker reaction tool
+STICKER_DIR = 'data/stickers'
+
+# Record incoming updates (anonymised) to RECORD_UPDATES_PATH for replay.py
+recorder = UpdateRecorder(RECORD_UPDATES_PATH, owner_id=AUTHORIZED_USER_ID) if RECORD_UPDATES_PATH else None
 
 # Conversation history storage
 conversation_history = {}
@@ -53,6 +122,8 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "/help - Show this help message\n"
         "/authorize - Authorize this group to use the bot\n"
         "/clear - Clear conversation history\n"
+        "/watch <stop> [service] - Track bus arrivals at a stop\n"
+        "/unwatch - Stop tracking buses\n"
         "\nYou can also:\n"
         "- Mention me with @ to get a response\n"
         f"\nCurrent context window: {MAX_HISTORY_LENGTH} messages"
@@ -71,9 +142,10 @@ async def clear_history(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if chat_id in conversation_history:
         conversation_history[chat_id] = []
     
-    # Clear the agent's memory
-    if str(chat_id) in chat_memories:
-        chat_memories[str(chat_id)].clear()
+    # Clear the agent's memory: its checkpoints, which survive restarts with STATE_DB_PATH
+    graph = chat_memories.get(str(chat_id))
+    checkpointer = graph.checkpointer if graph else get_checkpointer()
+    await asyncio.to_thread(clear_thread, checkpointer, str(chat_id))
     
     await update.message.reply_text("Conversation history cleared.")
 
@@ -101,6 +173,31 @@ async def authorize_group(update: Update, context: ContextTypes.DEFAULT_TYPE):
     logger.info(f"Group {chat_id} authorized by user {user_id}")
     await update.message.reply_text(f"This group is now authorized to use the bot. Group ID: {chat_id}")
 
+async def watch_bus(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Keep a message updated with arrivals at a bus stop: /watch <stop> [service]."""
+    if not is_authorized(update):
+        await update.message.reply_text("You are not authorized to use this command.")
+        return
+
+    args = context.args or []
+    if not args or not (args[0].isdigit() and len(args[0]) == 5):
+        await update.message.reply_text("Usage: /watch <5-digit bus stop code> [bus service]")
+        return
+
+    service_no = args[1].upper() if len(args) > 1 else None
+    error = await bus_watcher.add(context.bot, update.effective_chat.id, args[0], service_no)
+    if error:
+        await update.message.reply_text(error)
+
+async def unwatch_bus(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Stop this chat's bus watches."""
+    if not is_authorized(update):
+        await update.message.reply_text("You are not authorized to use this command.")
+        return
+
+    removed = bus_watcher.remove(update.effective_chat.id)
+    await update.message.reply_text(f"Stopped {removed} watch(es)." if removed else "Nothing is being watched.")
+
 def is_authorized(update: Update) -> bool:
     """Check if the user or group is authorized to use the bot."""
     user_id = update.effective_user.id
@@ -117,6 +214,63 @@ def is_authorized(update: Update) -> bool:
     return chat_id in AUTHORIZED_GROUPS
 
 
+def reply_context(message) -> Optional[str]:
+    """The message being replied to, as context for the agent."""
+    if not message.reply_to_message:
+        return None
+    if message.reply_to_message.location:
+        # This is a location message
+        location = message.reply_to_message.location
+        return f"Coordinates Provided (Latitude: {location.latitude}, Longitude: {location.longitude})"
+    # This is not a location message
+    return message.reply_to_message.text
+
+def log_update_sampled(update: Update):
+    """Log the raw incoming message at debug level for a sample of updates."""
+    if logger.isEnabledFor(logging.DEBUG) and random.random() < DEBUG_LOG_SAMPLE_RATE:
+        logger.debug(f"Incoming message: {update.message}")
+
+async def run_agent(update: Update, message: str, context_message=None) -> str:
+    """
+    Run an agent turn through the scheduler without blocking the event loop.
+
+    Raises SchedulerBusy if the turn is rate limited or the queue is full.
+    """
+    chat_id = update.effective_chat.id
+    priority = PRIORITY_HIGH if update.effective_user.id == AUTHORIZED_USER_ID else PRIORITY_NORMAL
+    return await scheduler.submit(chat_id, get_agent_response, message, str(chat_id), context_message, priority=priority)
+
+async def send_reply(update: Update, text: str):
+    """Reply to the update's message, recording how long Telegram takes."""
+    start = time.perf_counter()
+    try:
+        await update.message.reply_text(text)
+    finally:
+        TELEGRAM_SEND_SECONDS.observe(time.perf_counter() - start, method="sendMessage")
+
+async def respond(update: Update, message: str, context_message=None):
+    """Run an agent turn for a message and reply to it."""
+    try:
+        # Pass both the message and context to the agent
+        response = await run_agent(update, message, context_message)
+        await send_reply(update, response)
+    except SchedulerBusy:
+        await send_reply(update, BUSY_MESSAGE)
+    except Exception as e:
+        logger.error(f"Error getting response from agent: {e}")
+        await update.message.reply_text("Sorry, I encountered an error processing your request.")
+
+async def respond_to_batch(chat_id: int, batch):
+    """Answer a burst of messages from one chat with a single turn, replying to the latest."""
+    message, context_message = merge(batch)
+    await respond(batch[-1].update, message, context_message)
+
+coalescer = MessageCoalescer(DEBOUNCE_MS / 1000, respond_to_batch) if DEBOUNCE_MS > 0 else None
+
+def buffer_message(context: ContextTypes.DEFAULT_TYPE, chat_id: int, item: PendingMessage):
+    """Add a message to its chat's debounce window; its update only counts as processed once it's answered."""
+    item.done = context.application.update_processor.hold(item.update)
+    coalescer.add(chat_id, item)
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle incoming messages."""
@@ -132,64 +286,153 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.info(f"Unauthorized private chat attempt from user {update.effective_user.id}")
         return
     
-    print(update.message)
+    waited = queue_wait(update)
+    if waited is not None:
+        QUEUE_WAIT_SECONDS.observe(waited)
+
+    log_update_sampled(update)
 
     # Check if bot is mentioned
     if update.message and update.message.text:
         bot_username = context.bot.username
+        sender = update.effective_user.id
         if f"@{bot_username}" in update.message.text:
             # Get the message without the mention
             message = update.message.text.replace(f"@{bot_username}", "").strip()
+            context_message = reply_context(update.message)
             
-            # Get reply context if it exists
-            context_message = None
-            if update.message.reply_to_message:
-                if update.message.reply_to_message.location:
-                    # This is a location message
-                    location = update.message.reply_to_message.location
-                    context_message = f"Coordinates Provided (Latitude: {location.latitude}, Longitude: {location.longitude})"
-                    # Now you can access location.latitude and location.longitude
-                else:
-                    # This is not a location message
-                    context_message = update.message.reply_to_message.text
-            
-            try:
-                # Pass both the message and context to the agent
-                response = get_agent_response(message, str(chat_id), context_message)
-                await update.message.reply_text(response)
-            except Exception as e:
-                logger.error(f"Error getting response from agent: {e}")
-                await update.message.reply_text("Sorry, I encountered an error processing your request.")
+            # Quick follow-up messages are merged into a single agent turn
+            if coalescer:
+                buffer_message(context, chat_id, PendingMessage(update, message, context_message, sender))
+            else:
+                await respond(update, message, context_message)
+        elif coalescer and coalescer.is_open(chat_id, sender):
+            # A follow-up to a message that mentioned the bot doesn't need its own mention
+            buffer_message(context, chat_id, PendingMessage(update, update.message.text.strip(), reply_context(update.message), sender))
     elif update.message and update.message.sticker:
-        print("received sticker")
+        logger.debug(f"Received sticker in chat {chat_id}")
+        if coalescer:
+            # Answer the chat's earlier messages first
+            await coalescer.flush_now(chat_id)
         file = await context.bot.get_file(update.message.sticker.file_id)
-        await file.download_to_drive("data/sticker.jpg")
-        message = "Received a sticker. Saved in data/sticker.jpg"
+        # One file per sticker, so concurrent chats don't overwrite each other's
+        sticker_path = os.path.join(STICKER_DIR, f"{chat_id}_{update.message.message_id}.jpg")
+        os.makedirs(STICKER_DIR, exist_ok=True)
+        await file.download_to_drive(sticker_path)
+        message = f"Received a sticker. Saved in {sticker_path}"
         try: 
-            response = get_agent_response(message, str(chat_id), context_message=None)
-            # reply = get_photo_description("data/sticker.jpg")
-            await update.message.reply_text(response)
+            response = await run_agent(update, message, context_message=None)
+            # reply = get_photo_description(sticker_path)
+            await send_reply(update, response)
+        except SchedulerBusy:
+            await send_reply(update, BUSY_MESSAGE)
         except Exception as e:
             logger.error(f"Error getting response from agent: {e}")
             await update.message.reply_text("Sorry, I encountered an error processing your request.")
-    else:
-        print(update.message)
+        finally:
+            os.remove(sticker_path)
         
 
-def main():
-    """Start the bot."""
+async def post_init(application: Application):
+    """Start background workers once the bot is initialized."""
+    # The arrival cache and usage profile are shared, so one prefetcher serves every shard
+    if shard_index == 0:
+        prefetcher.start()
+    # Tools send media through the bot's own connection
+    outbound.start(application.bot)
+
+async def post_shutdown(application: Application):
+    """Stop background workers when the bot shuts down."""
+    if coalescer:
+        await coalescer.drain()
+    await scheduler.shutdown()
+    await bus_watcher.stop()
+    await prefetcher.stop()
+    await outbound.stop()
+    if recorder:
+        recorder.close()
+
+def build_application(request: Optional[BaseRequest] = None, defaults: Optional[Defaults] = None) -> Application:
+    """
+    Create the Application with all handlers registered.
+
+    A custom request object can be passed to talk to something other than
+    the real Bot API (replay.py uses a fake one).
+    """
     # Create the Application and pass it your bot's token
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+    builder = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .concurrent_updates(ChatOrderedUpdateProcessor(MAX_CONCURRENT_UPDATES))
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+    )
+    if request is not None:
+        builder = builder.request(request)
+    if defaults is not None:
+        builder = builder.defaults(defaults)
+    application = builder.build()
+
+    # In sharded mode the front process records, before routing
+    if recorder and SHARD_WORKERS <= 1:
+        application.add_handler(TypeHandler(Update, recorder.record), group=-1)
 
     # Add handlers
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(CommandHandler("authorize", authorize_group))
     application.add_handler(CommandHandler("clear", clear_history))
+    application.add_handler(CommandHandler("watch", watch_bus))
+    application.add_handler(CommandHandler("unwatch", unwatch_bus))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
     application.add_handler(MessageHandler(filters.Sticker.ALL, handle_message))
+    return application
+
+def build_front_application(router: ShardRouter) -> Application:
+    """Create an Application that only forwards updates to shard workers."""
+    async def start_router(application: Application):
+        await router.start()
+
+    async def stop_router(application: Application):
+        await router.stop()
+
+    application = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .post_init(start_router)
+        .post_shutdown(stop_router)
+        .build()
+    )
+    if recorder:
+        application.add_handler(TypeHandler(Update, recorder.record), group=-1)
+    application.add_handler(TypeHandler(Update, router.forward))
+    return application
+
+def main():
+    """Start the bot."""
+    if SHARD_WORKERS > 1:
+        if not STATE_DB_PATH:
+            raise ValueError("STATE_DB_PATH must be set when running with SHARD_WORKERS > 1")
+        logger.info(f"Running as front process for {SHARD_WORKERS} shard workers")
+        application = build_front_application(ShardRouter(SHARD_WORKERS))
+    else:
+        application = build_application()
+
+    # Expose latency, token and tool metrics
+    start_metrics_server()
+
     # Start the Bot
-    application.run_polling()
+    if WEBHOOK_URL:
+        logger.info(f"Starting webhook server on {WEBHOOK_LISTEN}:{WEBHOOK_PORT}/{WEBHOOK_PATH}")
+        application.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET,
+        )
+    else:
+        application.run_polling()
 
 if __name__ == '__main__':
     main() 
\ No newline at end of file
@@ -1,7 +1,10 @@
 from datetime import datetime
 from dotenv import load_dotenv
+import logging
 import os
 from singapore_data import LTADataMallBus
+from prefetch import arrival_cache, usage_profile
+from geocoder import get_index
 from langchain.tools import BaseTool
 from pydantic import BaseModel, Field
 from typing import Dict, List, Optional, Type
@@ -10,6 +13,8 @@ import numpy as np
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 class BusQueryInput(BaseModel):
     bus_stop_code: str = Field(description="The 5-digit bus stop code to query")
 
@@ -59,6 +64,18 @@ class BusQueryTool(BaseTool):
         }
         return type_map.get(bus_type, bus_type)
 
+    def format_arrivals(self, bus_stop_code: str, bus_info: List[tuple]) -> str:
+        """Format (service_no, arrival_time, load, bus_type) tuples for a bus stop."""
+        formatted_info = []
+        for service_no, arrival_time, load, bus_type in bus_info:
+            formatted_info.append(
+                f"Bus {service_no} ({self.format_bus_type(bus_type)}): "
+                f"Arriving in {self.format_time(arrival_time)}, "
+                f"{self.format_load(load)}"
+            )
+        
+        return f"Bus Stop {bus_stop_code}:\n" + "\n".join(formatted_info)
+
     def _run(self, bus_stop_code: str) -> str:
         """
         Query bus arrival information for a specific bus stop.
@@ -69,21 +86,22 @@ class BusQueryTool(BaseTool):
         Returns:
             str: A formatted string containing bus arrival information
         """
+        # Record the query so the prefetcher learns when this stop is used; a
+        # failure here only costs the prefetcher a sample, not the answer
         try:
-            bus_info = self._client.get_next_bus_info_concise(bus_stop_code)
+            usage_profile.record(bus_stop_code)
+        except Exception as e:
+            logger.warning(f"Could not record usage of bus stop {bus_stop_code}: {e}")
+
+        try:
+            # Answer from the warm cache when possible
+            arrival = arrival_cache.get_or_fetch(self._client, bus_stop_code)
+            bus_info = LTADataMallBus.concise_services(arrival['Services'])
             
             if not bus_info:
                 return "No bus services available at this stop."
             print(bus_info)
-            formatted_info = []
-            for service_no, arrival_time, load, bus_type in bus_info:
-                formatted_info.append(
-                    f"Bus {service_no} ({self.format_bus_type(bus_type)}): "
-                    f"Arriving in {self.format_time(arrival_time)}, "
-                    f"{self.format_load(load)}"
-                )
-            
-            return f"Bus Stop {bus_stop_code}:\n" + "\n".join(formatted_info)
+            return self.format_arrivals(bus_stop_code, bus_info)
             
         except Exception as e:
             return f"Error querying bus information: {str(e)}"
@@ -114,10 +132,42 @@ class NearestBusStopQueryTool(BaseTool):
         return nearest_stops
     
 
+class PlaceBusStopQueryInput(BaseModel):
+    place_name: str = Field(description="The place, landmark, building or road to find bus stops near, e.g. 'Bishan MRT' or 'Ngee Ann City'")
+
+class PlaceBusStopQueryTool(BaseTool):
+    name: str = "place_bus_stop_query"
+    description: str = (
+        "Find the nearest bus stops to a named place in Singapore (landmark, MRT station, building or road), "
+        "without needing coordinates. Works offline. If the name is ambiguous, returns ranked candidates to choose from."
+    )
+    args_schema: Type[BaseModel] = PlaceBusStopQueryInput
+
+    def _run(self, place_name: str) -> str:
+        best, candidates = get_index().geocode(place_name)
+        if best:
+            place = best.place
+            return f"Matched '{place_name}' to {place.name}" + (f" ({place.road})" if place.road else "") + ".\n\n" + \
+                get_nearest_stops(round(place.latitude, 6), round(place.longitude, 6))
+        if not candidates:
+            return f"No place matching '{place_name}' was found. Ask for a more specific name or a location."
+
+        lines = [f"'{place_name}' could be one of these places:"]
+        for rank, candidate in enumerate(candidates, 1):
+            place = candidate.place
+            where = f" ({place.road})" if place.road else " (road)"
+            lines.append(
+                f"{rank}. {place.name}{where}: latitude {place.latitude:.6f}, longitude {place.longitude:.6f}, "
+                f"bus stops {', '.join(place.stop_codes[:4])}"
+            )
+        lines.append("Ask which one is meant, or use nearest_bus_stop_query with the chosen coordinates.")
+        return "\n".join(lines)
+
+
 def get_nearest_stops(target_lat, target_lon):
     # Your bus stop dataframe (e.g., all_busstops)
     # Let's say it's already loaded and named `all_busstops`
-    all_busstops = pd.read_csv('data/all_busstops.csv')
+    all_busstops = pd.read_csv('data/all_busstops.csv', dtype={'BusStopCode': str})
     
     # Target coordinates
     
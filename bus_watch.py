@@ -0,0 +1,200 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set
+
+from telegram.error import BadRequest, RetryAfter, TelegramError
+
+from bus_tool import BusQueryTool
+from metrics import REGISTRY
+from prefetch import arrival_cache
+from singapore_data import LTADataMallBus
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_WATCHES = REGISTRY.gauge("bus_watches_active", "Active /watch subscriptions")
+WATCH_POLLS = REGISTRY.counter("bus_watch_polls_total", "DataMall polls made for watched stops", ["status"])
+
+ARRIVED = ("Arriving", "Arrived")
+
+
+@dataclass(eq=False)
+class Watch:
+    chat_id: int
+    message_id: int
+    bus_stop_code: str
+    service_no: Optional[str]
+    expires: float
+    last_text: str = field(default="")
+    # Don't edit the message before this time (flood control)
+    retry_at: float = 0.0
+
+
+class BusWatcher:
+    """
+    Shared-poll bus arrival subscriptions.
+
+    Every watched stop is polled once per interval no matter how many chats
+    watch it. Each subscriber's status message is edited in place with the
+    latest arrivals until their bus arrives or the watch times out. A new
+    subscriber to a stop that is already being polled is shown the stop's last
+    poll straight away rather than causing a poll of its own.
+    """
+
+    def __init__(self, interval: float = 30, timeout: float = 30 * 60, max_per_chat: int = 3):
+        self.interval = interval
+        self.timeout = timeout
+        self.max_per_chat = max_per_chat
+        self.watches: Dict[str, List[Watch]] = {}
+        # Services from each watched stop's last successful poll
+        self._latest: Dict[str, list] = {}
+        self._tool = None
+        self._client = None
+        self._bot = None
+        self._task: Optional[asyncio.Task] = None
+        self._refreshes: Set[asyncio.Task] = set()
+
+    def _ensure_started(self, bot) -> bool:
+        """Start the polling loop if it isn't running. Returns True if it was started."""
+        self._bot = bot
+        if self._task is not None and not self._task.done():
+            return False
+        self._task = asyncio.create_task(self._run())
+        return True
+
+    def _chat_watches(self, chat_id: int) -> List[Watch]:
+        return [w for watches in self.watches.values() for w in watches if w.chat_id == chat_id]
+
+    def _update_gauge(self):
+        ACTIVE_WATCHES.set(sum(len(watches) for watches in self.watches.values()))
+
+    async def add(self, bot, chat_id: int, bus_stop_code: str, service_no: Optional[str] = None) -> Optional[str]:
+        """Start watching a stop for a chat. Returns an error message if the watch can't be added."""
+        if len(self._chat_watches(chat_id)) >= self.max_per_chat:
+            return f"You already have {self.max_per_chat} watches running. Use /unwatch to stop them."
+        if self._tool is None:
+            self._tool = BusQueryTool()
+            self._client = LTADataMallBus()
+
+        target = f"bus {service_no}" if service_no else "buses"
+        text = f"👀 Watching {target} at stop {bus_stop_code}..."
+        message = await bot.send_message(chat_id, text)
+        watch = Watch(chat_id, message.message_id, bus_stop_code, service_no, time.time() + self.timeout, text)
+        self.watches.setdefault(bus_stop_code, []).append(watch)
+        self._update_gauge()
+        # A freshly started loop polls straight away. Otherwise show the stop's
+        # last poll, or poll a newly watched stop now rather than at the next interval
+        if not self._ensure_started(bot):
+            if bus_stop_code in self._latest:
+                await self._update(watch, self._latest[bus_stop_code], time.time())
+            elif len(self.watches[bus_stop_code]) == 1:
+                task = asyncio.create_task(self._poll_stop(bus_stop_code))
+                self._refreshes.add(task)
+                task.add_done_callback(self._refreshes.discard)
+        return None
+
+    def remove(self, chat_id: int) -> int:
+        """Stop all of a chat's watches. Returns how many were removed."""
+        removed = 0
+        for code in list(self.watches):
+            kept = [w for w in self.watches[code] if w.chat_id != chat_id]
+            removed += len(self.watches[code]) - len(kept)
+            if kept:
+                self.watches[code] = kept
+            else:
+                del self.watches[code]
+                self._latest.pop(code, None)
+        self._update_gauge()
+        return removed
+
+    async def _run(self):
+        while self.watches:
+            codes = list(self.watches)
+            results = await asyncio.gather(*(self._poll_stop(code) for code in codes), return_exceptions=True)
+            for code, result in zip(codes, results):
+                if isinstance(result, Exception):
+                    # Keep polling the other stops (and this one next time)
+                    logger.error(f"Failed to update watches for bus stop {code}: {result}")
+            await asyncio.sleep(self.interval)
+
+    async def _poll_stop(self, bus_stop_code: str):
+        if not self.watches.get(bus_stop_code):
+            return
+        try:
+            # Refreshing through the arrival cache also warms it for the bus tools
+            arrival = await asyncio.to_thread(arrival_cache.refresh, self._client, bus_stop_code)
+            services = arrival.get('Services', [])
+            WATCH_POLLS.inc(status="ok")
+        except Exception as e:
+            logger.warning(f"Failed to poll bus stop {bus_stop_code}: {e}")
+            WATCH_POLLS.inc(status="error")
+            # Watches still time out while DataMall is failing
+            now = time.time()
+            for watch in list(self.watches.get(bus_stop_code, [])):
+                if now >= watch.expires:
+                    await self._edit(watch, f"⏱️ Stopped watching stop {bus_stop_code} (timed out).")
+                    self._discard(watch)
+            return
+
+        now = time.time()
+        if bus_stop_code in self.watches:
+            self._latest[bus_stop_code] = services
+        for watch in list(self.watches.get(bus_stop_code, [])):
+            await self._update(watch, services, now)
+
+    async def _update(self, watch: Watch, services: list, now: float):
+        bus_info = LTADataMallBus.concise_services(services, watch.service_no)
+        text, done = self._render(watch, bus_info, now)
+        await self._edit(watch, text)
+        if done:
+            self._discard(watch)
+
+    def _render(self, watch: Watch, bus_info: List[tuple], now: float):
+        """Text for a watch's message, and whether the watch is finished."""
+        if not bus_info:
+            status = f"Bus {watch.service_no} isn't running at stop {watch.bus_stop_code} right now." if watch.service_no \
+                else "No bus services available at this stop."
+            return status, True
+
+        text = self._tool.format_arrivals(watch.bus_stop_code, bus_info)
+        if watch.service_no and self._tool.format_time(bus_info[0][1]) in ARRIVED:
+            return f"🚌 Bus {watch.service_no} is arriving at stop {watch.bus_stop_code} now!", True
+        if now >= watch.expires:
+            return text + "\n\n⏱️ Stopped watching (timed out).", True
+        return text + f"\n\nUpdated {time.strftime('%H:%M:%S')} · /unwatch to stop", False
+
+    async def _edit(self, watch: Watch, text: str):
+        if text == watch.last_text or time.time() < watch.retry_at:
+            return
+        try:
+            await self._bot.edit_message_text(text, chat_id=watch.chat_id, message_id=watch.message_id)
+            watch.last_text = text
+        except BadRequest as e:
+            # e.g. the message was deleted; drop the watch rather than retrying forever
+            logger.info(f"Dropping watch in chat {watch.chat_id}: {e}")
+            self._discard(watch)
+        except RetryAfter as e:
+            logger.warning(f"Flood control editing watch in chat {watch.chat_id}, skipping edits for {e.retry_after}s")
+            watch.retry_at = time.time() + e.retry_after
+        except TelegramError as e:
+            # Timeouts and network errors: skip this edit, the next poll tries again
+            logger.warning(f"Failed to edit watch in chat {watch.chat_id}: {e}")
+
+    def _discard(self, watch: Watch):
+        watches = self.watches.get(watch.bus_stop_code, [])
+        if watch in watches:
+            watches.remove(watch)
+        if not watches:
+            self.watches.pop(watch.bus_stop_code, None)
+            self._latest.pop(watch.bus_stop_code, None)
+        self._update_gauge()
+
+    async def stop(self):
+        for task in list(self._refreshes):
+            task.cancel()
+        await asyncio.gather(*self._refreshes, return_exceptions=True)
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
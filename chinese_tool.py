@@ -0,0 +1,212 @@
+import os
+import re
+from typing import Optional, Type
+
+from dotenv import load_dotenv
+from langchain.tools import BaseTool
+from langchain_core.messages import HumanMessage, SystemMessage
+from pydantic import BaseModel, Field
+from pypinyin import Style, lazy_pinyin, load_phrases_dict
+
+from metrics import REGISTRY
+from store import STATE_DB_PATH, SharedCache, connect
+
+load_dotenv()
+
+# Translations are memoized on disk, in the shared state database if there is one
+TRANSLATION_MEMO_PATH = os.getenv('TRANSLATION_MEMO_PATH', STATE_DB_PATH or 'data/translation_memo.db')
+
+MEMO_LOOKUPS = REGISTRY.counter("translation_memo_lookups_total", "Translation memo lookups", ["result"])
+FAST_PATH_ANSWERS = REGISTRY.counter("chinese_fast_path_total", "Chinese-teaching requests answered without an agent turn", ["kind"])
+
+EN_TO_ZH = "en-zh"
+ZH_TO_EN = "zh-en"
+
+_CHINESE_CHARS = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]")
+
+TRANSLATION_PROMPT = {
+    EN_TO_ZH: "Translate the user's English text into natural Simplified Chinese. Reply with the translation only.",
+    ZH_TO_EN: "Translate the user's Chinese text into natural English. Reply with the translation only.",
+}
+
+
+# pypinyin reads many everyday words with the citation tone of every syllable
+# (谢谢 "xiè xiè"); these are spoken, and taught, with a neutral last syllable
+NEUTRAL_TONE_WORDS = {
+    "谢谢": "xiè xie", "妈妈": "mā ma", "爸爸": "bà ba", "哥哥": "gē ge", "姐姐": "jiě jie",
+    "妹妹": "mèi mei", "爷爷": "yé ye", "奶奶": "nǎi nai", "叔叔": "shū shu", "宝宝": "bǎo bao",
+    "看看": "kàn kan", "试试": "shì shi", "想想": "xiǎng xiang",
+    "朋友": "péng you", "先生": "xiān sheng", "衣服": "yī fu", "时候": "shí hou", "名字": "míng zi",
+    "喜欢": "xǐ huan", "客气": "kè qi", "认识": "rèn shi", "舒服": "shū fu", "漂亮": "piào liang",
+    "明白": "míng bai", "清楚": "qīng chu", "告诉": "gào su", "休息": "xiū xi", "麻烦": "má fan",
+    "眼睛": "yǎn jing", "头发": "tóu fa", "事情": "shì qing", "地方": "dì fang", "关系": "guān xi",
+    "消息": "xiāo xi", "豆腐": "dòu fu", "耳朵": "ěr duo", "月亮": "yuè liang", "聪明": "cōng ming",
+    "商量": "shāng liang", "收拾": "shōu shi", "脑袋": "nǎo dai", "葡萄": "pú tao",
+}
+load_phrases_dict({word: [[syllable] for syllable in reading.split()] for word, reading in NEUTRAL_TONE_WORDS.items()})
+
+
+def contains_chinese(text: str) -> bool:
+    return bool(_CHINESE_CHARS.search(text))
+
+
+def to_pinyin(text: str) -> str:
+    """Pinyin with tone marks for the Chinese characters in text; everything else is kept as is."""
+    parts = []
+    for chunk in lazy_pinyin(text, style=Style.TONE, errors=lambda chars: [chars]):
+        chunk = chunk.strip()
+        if not chunk:
+            continue
+        if parts and re.fullmatch(r"[，。！？、；：,.!?;:]+", chunk):
+            parts[-1] += chunk
+        else:
+            parts.append(chunk)
+    return " ".join(parts)
+
+
+def normalize_phrase(phrase: str) -> str:
+    """Normalize a phrase for memo lookups, so trivially different phrasings share an entry."""
+    phrase = re.sub(r"\s+", " ", phrase.strip().strip("\"'“”‘’「」"))
+    phrase = phrase.rstrip("?!.。！？")
+    return phrase.lower() if not contains_chinese(phrase) else phrase
+
+
+def detect_direction(phrase: str) -> str:
+    return ZH_TO_EN if contains_chinese(phrase) else EN_TO_ZH
+
+
+class TranslationMemo:
+    """Persistent (phrase, direction) -> translation memo."""
+
+    def __init__(self, path: Optional[str] = None):
+        self._cache = SharedCache("translations", connect(path or TRANSLATION_MEMO_PATH))
+
+    @staticmethod
+    def _key(phrase: str, direction: str) -> str:
+        return f"{direction}:{normalize_phrase(phrase)}"
+
+    def get(self, phrase: str, direction: str) -> Optional[str]:
+        translation = self._cache.get(self._key(phrase, direction))
+        MEMO_LOOKUPS.inc(result="hit" if translation is not None else "miss")
+        return translation
+
+    def put(self, phrase: str, direction: str, translation: str):
+        self._cache.set(self._key(phrase, direction), translation)
+
+
+_memo = None
+_translator = None
+
+
+def get_memo() -> TranslationMemo:
+    global _memo
+    if _memo is None:
+        _memo = TranslationMemo()
+    return _memo
+
+
+def llm_translate(phrase: str, direction: str) -> str:
+    """Translate with gpt-4o-mini. Only called on memo misses."""
+    global _translator
+    if _translator is None:
+        from langchain_openai import ChatOpenAI
+        _translator = ChatOpenAI(model="gpt-4o-mini", temperature=0, api_key=os.environ.get("OPENAI_API_KEY"))
+    response = _translator.invoke([SystemMessage(content=TRANSLATION_PROMPT[direction]), HumanMessage(content=phrase)])
+    return response.content.strip()
+
+
+def format_lesson(phrase: str, translation: str, direction: str) -> str:
+    """Format a translation with pinyin for the Chinese side."""
+    phrase = phrase.strip()
+    chinese, english = (translation, phrase) if direction == EN_TO_ZH else (phrase, translation)
+    return f"English: {english}\nChinese: {chinese}\nPinyin: {to_pinyin(chinese)}"
+
+
+def translate(phrase: str, direction: Optional[str] = None, memo_only: bool = False) -> Optional[str]:
+    """
+    Translate a phrase between English and Chinese and return it formatted with pinyin.
+
+    Answers from the memo when possible. On a miss the LLM is called and the
+    result memoized, unless memo_only is set, in which case None is returned.
+    """
+    direction = direction or detect_direction(phrase)
+    memo = get_memo()
+    translation = memo.get(phrase, direction)
+    if translation is None:
+        if memo_only:
+            return None
+        translation = llm_translate(phrase, direction)
+        memo.put(phrase, direction, translation)
+    return format_lesson(phrase, translation, direction)
+
+
+_PINYIN_REQUEST = re.compile(r"^(?:what(?:'s| is) the )?pinyin(?: for| of)?\s*[:：]?\s*(.+)$", re.IGNORECASE)
+_TRANSLATION_REQUESTS = [
+    (re.compile(r"^how (?:do|would|can) (?:i|you|we) say (.+?) in (?:chinese|mandarin)\s*\??$", re.IGNORECASE), EN_TO_ZH),
+    (re.compile(r"^translate\s*[:：]?\s*(.+?)(?: (?:in|into|to) (?:chinese|mandarin))?\s*\??$", re.IGNORECASE), None),
+    (re.compile(r"^what does (.+?) mean(?: in english)?\s*\??$", re.IGNORECASE), ZH_TO_EN),
+]
+
+
+def quick_answer(message: str) -> Optional[str]:
+    """
+    Answer a Chinese-teaching request locally, without an LLM round trip.
+
+    Pinyin requests for Chinese text are always answered locally; translation
+    requests only when the phrase is already in the memo. Returns None if the
+    message should go to the agent.
+    """
+    message = message.strip()
+    match = _PINYIN_REQUEST.match(message)
+    if match and contains_chinese(match.group(1)):
+        FAST_PATH_ANSWERS.inc(kind="pinyin")
+        phrase = match.group(1).strip()
+        return f"{phrase}\nPinyin: {to_pinyin(phrase)}"
+
+    for pattern, direction in _TRANSLATION_REQUESTS:
+        match = pattern.match(message)
+        if not match:
+            continue
+        phrase = match.group(1)
+        direction = direction or detect_direction(phrase)
+        if (direction == ZH_TO_EN) != contains_chinese(phrase):
+            return None
+        answer = translate(phrase, direction, memo_only=True)
+        if answer is not None:
+            FAST_PATH_ANSWERS.inc(kind="translation")
+        return answer
+    return None
+
+
+class PinyinInput(BaseModel):
+    text: str = Field(description="Chinese text to romanize")
+
+
+class PinyinTool(BaseTool):
+    name: str = "chinese_pinyin"
+    description: str = "Get the pinyin (with tone marks) for Chinese text. Runs locally and instantly."
+    args_schema: Type[BaseModel] = PinyinInput
+
+    def _run(self, text: str) -> str:
+        if not contains_chinese(text):
+            return "No Chinese characters found in the text."
+        return to_pinyin(text)
+
+
+class ChineseTranslationInput(BaseModel):
+    phrase: str = Field(description="The English or Chinese phrase to translate")
+
+
+class ChineseTranslationTool(BaseTool):
+    name: str = "chinese_translation"
+    description: str = (
+        "Translate a phrase between English and Chinese. Returns the English, the Chinese and its pinyin. "
+        "Use this for every Chinese-teaching request instead of translating yourself."
+    )
+    args_schema: Type[BaseModel] = ChineseTranslationInput
+
+    def _run(self, phrase: str) -> str:
+        try:
+            return translate(phrase)
+        except Exception as e:
+            return f"Error translating phrase: {str(e)}"
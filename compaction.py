@@ -0,0 +1,207 @@
+import html
+import json
+import os
+import re
+import uuid
+from typing import Any, Optional, Type
+
+from dotenv import load_dotenv
+from langchain.tools import BaseTool
+from langchain_core.messages import AIMessage, ToolMessage
+from pydantic import BaseModel, Field
+
+from metrics import REGISTRY
+from store import get_cache
+
+load_dotenv()
+
+# Tool outputs longer than this (after cleanup) are truncated in the conversation
+TOOL_OUTPUT_MAX_CHARS = int(os.getenv('TOOL_OUTPUT_MAX_CHARS', '2000'))
+# How long full tool outputs stay fetchable by reference
+TOOL_OUTPUT_TTL_HOURS = float(os.getenv('TOOL_OUTPUT_TTL_HOURS', '168'))
+# Most full outputs kept in memory when there's no state database (oldest are dropped first)
+TOOL_OUTPUT_MAX_STORED = int(os.getenv('TOOL_OUTPUT_MAX_STORED', '500'))
+
+FETCH_TOOL_NAME = "fetch_tool_output"
+# Start of the note that replaces a fetched page once its turn is over
+RELEASED_NOTE_PREFIX = "[Fetched output"
+
+# Per-tool caps for the tools that return mail bodies, web pages and listings
+TOOL_CAPS = {
+    "search_gmail": 1500,
+    "get_gmail_message": 1500,
+    "get_gmail_thread": 1500,
+    "tavily_search_results_json": 1500,
+    "search_events": 2000,
+    "get_calendars_info": 1000,
+    "youtube_search": 1000,
+}
+
+# Outputs that must reach the model untouched: fetched payloads were asked for
+# explicitly (they are dropped once their turn is over, see
+# release_fetched_outputs), and sticker reactions are repeated verbatim
+EXEMPT_TOOLS = {FETCH_TOOL_NAME, "sticker_reaction"}
+
+COMPACTED = REGISTRY.counter("tool_outputs_compacted_total", "Tool outputs truncated before being fed back to the model", ["tool"])
+CHARS_SAVED = REGISTRY.counter("tool_output_chars_saved_total", "Characters of tool output kept out of the prompt", ["tool"])
+
+_TAGS = re.compile(r"<(script|style)\b.*?</\1\s*>|<!--.*?-->|<[^>]+>", re.IGNORECASE | re.DOTALL)
+# "On Mon, 3 Jun 2024 at 10:00, Someone <a@b.com> wrote:" and Outlook-style headers start the quoted history
+_QUOTE_HEADER = re.compile(r"^\s*(On .{0,200}wrote:|-{2,}\s*Original Message\s*-{2,}|From: .+)\s*$", re.IGNORECASE)
+
+
+def strip_html(text: str) -> str:
+    if "<" not in text and "&" not in text:
+        return text
+    text = _TAGS.sub(" ", text)
+    return html.unescape(text)
+
+
+def strip_quoted(text: str) -> str:
+    """Drop quoted email history: '>' lines and everything after a reply header."""
+    kept = []
+    for line in text.splitlines():
+        if _QUOTE_HEADER.match(line):
+            break
+        if line.lstrip().startswith(">"):
+            continue
+        kept.append(line)
+    return "\n".join(kept)
+
+
+def clean_text(text: str) -> str:
+    text = strip_quoted(strip_html(text))
+    text = re.sub(r"[ \t ]+", " ", text)
+    return re.sub(r"\n\s*\n+", "\n\n", text).strip()
+
+
+def _clean(value: Any) -> Any:
+    if isinstance(value, str):
+        return clean_text(value)
+    if isinstance(value, list):
+        return [_clean(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _clean(item) for key, item in value.items()}
+    return value
+
+
+def clean_output(content: str) -> str:
+    """Strip HTML and quoted text, field by field if the output is JSON."""
+    try:
+        parsed = json.loads(content)
+    except ValueError:
+        return clean_text(content)
+    if isinstance(parsed, (dict, list)):
+        return json.dumps(_clean(parsed), ensure_ascii=False, separators=(",", ":"))
+    return content
+
+
+def cap_for(tool_name: str) -> int:
+    return TOOL_CAPS.get(tool_name, TOOL_OUTPUT_MAX_CHARS)
+
+
+class ToolOutputStore:
+    """Full tool outputs kept out of the prompt, retrievable by reference."""
+
+    def __init__(self, ttl_hours: float = TOOL_OUTPUT_TTL_HOURS, max_stored: int = TOOL_OUTPUT_MAX_STORED):
+        self.ttl = ttl_hours * 3600
+        self._cache = get_cache("tool_outputs", max_entries=max_stored)
+
+    def put(self, content: str) -> str:
+        ref = uuid.uuid4().hex[:12]
+        self._cache.set(ref, content, ttl=self.ttl)
+        return ref
+
+    def get(self, ref: str) -> Optional[str]:
+        return self._cache.get(ref)
+
+
+output_store = ToolOutputStore()
+
+
+def compact(content: str, tool_name: str) -> str:
+    """
+    The version of a tool output that goes into the conversation.
+
+    Outputs are cleaned, and if still over the tool's cap, truncated with a
+    reference to the full output, which is kept in the output store.
+    """
+    if tool_name in EXEMPT_TOOLS:
+        return content
+    cleaned = clean_output(content)
+    cap = cap_for(tool_name)
+    if len(cleaned) <= cap:
+        return cleaned
+
+    ref = output_store.put(content)
+    COMPACTED.inc(tool=tool_name)
+    CHARS_SAVED.inc(len(content) - cap, tool=tool_name)
+    return (
+        f"{cleaned[:cap]}\n\n[Output truncated: showing {cap} of {len(cleaned)} characters. "
+        f"Call {FETCH_TOOL_NAME} with ref=\"{ref}\" to read the full output.]"
+    )
+
+
+def compact_tool_outputs(state):
+    """
+    Graph node run after the tools: replaces this step's tool messages with
+    compacted versions, so the full payloads aren't resent on every later turn.
+    """
+    compacted = []
+    for message in reversed(state["messages"]):
+        if isinstance(message, AIMessage):
+            break
+        if not isinstance(message, ToolMessage) or not isinstance(message.content, str):
+            continue
+        content = compact(message.content, message.name)
+        if content != message.content:
+            # Same id, so add_messages replaces the original in the state
+            compacted.append(message.model_copy(update={"content": content}))
+    return {"messages": compacted[::-1]}
+
+
+def release_fetched_outputs(state):
+    """
+    Graph node run at the start of each turn: replaces pages read with
+    fetch_tool_output in earlier turns with a short note, since the model has
+    already used them and they'd otherwise be resent on every later turn.
+    """
+    fetch_args = {}
+    released = []
+    for message in state["messages"]:
+        if isinstance(message, AIMessage):
+            for call in message.tool_calls:
+                if call["name"] == FETCH_TOOL_NAME:
+                    fetch_args[call["id"]] = call["args"]
+        elif isinstance(message, ToolMessage) and message.name == FETCH_TOOL_NAME \
+                and not str(message.content).startswith(RELEASED_NOTE_PREFIX):
+            args = fetch_args.get(message.tool_call_id, {})
+            note = (f"{RELEASED_NOTE_PREFIX} ref=\"{args.get('ref', '')}\" offset={args.get('offset', 0)} "
+                    f"was removed after use. Call {FETCH_TOOL_NAME} again if you need it.]")
+            released.append(message.model_copy(update={"content": note}))
+    return {"messages": released}
+
+
+class FetchToolOutputInput(BaseModel):
+    ref: str = Field(description="The ref from a truncated tool output")
+    offset: int = Field(default=0, description="Character offset to start reading from")
+
+
+class FetchToolOutputTool(BaseTool):
+    name: str = FETCH_TOOL_NAME
+    description: str = (
+        "Read the full text of a tool output that was truncated. "
+        "Pass the ref given in the truncation note, and an offset to continue reading a long output."
+    )
+    args_schema: Type[BaseModel] = FetchToolOutputInput
+    page_size: int = 8000
+
+    def _run(self, ref: str, offset: int = 0) -> str:
+        content = output_store.get(ref.strip().strip('"'))
+        if content is None:
+            return f"No stored output found for ref {ref}. It may have expired; call the original tool again."
+        page = content[offset:offset + self.page_size]
+        end = offset + len(page)
+        if end < len(content):
+            page += f"\n\n[Showing characters {offset}-{end} of {len(content)}. Call again with offset={end} for more.]"
+        return page
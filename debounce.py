@@ -0,0 +1,110 @@
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+from metrics import REGISTRY
+from update_processor import ChatLock
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = REGISTRY.histogram("coalesced_batch_size", "Messages merged into each agent turn", buckets=(1, 2, 3, 4, 6, 10))
+MERGED = REGISTRY.counter("messages_merged_total", "Messages folded into another message's agent turn")
+
+
+@dataclass
+class PendingMessage:
+    update: Any
+    text: str
+    context: Optional[str] = None
+    sender: Any = None
+    # Called once the batch holding the message has been answered
+    done: Optional[Callable[[], None]] = None
+
+
+def merge(batch: List[PendingMessage]):
+    """Combine a batch into one message and one reply context, preserving order."""
+    text = "\n".join(item.text for item in batch if item.text)
+    contexts = []
+    for item in batch:
+        if item.context and item.context not in contexts:
+            contexts.append(item.context)
+    return text, "\n".join(contexts) or None
+
+
+class MessageCoalescer:
+    """
+    Per-chat debounce window for incoming messages.
+
+    Each message restarts its chat's window. When a chat has been quiet for
+    `window` seconds, everything it sent is handed to `flush` as a single batch.
+    Batches for the same chat are flushed one at a time, in order; flush_now()
+    lets other updates for the chat (e.g. stickers) wait their turn.
+    """
+
+    def __init__(self, window: float, flush: Callable[[Any, List[PendingMessage]], Awaitable[None]]):
+        self.window = window
+        self.flush = flush
+        self._pending: Dict[Any, List[PendingMessage]] = {}
+        self._timers: Dict[Any, asyncio.Task] = {}
+        self._locks: Dict[Any, ChatLock] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    def is_open(self, chat_id, sender) -> bool:
+        """Whether the chat has a window open that `sender` started or added to."""
+        return any(item.sender == sender for item in self._pending.get(chat_id, []))
+
+    def add(self, chat_id, item: PendingMessage):
+        """Buffer a message and (re)start the chat's debounce window."""
+        self._pending.setdefault(chat_id, []).append(item)
+        timer = self._timers.get(chat_id)
+        if timer is not None:
+            timer.cancel()
+        task = asyncio.create_task(self._wait_and_flush(chat_id))
+        self._timers[chat_id] = task
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _wait_and_flush(self, chat_id):
+        await asyncio.sleep(self.window)
+        # Past this point a newer message must not cancel the flush
+        self._timers.pop(chat_id, None)
+        await self._flush(chat_id)
+
+    async def flush_now(self, chat_id):
+        """Answer the chat's buffered messages now, and wait until every earlier batch has been answered."""
+        timer = self._timers.pop(chat_id, None)
+        if timer is not None:
+            timer.cancel()
+        await self._flush(chat_id)
+
+    async def _flush(self, chat_id):
+        chat_lock = self._locks.get(chat_id)
+        if chat_lock is None:
+            chat_lock = self._locks[chat_id] = ChatLock()
+        chat_lock.users += 1
+        try:
+            async with chat_lock.lock:
+                batch = self._pending.pop(chat_id, [])
+                if not batch:
+                    return
+                BATCH_SIZE.observe(len(batch))
+                MERGED.inc(len(batch) - 1)
+                if len(batch) > 1:
+                    logger.info(f"Merged {len(batch)} messages from chat {chat_id} into one turn")
+                try:
+                    await self.flush(chat_id, batch)
+                except Exception as e:
+                    logger.error(f"Error handling messages from chat {chat_id}: {e}")
+                for item in batch:
+                    if item.done:
+                        item.done()
+        finally:
+            chat_lock.users -= 1
+            if not chat_lock.users:
+                del self._locks[chat_id]
+
+    async def drain(self):
+        """Wait for all pending windows and flushes to finish."""
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
@@ -0,0 +1,419 @@
+import asyncio
+import itertools
+import json
+import os
+import random
+import re
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from telegram.request import BaseRequest
+
+# Offline stand-ins for the services the bot talks to (OpenAI, LTA DataMall,
+# Google, Telegram). Used by the benchmark suite and the replay harness so
+# they can run without network access or credentials.
+
+SGT = timezone(timedelta(hours=8))
+
+BUS_STOP_COLUMNS = ['BusStopCode', 'RoadName', 'Description', 'Latitude', 'Longitude']
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token)."""
+    return max(1, len(text) // 4)
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Deterministic chat model that mimics the tool-calling behaviour of gpt-4o-mini.
+
+    If the latest human message contains a 5-digit bus stop code and the
+    bus_arrival_query tool is bound, the model calls it, and likewise
+    sticker_reaction for a saved sticker. Once a tool result
+    comes back it replies with a short summary. Token usage is estimated from
+    the prompt so instrumentation downstream sees realistic numbers.
+    """
+    latency: float = 0.0
+    reply: str = "Here you go!"
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat-model"
+
+    def bind_tools(self, tools, **kwargs):
+        return self.bind(tools=[convert_to_openai_tool(tool) for tool in tools], **kwargs)
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        if self.latency:
+            time.sleep(self.latency)
+
+        tool_names = [tool["function"]["name"] for tool in kwargs.get("tools", [])]
+        prompt = "".join(str(m.content) for m in messages) + json.dumps(kwargs.get("tools", []))
+        # Per-turn context comes after the conversation; answer the latest message
+        last = next(m for m in reversed(messages) if not isinstance(m, SystemMessage))
+
+        tool_calls = []
+        if isinstance(last, ToolMessage):
+            content = f"{self.reply}\n{last.content[:200]}"
+        else:
+            content = self.reply
+            text = str(last.content) if isinstance(last, HumanMessage) else ""
+            sticker = re.search(r"Saved in (\S+)", text)
+            match = re.search(r"\b(\d{5})\b", text)
+            if sticker and "sticker_reaction" in tool_names:
+                tool_calls = [self._tool_call("sticker_reaction", image_path=sticker.group(1))]
+            elif match and "bus_arrival_query" in tool_names:
+                tool_calls = [self._tool_call("bus_arrival_query", bus_stop_code=match.group(1))]
+            if tool_calls:
+                content = ""
+
+        input_tokens = estimate_tokens(prompt)
+        output_tokens = estimate_tokens(content or json.dumps(tool_calls))
+        message = AIMessage(
+            content=content,
+            tool_calls=tool_calls,
+            usage_metadata={
+                "input_tokens": input_tokens,
+                "output_tokens": output_tokens,
+                "total_tokens": input_tokens + output_tokens,
+            },
+        )
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    @staticmethod
+    def _tool_call(name: str, **args) -> dict:
+        return {"name": name, "args": args, "id": f"call_{random.getrandbits(48):012x}"}
+
+
+def fake_photo_description(image_path: str) -> str:
+    """Stand-in for the vision model: echoes the image file's contents, so a reply shows which file was read."""
+    with open(image_path, "rb") as f:
+        return f"<IMAGE DESCRIPTION>: {f.read().decode(errors='replace')}"
+
+
+class _FakeLTAHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency)
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        server.request_count += 1
+
+        if url.path.endswith("/BusArrivalv2"):
+            code = params.get("BusStopCode", [""])[0]
+            body = {"BusStopCode": code, "Services": fake_bus_services(code, server.services_per_stop)}
+        elif url.path.endswith("/BusStops"):
+            skip = int(params.get("$skip", ["0"])[0])
+            body = {"value": server.bus_stops[skip:skip + 500]}
+        else:
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        payload = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def fake_bus_services(bus_stop_code: str, count: int = 6) -> List[dict]:
+    """Build a BusArrivalv2-shaped list of services with arrivals in the near future."""
+    now = datetime.now(SGT)
+    services = []
+    for i in range(count):
+        next_buses = {}
+        for j, key in enumerate(["NextBus", "NextBus2", "NextBus3"]):
+            eta = now + timedelta(minutes=2 + i + j * 8)
+            next_buses[key] = {
+                "OriginCode": bus_stop_code,
+                "DestinationCode": "10009",
+                "EstimatedArrival": eta.isoformat(timespec="seconds"),
+                "Latitude": "1.3",
+                "Longitude": "103.8",
+                "VisitNumber": "1",
+                "Load": ["SEA", "SDA", "LSD"][(i + j) % 3],
+                "Feature": "WAB",
+                "Type": ["SD", "DD", "BD"][i % 3],
+            }
+        services.append({"ServiceNo": str(10 + i * 7), "Operator": "SBST", **next_buses})
+    return services
+
+
+class FakeLTAServer:
+    """Local HTTP server that speaks enough of the LTA DataMall API for the bus tools."""
+
+    def __init__(self, latency: float = 0.0, services_per_stop: int = 6, bus_stops: Optional[List[dict]] = None):
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), _FakeLTAHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.latency = latency
+        self._httpd.services_per_stop = services_per_stop
+        self._httpd.bus_stops = bus_stops or []
+        self._httpd.request_count = 0
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address
+        return f"http://{host}:{port}/ltaodataservice"
+
+    @property
+    def request_count(self) -> int:
+        return self._httpd.request_count
+
+    def start(self) -> "FakeLTAServer":
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def cached_prefix_tokens(prompt: str, previous: str) -> int:
+    """Tokens of `prompt` a provider prompt cache could serve after seeing `previous`."""
+    shared = len(os.path.commonprefix([prompt, previous]))
+    tokens = estimate_tokens(prompt[:shared]) // 128 * 128
+    return tokens if tokens >= 1024 else 0
+
+
+class _FakeOpenAIHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        # The cacheable part of the request, in the order the provider caches it
+        prompt = json.dumps([body.get("tools", []), body.get("messages", [])])
+        with server.lock:
+            cached = max((cached_prefix_tokens(prompt, previous) for previous in server.prompts), default=0)
+            server.prompts.append(prompt)
+            server.requests.append(body)
+            delay = server.delays.pop(0) if server.delays else server.latency
+            status = server.statuses.pop(0) if server.statuses else 200
+        if delay:
+            time.sleep(delay)
+
+        if status != 200:
+            payload = json.dumps({"error": {"message": "injected failure", "type": "server_error"}}).encode()
+        else:
+            content = server.reply
+            prompt_tokens = estimate_tokens(prompt)
+            payload = json.dumps({
+                "id": f"chatcmpl-{random.getrandbits(48):012x}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model", "fake"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": estimate_tokens(content),
+                          "total_tokens": prompt_tokens + estimate_tokens(content),
+                          "prompt_tokens_details": {"cached_tokens": cached}},
+            }).encode()
+        try:
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client gave up on this request
+            pass
+
+
+class FakeOpenAIServer:
+    """
+    Local OpenAI-compatible chat completions server with injectable delays and failures.
+
+    Reports cached prompt tokens like OpenAI's prompt cache would: the longest
+    prefix shared with an earlier request, from 1024 tokens in 128 token steps.
+
+    Each request takes the next entry of `delays` (seconds) and `statuses`
+    (HTTP status) if any are queued, otherwise `latency` and 200. Replies
+    with `reply`, so tests can tell servers apart.
+    """
+
+    def __init__(self, reply: str = "Hello from the fake model", latency: float = 0.0):
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), _FakeOpenAIHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.reply = reply
+        self._httpd.latency = latency
+        self._httpd.delays = []
+        self._httpd.statuses = []
+        self._httpd.requests = []
+        self._httpd.prompts = []
+        self._httpd.lock = threading.Lock()
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address
+        return f"http://{host}:{port}/v1"
+
+    @property
+    def requests(self) -> List[dict]:
+        return self._httpd.requests
+
+    def inject(self, delays: Optional[List[float]] = None, statuses: Optional[List[int]] = None):
+        """Queue delays and/or HTTP statuses for the next requests."""
+        with self._httpd.lock:
+            self._httpd.delays.extend(delays or [])
+            self._httpd.statuses.extend(statuses or [])
+
+    def start(self) -> "FakeOpenAIServer":
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class FakeTelegramRequest(BaseRequest):
+    """
+    In-process stand-in for the Telegram Bot API, plugged into a Bot as its request object.
+
+    Answers the methods the bot uses and records every outgoing message in
+    `sent` (with a perf_counter timestamp). Downloaded files contain
+    "file:<file_id>", so it's visible which file a reply was based on.
+    """
+
+    def __init__(self, latency: float = 0.0, username: str = "replay_bot"):
+        self.latency = latency
+        self.username = username
+        self.sent: List[dict] = []
+        self._message_ids = itertools.count(1)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def _message(self, params: dict) -> dict:
+        chat_id = int(params.get("chat_id", 0))
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "group"},
+            "text": params.get("text", ""),
+        }
+
+    async def do_request(self, url: str, method: str, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if "/file/bot" in url:
+            return 200, f"file:{url.rsplit('/', 1)[-1].split('.')[0]}".encode()
+
+        endpoint = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+        if endpoint == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Gianna", "username": self.username}
+        elif endpoint == "getFile":
+            result = {"file_id": params["file_id"], "file_unique_id": params["file_id"],
+                      "file_path": f"stickers/{params['file_id']}.webp"}
+        elif endpoint in ("sendMessage", "sendVoice", "sendPhoto", "sendDocument", "editMessageText"):
+            self.sent.append({"method": endpoint, "time": time.perf_counter(), **params})
+            result = self._message(params)
+        elif endpoint == "getUpdates":
+            result = []
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+def fake_bus_stops(count: int = 5000, seed: int = 0) -> List[dict]:
+    """Generate bus stops spread over Singapore's bounding box, shaped like all_busstops.csv rows."""
+    rng = random.Random(seed)
+    roads = ["Orchard Rd", "Bukit Timah Rd", "Thomson Rd", "Balestier Rd", "Serangoon Rd",
+             "Ang Mo Kio Ave 3", "Clementi Ave 2", "Tampines Ave 4", "Jurong West St 41", "Bedok North Rd"]
+    landmarks = ["Blk", "Opp Blk", "Bef", "Aft", "Stn", "Sch", "Ch", "Condo", "Mall", "Int"]
+    stops = []
+    for i in range(count):
+        road = rng.choice(roads)
+        stops.append({
+            "BusStopCode": f"{10000 + i * 17 % 89999:05d}",
+            "RoadName": road,
+            "Description": f"{rng.choice(landmarks)} {rng.randint(1, 999)}",
+            "Latitude": round(rng.uniform(1.24, 1.46), 6),
+            "Longitude": round(rng.uniform(103.62, 104.0), 6),
+        })
+    return stops
+
+
+def write_fake_data(workdir: str, bus_stops: List[dict]):
+    """Write the data files agent.py and bus_tool.py read from the working directory."""
+    os.makedirs(os.path.join(workdir, "data"), exist_ok=True)
+    with open(os.path.join(workdir, "data", "all_busstops.csv"), "w") as f:
+        f.write(",".join(BUS_STOP_COLUMNS) + "\n")
+        for stop in bus_stops:
+            f.write(",".join(str(stop[c]) for c in BUS_STOP_COLUMNS) + "\n")
+    mapping = {f"{stop['Description']} ({stop['RoadName']})": stop["BusStopCode"] for stop in bus_stops[:10]}
+    with open(os.path.join(workdir, "busstop_mapping.json"), "w") as f:
+        json.dump(mapping, f)
+
+
+def install_google_fakes():
+    """
+    Make the Google toolkits build without credentials or network.
+
+    Must be called before agent.py is imported. Resources are built from the
+    discovery documents bundled with googleapiclient and every request they
+    make returns an empty listing.
+    """
+    from googleapiclient.discovery import build
+    from googleapiclient.http import HttpMock
+    from langchain_google_community.calendar import utils as calendar_utils
+    from langchain_google_community.gmail import utils as gmail_utils
+
+    class FakeGoogleHttp(HttpMock):
+        def request(self, uri, method="GET", body=None, headers=None, redirections=1, connection_type=None):
+            self.uri, self.method, self.body, self.headers = uri, method, body, headers
+            return {"status": "200"}, b'{"items": [], "messages": []}'
+
+    def fake_builder(service_name, service_version, credentials=None):
+        return build(service_name, service_version, http=FakeGoogleHttp(), static_discovery=True)
+
+    def fake_build_resource_service(credentials=None, service_name="gmail", service_version="v1"):
+        return fake_builder(service_name, service_version)
+
+    calendar_utils.get_google_credentials = lambda *args, **kwargs: None
+    calendar_utils.import_googleapiclient_resource_builder = lambda: fake_builder
+    gmail_utils.build_resource_service = fake_build_resource_service
+
+
+def install_fakes(workdir: str, lta_url: str):
+    """Point every external dependency of agent.py at local fakes. Call before importing agent."""
+    os.environ["OPENAI_API_KEY"] = "sk-fake"
+    os.environ["TAVILY_API_KEY"] = "tvly-fake"
+    os.environ["LTA_API_KEY"] = "fake"
+    os.environ["LTA_BASE_URL"] = lta_url
+    os.chdir(workdir)
+    install_google_fakes()
@@ -0,0 +1,199 @@
+import difflib
+import math
+import re
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set
+
+import pandas as pd
+
+from metrics import REGISTRY
+
+BUS_STOPS_PATH = 'data/all_busstops.csv'
+
+GEOCODES = REGISTRY.counter("geocoder_lookups_total", "Place name lookups against the bus stop index", ["result"])
+
+# Words people type mapped to the abbreviations LTA uses in stop descriptions and road names
+ABBREVIATIONS = {
+    "station": "stn", "mrt": "stn", "lrt": "stn", "interchange": "int", "terminal": "int",
+    "block": "blk", "opposite": "opp", "before": "bef", "after": "aft",
+    "road": "rd", "avenue": "ave", "street": "st", "drive": "dr", "crescent": "cres", "lorong": "lor",
+    "jalan": "jln", "bukit": "bt", "upper": "upp", "north": "nth", "south": "sth", "central": "ctrl",
+    "centre": "ctr", "center": "ctr", "park": "pk", "school": "sch", "primary": "pr", "secondary": "sec",
+    "church": "ch", "hospital": "hosp", "building": "bldg", "tower": "twr", "market": "mkt",
+    "condominium": "condo", "junction": "jct", "place": "pl", "square": "sq", "temple": "tp",
+    "mount": "mt", "saint": "st", "industrial": "ind", "estate": "est", "garden": "gdn", "gardens": "gdns",
+}
+
+# Tokens that say where a stop is relative to a place, or are filler in a question
+IGNORED_TOKENS = {"opp", "bef", "aft", "the", "near", "nearest", "at", "to", "bus", "stop", "stops", "by", "of", "in"}
+
+# Ambiguity thresholds: a match below CONFIDENT_SCORE, or a runner-up at a
+# different spot within RUNNER_UP_MARGIN, means the caller should choose
+CONFIDENT_SCORE = 0.85
+RUNNER_UP_MARGIN = 0.05
+DISTINCT_KM = 0.5
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase tokens with common words abbreviated the way LTA does, and filler removed."""
+    tokens = re.findall(r"[a-z0-9]+", text.lower().replace("'", ""))
+    tokens = [ABBREVIATIONS.get(token, token) for token in tokens]
+    return [token for token in tokens if token not in IGNORED_TOKENS]
+
+
+def distance_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * 6371 * math.asin(math.sqrt(a))
+
+
+@dataclass
+class Place:
+    """A named place: the bus stops sharing a landmark, or all stops on a road."""
+    name: str
+    road: Optional[str]
+    tokens: List[str]
+    stop_codes: List[str] = field(default_factory=list)
+    latitudes: List[float] = field(default_factory=list)
+    longitudes: List[float] = field(default_factory=list)
+
+    @property
+    def keys(self) -> List[str]:
+        key = " ".join(self.tokens)
+        return [key, f"{key} {' '.join(tokenize(self.road))}"] if self.road else [key]
+
+    @property
+    def latitude(self) -> float:
+        return sum(self.latitudes) / len(self.latitudes)
+
+    @property
+    def longitude(self) -> float:
+        return sum(self.longitudes) / len(self.longitudes)
+
+
+@dataclass
+class Candidate:
+    place: Place
+    score: float
+
+
+class PlaceIndex:
+    """
+    Offline place name index built from the bus stop dataset.
+
+    Stops are grouped into places by their description ("Bishan Int", "Opp
+    Ngee Ann City" and "Ngee Ann City" are one place, per road) and by road
+    name. Lookups match query tokens fuzzily against the index vocabulary with
+    difflib, then rank the places containing them.
+    """
+
+    def __init__(self, stops: pd.DataFrame):
+        places: Dict[tuple, Place] = {}
+        for row in stops.itertuples(index=False):
+            description, road = str(row.Description), str(row.RoadName)
+            code = f"{int(row.BusStopCode):05d}" if str(row.BusStopCode).isdigit() else str(row.BusStopCode)
+            landmark = tokenize(description)
+            road_tokens = tokenize(road)
+            keys = [(tuple(road_tokens), None, road)]
+            if landmark:
+                keys.append((tuple(landmark), tuple(road_tokens), description))
+            for key_tokens, road_key, name in keys:
+                place = places.get((key_tokens, road_key))
+                if place is None:
+                    name = re.sub(r"^(opp|bef|aft)\s+", "", name, flags=re.IGNORECASE)
+                    place = places[(key_tokens, road_key)] = Place(name, road if road_key else None, list(key_tokens))
+                place.stop_codes.append(code)
+                place.latitudes.append(float(row.Latitude))
+                place.longitudes.append(float(row.Longitude))
+
+        self.places = list(places.values())
+        # Places by the tokens of their own name, and landmarks by their road's tokens
+        self._by_token: Dict[str, Set[int]] = defaultdict(set)
+        self._by_road_token: Dict[str, Set[int]] = defaultdict(set)
+        for index, place in enumerate(self.places):
+            for token in place.tokens:
+                self._by_token[token].add(index)
+            if place.road:
+                for token in tokenize(place.road):
+                    self._by_road_token[token].add(index)
+        self._vocabulary = list(self._by_token.keys() | self._by_road_token.keys())
+
+    @classmethod
+    def from_csv(cls, path: str = BUS_STOPS_PATH) -> "PlaceIndex":
+        return cls(pd.read_csv(path, dtype={"BusStopCode": str}))
+
+    def _token_matches(self, token: str) -> Dict[str, float]:
+        """Index tokens similar to a query token, with their similarity."""
+        if token in self._by_token or token in self._by_road_token:
+            return {token: 1.0}
+        if token.isdigit():
+            # Block and exit numbers must match exactly
+            return {}
+        close = difflib.get_close_matches(token, self._vocabulary, n=5, cutoff=0.75)
+        return {match: difflib.SequenceMatcher(None, token, match).ratio() for match in close}
+
+    def search(self, query: str, limit: int = 5) -> List[Candidate]:
+        """Places matching a query, best first."""
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+
+        matches = [self._token_matches(token) for token in tokens]
+        # A landmark is only a candidate if the query names it, not just its road
+        named = {index for token_matches in matches for match in token_matches for index in self._by_token[match]}
+        scores: Dict[int, float] = defaultdict(float)
+        for token_matches in matches:
+            best: Dict[int, float] = {}
+            for match, similarity in token_matches.items():
+                for index in (self._by_token[match] | self._by_road_token[match]) & named:
+                    best[index] = max(best.get(index, 0.0), similarity)
+            for index, similarity in best.items():
+                scores[index] += similarity / len(tokens)
+
+        query_key = " ".join(tokens)
+        candidates = []
+        for index, coverage in scores.items():
+            place = self.places[index]
+            # How much of the place's own name (with or without its road) the query accounts for
+            shape = max(difflib.SequenceMatcher(None, query_key, key).ratio() for key in place.keys)
+            score = 0.6 * coverage + 0.4 * shape
+            if place.road is None:
+                # A whole road is a weaker answer than a specific landmark on it
+                score *= 0.9
+            candidates.append(Candidate(place, round(score, 3)))
+
+        candidates.sort(key=lambda candidate: (-candidate.score, len(candidate.place.tokens)))
+        return candidates[:limit]
+
+    def geocode(self, query: str, limit: int = 5):
+        """
+        Resolve a place name to (best, candidates).
+
+        best is the top Candidate when the match is confident and unambiguous,
+        otherwise None; candidates are the ranked matches either way.
+        """
+        candidates = self.search(query, limit)
+        if not candidates:
+            GEOCODES.inc(result="miss")
+            return None, []
+
+        top = candidates[0]
+        rivals = [c for c in candidates[1:] if top.score - c.score <= RUNNER_UP_MARGIN and distance_km(
+            top.place.latitude, top.place.longitude, c.place.latitude, c.place.longitude) > DISTINCT_KM]
+        if top.score >= CONFIDENT_SCORE and not rivals:
+            GEOCODES.inc(result="match")
+            return top, candidates
+        GEOCODES.inc(result="ambiguous")
+        return None, candidates
+
+
+_index = None
+
+
+def get_index() -> PlaceIndex:
+    """The place index for data/all_busstops.csv, built on first use."""
+    global _index
+    if _index is None:
+        _index = PlaceIndex.from_csv()
+    return _index
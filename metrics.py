@@ -0,0 +1,314 @@
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Sequence, Tuple
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets in seconds, from a fast tool call up to a slow multi-tool turn
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+TOKEN_BUCKETS = (50, 100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000)
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _format_labels(self, key: Tuple[str, ...], extra: Optional[Tuple[str, str]] = None) -> str:
+        pairs = list(zip(self.labelnames, key))
+        if extra:
+            pairs.append(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        with self._lock:
+            return [f"{self.name}{self._format_labels(k)} {v}" for k, v in self._values.items()]
+
+
+class Gauge(Counter):
+    type_name = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def count(self, **labels) -> int:
+        counts, _ = self._values.get(self._key(labels), ([0], 0.0))
+        return sum(counts)
+
+    def sum(self, **labels) -> float:
+        return self._values.get(self._key(labels), ([0], 0.0))[1]
+
+    def _samples(self):
+        lines = []
+        with self._lock:
+            for key, (counts, total) in self._values.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{self.name}_bucket{self._format_labels(key, ('le', le))} {cumulative}")
+                lines.append(f"{self.name}_sum{self._format_labels(key)} {total}")
+                lines.append(f"{self.name}_count{self._format_labels(key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, *args, **kwargs):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = cls(name, *args, **kwargs)
+            return self._metrics[name]
+
+    def counter(self, name, help, labelnames=()) -> Counter:
+        return self._get_or_create(Counter, name, help, labelnames)
+
+    def gauge(self, name, help, labelnames=()) -> Gauge:
+        return self._get_or_create(Gauge, name, help, labelnames)
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, help, labelnames, buckets)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+REGISTRY = Registry()
+STARTED = time.monotonic()
+
+TURN_SECONDS = REGISTRY.histogram("agent_turn_seconds", "End-to-end get_agent_response latency, by route (agent or fast_path)", ["route"])
+NODE_SECONDS = REGISTRY.histogram("graph_node_seconds", "Time spent in each graph node", ["node"])
+LLM_SECONDS = REGISTRY.histogram("llm_request_seconds", "Chat model request latency", ["model"])
+PROMPT_TOKENS = REGISTRY.histogram("llm_prompt_tokens", "Prompt tokens per chat model request", ["model"], TOKEN_BUCKETS)
+COMPLETION_TOKENS = REGISTRY.histogram("llm_completion_tokens", "Completion tokens per chat model request", ["model"], TOKEN_BUCKETS)
+CACHED_TOKENS = REGISTRY.histogram("llm_cached_prompt_tokens", "Prompt tokens served from the provider's prompt cache", ["model"], TOKEN_BUCKETS)
+TOOL_SECONDS = REGISTRY.histogram("tool_duration_seconds", "Tool execution time", ["tool"])
+TOOL_CALLS = REGISTRY.counter("tool_calls_total", "Tool calls by outcome", ["tool", "status"])
+QUEUE_WAIT_SECONDS = REGISTRY.histogram("update_queue_wait_seconds", "Time an authorized message waits in the bot (behind its chat's earlier updates) before handle_message starts")
+TELEGRAM_SEND_SECONDS = REGISTRY.histogram("telegram_send_seconds", "Time to send a reply to Telegram", ["method"])
+
+
+def log_event(event: str, **fields):
+    """Emit a structured (JSON) log line."""
+    logger.info(json.dumps({"event": event, **fields}, default=str))
+
+
+class TurnTracer(BaseCallbackHandler):
+    """
+    Callback handler that traces a single agent turn.
+
+    Records LLM latency and token usage (including prompt cache hits), tool durations and outcomes, and graph
+    node durations into the registry, and keeps per-turn totals for the
+    structured turn log. `route` is "fast_path" for turns answered without
+    the graph.
+    """
+
+    def __init__(self, chat_id: str, route: str = "agent"):
+        self.chat_id = chat_id
+        self.route = route
+        self.started = time.perf_counter()
+        self.llm_calls = 0
+        self.llm_seconds = 0.0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_tokens = 0
+        self.tool_calls = []
+        self._runs: Dict[UUID, Tuple[str, str, float]] = {}
+        self._lock = threading.Lock()
+
+    def _start(self, run_id: UUID, kind: str, name: str):
+        with self._lock:
+            self._runs[run_id] = (kind, name, time.perf_counter())
+
+    def _finish(self, run_id: UUID):
+        with self._lock:
+            kind, name, started = self._runs.pop(run_id, (None, None, None))
+        if kind is None:
+            return None, None, 0.0
+        return kind, name, time.perf_counter() - started
+
+    def on_chain_start(self, serialized, inputs, *, run_id, metadata=None, **kwargs):
+        node = (metadata or {}).get("langgraph_node")
+        if node and kwargs.get("name") == node:
+            self._start(run_id, "node", node)
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        kind, name, elapsed = self._finish(run_id)
+        if kind == "node":
+            NODE_SECONDS.observe(elapsed, node=name)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self.on_chain_end(None, run_id=run_id)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs):
+        model = (metadata or {}).get("ls_model_name") or (serialized or {}).get("id", ["unknown"])[-1]
+        self._start(run_id, "llm", model)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        kind, model, elapsed = self._finish(run_id)
+        if kind != "llm":
+            return
+        LLM_SECONDS.observe(elapsed, model=model)
+        usage = {}
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, "message", None)
+                if message is not None and getattr(message, "usage_metadata", None):
+                    usage = message.usage_metadata
+        prompt_tokens = usage.get("input_tokens", 0)
+        completion_tokens = usage.get("output_tokens", 0)
+        cached_tokens = (usage.get("input_token_details") or {}).get("cache_read") or 0
+        PROMPT_TOKENS.observe(prompt_tokens, model=model)
+        COMPLETION_TOKENS.observe(completion_tokens, model=model)
+        CACHED_TOKENS.observe(cached_tokens, model=model)
+        with self._lock:
+            self.llm_calls += 1
+            self.llm_seconds += elapsed
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            self.cached_tokens += cached_tokens
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        kind, model, elapsed = self._finish(run_id)
+        if kind == "llm":
+            LLM_SECONDS.observe(elapsed, model=model)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        self._start(run_id, "tool", (serialized or {}).get("name") or kwargs.get("name") or "unknown")
+
+    def _tool_done(self, run_id, status):
+        kind, tool, elapsed = self._finish(run_id)
+        if kind != "tool":
+            return
+        TOOL_SECONDS.observe(elapsed, tool=tool)
+        TOOL_CALLS.inc(tool=tool, status=status)
+        with self._lock:
+            self.tool_calls.append({"tool": tool, "seconds": round(elapsed, 4), "status": status})
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._tool_done(run_id, "ok")
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._tool_done(run_id, "error")
+
+    def finish(self):
+        """Record the turn latency and emit the structured turn log."""
+        elapsed = time.perf_counter() - self.started
+        TURN_SECONDS.observe(elapsed, route=self.route)
+        log_event(
+            "agent_turn",
+            chat_id=self.chat_id,
+            route=self.route,
+            seconds=round(elapsed, 4),
+            llm_calls=self.llm_calls,
+            llm_seconds=round(self.llm_seconds, 4),
+            prompt_tokens=self.prompt_tokens,
+            completion_tokens=self.completion_tokens,
+            cached_tokens=self.cached_tokens,
+            cache_hit_ratio=round(self.cached_tokens / self.prompt_tokens, 3) if self.prompt_tokens else None,
+            tools=self.tool_calls,
+        )
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        if path == "/metrics":
+            payload, content_type = REGISTRY.render().encode(), "text/plain; version=0.0.4"
+        elif path == "/healthz":
+            health = {"status": "ok", "uptime_seconds": round(time.monotonic() - STARTED, 1)}
+            payload, content_type = json.dumps(health).encode(), "application/json"
+        else:
+            self.send_response(404)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def start_metrics_server(port: Optional[int] = None, host: Optional[str] = None) -> Optional[ThreadingHTTPServer]:
+    """
+    Serve the registry in Prometheus text format on /metrics, and a liveness
+    check on /healthz, from a background thread.
+
+    Port and host default to METRICS_PORT (9464) and METRICS_HOST (127.0.0.1).
+    A port of 0 disables the endpoint.
+    """
+    port = int(os.getenv("METRICS_PORT", "9464")) if port is None else port
+    host = host or os.getenv("METRICS_HOST", "127.0.0.1")
+    if not port:
+        return None
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f"Metrics and health endpoints listening on http://{host}:{port}")
+    return server
@@ -0,0 +1,166 @@
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from dotenv import load_dotenv
+from telegram.error import BadRequest, NetworkError, RetryAfter, TelegramError
+
+from metrics import REGISTRY, TELEGRAM_SEND_SECONDS
+from scheduler import TokenBucket
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Telegram allows about one message per second in a chat, 20 per minute in a
+# group and 30 per second overall; stay under all three
+OUTBOUND_CHAT_RATE_PER_MINUTE = float(os.getenv('OUTBOUND_CHAT_RATE_PER_MINUTE', '20'))
+OUTBOUND_CHAT_BURST = float(os.getenv('OUTBOUND_CHAT_BURST', '3'))
+OUTBOUND_GLOBAL_RATE_PER_SECOND = float(os.getenv('OUTBOUND_GLOBAL_RATE_PER_SECOND', '25'))
+OUTBOUND_MAX_RETRIES = int(os.getenv('OUTBOUND_MAX_RETRIES', '5'))
+
+OUTBOUND_DEPTH = REGISTRY.gauge("outbound_media_queued", "Media waiting to be sent to Telegram")
+OUTBOUND_SENT = REGISTRY.counter("outbound_media_total", "Media sends to Telegram by outcome", ["kind", "status"])
+
+# Bot method and file argument for each kind of media
+SEND_METHODS = {
+    "voice": ("send_voice", "voice"),
+    "photo": ("send_photo", "photo"),
+    "document": ("send_document", "document"),
+}
+
+
+@dataclass
+class OutboundMedia:
+    chat_id: int
+    kind: str
+    data: bytes
+    filename: Optional[str] = None
+    caption: Optional[str] = None
+
+
+class OutboundQueue:
+    """
+    Async queue of media for tools to send to Telegram through the bot.
+
+    Tools run on worker threads, so they hand media over with submit(), which
+    returns straight away. Each chat's media is sent in order by its own task,
+    through the Application's Bot (and its connection pool), under a per-chat
+    and a global token bucket. Flood waits and network errors are retried.
+    """
+
+    def __init__(self, chat_rate: float = OUTBOUND_CHAT_RATE_PER_MINUTE / 60, chat_burst: float = OUTBOUND_CHAT_BURST,
+                 global_rate: float = OUTBOUND_GLOBAL_RATE_PER_SECOND, max_retries: int = OUTBOUND_MAX_RETRIES,
+                 backoff: float = 1.0):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._global = TokenBucket(global_rate, max(1.0, global_rate))
+        self._chat_buckets: Dict[int, TokenBucket] = {}
+        self._chat_queues: Dict[int, asyncio.Queue] = {}
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self._bot = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @property
+    def running(self) -> bool:
+        return self._bot is not None
+
+    def start(self, bot):
+        """Start accepting media, sending it with the given Bot. Call from the event loop."""
+        self._bot = bot
+        self._loop = asyncio.get_running_loop()
+
+    def submit(self, media: OutboundMedia):
+        """Queue media for sending. Safe to call from any thread; doesn't wait for the send."""
+        if not self.running:
+            raise RuntimeError("The outbound queue isn't running")
+        try:
+            in_loop = asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            in_loop = False
+        if in_loop:
+            self._loop.create_task(self.put(media))
+            return
+        future = asyncio.run_coroutine_threadsafe(self.put(media), self._loop)
+        # Only wait for the hand-over, which is immediate, not the send
+        future.result(timeout=5)
+
+    async def put(self, media: OutboundMedia):
+        queue = self._chat_queues.get(media.chat_id)
+        if queue is None:
+            queue = self._chat_queues[media.chat_id] = asyncio.Queue()
+        queue.put_nowait(media)
+        OUTBOUND_DEPTH.inc()
+        task = self._tasks.get(media.chat_id)
+        if task is None or task.done():
+            self._tasks[media.chat_id] = asyncio.create_task(self._drain_chat(media.chat_id, queue))
+
+    async def _drain_chat(self, chat_id: int, queue: asyncio.Queue):
+        while not queue.empty():
+            media = queue.get_nowait()
+            try:
+                await self._send(media)
+            finally:
+                OUTBOUND_DEPTH.dec()
+        self._chat_queues.pop(chat_id, None)
+        self._tasks.pop(chat_id, None)
+
+    async def _acquire(self, chat_id: int):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        while True:
+            wait = max(bucket.time_until_available(), self._global.time_until_available())
+            if wait <= 0:
+                # Nothing else runs between these, so both succeed
+                bucket.try_acquire()
+                self._global.try_acquire()
+                return
+            await asyncio.sleep(wait)
+
+    async def _send(self, media: OutboundMedia):
+        method, argument = SEND_METHODS[media.kind]
+        for attempt in range(self.max_retries + 1):
+            await self._acquire(media.chat_id)
+            start = time.perf_counter()
+            try:
+                await getattr(self._bot, method)(
+                    chat_id=media.chat_id, caption=media.caption, filename=media.filename, **{argument: media.data})
+                OUTBOUND_SENT.inc(kind=media.kind, status="ok")
+                return
+            except RetryAfter as e:
+                delay = e.retry_after
+                logger.warning(f"Flood control sending {media.kind} to chat {media.chat_id}, retrying in {delay}s")
+            except BadRequest as e:
+                logger.error(f"Telegram rejected {media.kind} for chat {media.chat_id}: {e}")
+                OUTBOUND_SENT.inc(kind=media.kind, status="error")
+                return
+            except NetworkError as e:
+                delay = self.backoff * 2 ** attempt
+                logger.warning(f"Network error sending {media.kind} to chat {media.chat_id}: {e}, retrying in {delay}s")
+            except TelegramError as e:
+                logger.error(f"Failed to send {media.kind} to chat {media.chat_id}: {e}")
+                OUTBOUND_SENT.inc(kind=media.kind, status="error")
+                return
+            finally:
+                TELEGRAM_SEND_SECONDS.observe(time.perf_counter() - start, method=method)
+            OUTBOUND_SENT.inc(kind=media.kind, status="retry")
+            await asyncio.sleep(delay)
+
+        logger.error(f"Giving up sending {media.kind} to chat {media.chat_id} after {self.max_retries} retries")
+        OUTBOUND_SENT.inc(kind=media.kind, status="error")
+
+    async def stop(self):
+        """Finish sending what is queued, then stop accepting media."""
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks.values()), return_exceptions=True)
+        self._bot = None
+        self._loop = None
+
+
+outbound = OutboundQueue()
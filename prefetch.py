@@ -0,0 +1,142 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from metrics import REGISTRY
+from singapore_data import LTADataMallBus
+from store import get_cache
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+ARRIVAL_CACHE_TTL_SECONDS = float(os.getenv('ARRIVAL_CACHE_TTL_SECONDS', '20'))
+PREFETCH_INTERVAL_SECONDS = float(os.getenv('PREFETCH_INTERVAL_SECONDS', '15'))
+PREFETCH_LEAD_MINUTES = float(os.getenv('PREFETCH_LEAD_MINUTES', '10'))
+PREFETCH_MIN_QUERIES = int(os.getenv('PREFETCH_MIN_QUERIES', '3'))
+PREFETCH_MAX_STOPS = int(os.getenv('PREFETCH_MAX_STOPS', '5'))
+
+# Usage is bucketed into 15 minute slots, separately for weekdays and weekends
+SLOT_MINUTES = 15
+
+ARRIVAL_CACHE = REGISTRY.counter("bus_arrival_cache_total", "Bus arrival cache lookups", ["result"])
+PREFETCHES = REGISTRY.counter("bus_arrival_prefetch_total", "Bus arrival refreshes made ahead of predicted queries", ["status"])
+
+
+def slot_key(when: datetime) -> str:
+    day_type = "weekend" if when.weekday() >= 5 else "weekday"
+    return f"{day_type}:{(when.hour * 60 + when.minute) // SLOT_MINUTES}"
+
+
+class ArrivalCache:
+    """
+    Short-lived cache of DataMall bus arrival responses.
+
+    Arrival responses carry absolute ETAs, so a response that is a few seconds
+    old still formats correctly.
+    """
+
+    def __init__(self, ttl: float = ARRIVAL_CACHE_TTL_SECONDS):
+        self.ttl = ttl
+        self._cache = get_cache("bus_arrivals")
+
+    def get(self, bus_stop_code: str) -> Optional[Dict]:
+        arrival = self._cache.get(bus_stop_code)
+        ARRIVAL_CACHE.inc(result="hit" if arrival is not None else "miss")
+        return arrival
+
+    def refresh(self, client, bus_stop_code: str) -> Dict:
+        """Fetch arrivals from DataMall and cache them."""
+        arrival = client.get_bus_arrival(bus_stop_code)
+        self._cache.set(bus_stop_code, arrival, ttl=self.ttl)
+        return arrival
+
+    def invalidate(self, bus_stop_code: str):
+        self._cache.delete(bus_stop_code)
+
+    def get_or_fetch(self, client, bus_stop_code: str) -> Dict:
+        arrival = self.get(bus_stop_code)
+        if arrival is None:
+            arrival = self.refresh(client, bus_stop_code)
+        return arrival
+
+
+class UsageProfile:
+    """Per-stop query counts by time-of-day slot, used to predict upcoming queries."""
+
+    def __init__(self):
+        self._cache = get_cache("bus_usage")
+
+    def stops(self) -> List[str]:
+        return self._cache.get("stops", [])
+
+    def record(self, bus_stop_code: str, when: Optional[datetime] = None):
+        key = slot_key(when or datetime.now())
+
+        # Agent threads and shard processes record concurrently, so counts are updated atomically
+        def count(counts):
+            counts = counts or {}
+            counts[key] = counts.get(key, 0) + 1
+            return counts
+
+        self._cache.update(f"usage:{bus_stop_code}", count)
+        if bus_stop_code not in self.stops():
+            self._cache.update("stops", lambda stops: stops if bus_stop_code in (stops or []) else (stops or []) + [bus_stop_code])
+
+    def likely_stops(self, when: Optional[datetime] = None, lead_minutes: float = PREFETCH_LEAD_MINUTES,
+                     min_queries: int = PREFETCH_MIN_QUERIES, limit: int = PREFETCH_MAX_STOPS) -> List[str]:
+        """Stops that have been queried at least min_queries times in the slots between now and now + lead."""
+        when = when or datetime.now()
+        slots = {slot_key(when + timedelta(minutes=m)) for m in range(0, int(lead_minutes) + 1, 5)}
+        scored = []
+        for code in self.stops():
+            counts = self._cache.get(f"usage:{code}", {})
+            score = sum(counts.get(slot, 0) for slot in slots)
+            if score >= min_queries:
+                scored.append((score, code))
+        return [code for _, code in sorted(scored, reverse=True)[:limit]]
+
+
+arrival_cache = ArrivalCache()
+usage_profile = UsageProfile()
+
+
+class Prefetcher:
+    """Keeps arrivals warm in the cache for the stops likely to be asked about soon."""
+
+    def __init__(self, interval: float = PREFETCH_INTERVAL_SECONDS):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+        self._client = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            stops = usage_profile.likely_stops()
+            if stops:
+                if self._client is None:
+                    self._client = LTADataMallBus()
+                for code in stops:
+                    try:
+                        await asyncio.to_thread(arrival_cache.refresh, self._client, code)
+                        PREFETCHES.inc(status="ok")
+                    except Exception as e:
+                        logger.warning(f"Failed to prefetch arrivals for stop {code}: {e}")
+                        PREFETCHES.inc(status="error")
+            await asyncio.sleep(self.interval)
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+prefetcher = Prefetcher()
@@ -0,0 +1,77 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+from typing import Optional, Sequence
+from zoneinfo import ZoneInfo
+
+from langchain_core.tools import BaseTool
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+from metrics import REGISTRY, log_event
+from store import get_cache
+
+logger = logging.getLogger(__name__)
+
+# Time zone the model is told the current time in (the server's own is usually UTC)
+BOT_TIMEZONE = os.getenv('BOT_TIMEZONE', 'Asia/Singapore')
+
+# Providers cache the longest previously seen prompt prefix (OpenAI from 1024
+# tokens): tool schemas, then messages in order. Everything that is the same
+# on every request - the persona and the tool schemas - must therefore come
+# first and be byte-identical, and anything that changes per turn goes last.
+
+PREFIX_CHANGES = REGISTRY.counter("llm_prompt_prefix_changes_total",
+                                  "Times the static prompt prefix (system prompt and tool schemas) changed")
+
+
+def sort_tools(tools: Sequence[BaseTool]) -> list:
+    """Tools in a fixed order (by name), so their schemas serialize the same way every time."""
+    return sorted(tools, key=lambda tool: tool.name)
+
+
+def prefix_hash(system_prompt: str, tools: Sequence[BaseTool]) -> str:
+    """Hash of the static prompt prefix: the tool schemas as sent, then the system prompt."""
+    schemas = [convert_to_openai_tool(tool) for tool in tools]
+    payload = json.dumps({"tools": schemas, "system": system_prompt}, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+
+def dynamic_context(now: Optional[datetime] = None) -> str:
+    """Per-turn context, sent after the conversation so it never breaks the cached prefix."""
+    now = now or datetime.now(ZoneInfo(BOT_TIMEZONE))
+    zone = getattr(now.tzinfo, "key", None) or now.tzname()
+    return f"Current time: {now:%A %d %B %Y, %H:%M} ({zone} time, UTC{now:%z})"
+
+
+class PrefixMonitor:
+    """
+    Checks the static prompt prefix stays byte-stable.
+
+    The last hash seen is kept in the shared cache, so with STATE_DB_PATH a
+    change between restarts or between worker processes is reported too. A
+    change means every conversation's cached prefix is lost once.
+    """
+
+    def __init__(self):
+        self._cache = get_cache("prompt_prefix")
+        self._lock = threading.Lock()
+
+    def check(self, digest: str) -> bool:
+        """Record the prefix hash. Returns False (and warns) if it differs from the last one."""
+        with self._lock:
+            previous = self._cache.get("hash")
+            if previous == digest:
+                return True
+            self._cache.set("hash", digest)
+        if previous is None:
+            log_event("prompt_prefix", hash=digest)
+            return True
+        logger.warning(f"Static prompt prefix changed ({previous} -> {digest}); cached prompts will miss once")
+        PREFIX_CHANGES.inc()
+        return False
+
+
+prefix_monitor = PrefixMonitor()
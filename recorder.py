@@ -0,0 +1,136 @@
+import hashlib
+import hmac
+import json
+import logging
+import os
+import re
+import time
+from typing import Any, Optional
+
+from dotenv import load_dotenv
+from telegram import Update
+from telegram.ext import ContextTypes
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Set to a file path to record incoming updates (anonymised) for replay.py
+RECORD_UPDATES_PATH = os.getenv('RECORD_UPDATES_PATH')
+# Key for pseudonymising ids; keep it stable so ids match across restarts
+RECORD_UPDATES_SALT = os.getenv('RECORD_UPDATES_SALT') or os.getenv('TELEGRAM_BOT_TOKEN') or ''
+
+# The bot's own @username is replaced with this in recorded text
+BOT_MENTION = "@replay_bot"
+
+# Keys whose values are users or chats
+_IDENTITY_KEYS = {"from", "chat", "user", "sender_chat", "forward_from", "forward_from_chat", "via_bot",
+                  "new_chat_members", "left_chat_member"}
+# Personal details dropped from users and chats
+_PERSONAL_KEYS = {"first_name", "last_name", "username", "title", "bio", "description", "photo",
+                  "language_code", "invite_link", "active_usernames"}
+# Fields dropped altogether (a message's leading /command entity is rebuilt, see _command_entities)
+_DROPPED_KEYS = {"contact", "venue", "entities", "caption_entities"}
+
+_EMAIL = re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+")
+_PHONE = re.compile(r"\+?\d[\d -]{7,}\d")
+_COMMAND = re.compile(r"/\w+(?:@\w+)?")
+
+
+class UpdateRecorder:
+    """
+    Appends incoming updates to a JSON lines file, anonymised, for replay.py.
+
+    User and chat ids are replaced with keyed hashes (so a user keeps the same
+    pseudonym, and group ids stay negative), names and contact details are
+    removed, emails and phone numbers in text are masked and locations are
+    rounded to about 100m. Message text is otherwise kept, since replaying
+    realistic traffic needs it. Of the text's entities only a leading
+    /command is kept, so commands still reach their handlers on replay.
+    """
+
+    def __init__(self, path: str, salt: str = RECORD_UPDATES_SALT, owner_id: Optional[int] = None):
+        self.path = path
+        self.salt = salt.encode()
+        self._file = None
+        self._owner_id = owner_id
+        self._bot_username: Optional[str] = None
+
+    def pseudonym(self, value: int) -> int:
+        digest = hmac.new(self.salt, str(abs(value)).encode(), hashlib.sha256).digest()
+        alias = int.from_bytes(digest[:8], "big") % 10 ** 12 + 1
+        return -alias if value < 0 else alias
+
+    def _text(self, text: str) -> str:
+        if self._bot_username:
+            text = re.sub(f"@{re.escape(self._bot_username)}", BOT_MENTION, text, flags=re.IGNORECASE)
+        text = _EMAIL.sub("<email>", text)
+        return _PHONE.sub("<phone>", text)
+
+    @staticmethod
+    def _command_entities(entities: list, text: str) -> list:
+        """A leading bot_command entity, refitted to the anonymised text (the bot's username may have changed length)."""
+        command = _COMMAND.match(text)
+        if command and any(entity.get("type") == "bot_command" and entity.get("offset") == 0 for entity in entities):
+            return [{"type": "bot_command", "offset": 0, "length": len(command.group(0))}]
+        return []
+
+    def _identity(self, value: dict) -> dict:
+        anonymised = {key: item for key, item in value.items() if key not in _PERSONAL_KEYS}
+        if "first_name" in value:
+            # Required by the Bot API's User type
+            anonymised["first_name"] = "User"
+        if "id" in value:
+            anonymised["id"] = self.pseudonym(value["id"])
+        return anonymised
+
+    def anonymise(self, data: Any) -> Any:
+        if isinstance(data, list):
+            return [self.anonymise(item) for item in data]
+        if not isinstance(data, dict):
+            return data
+
+        result = {}
+        for key, value in data.items():
+            if key in _DROPPED_KEYS:
+                continue
+            if key in _IDENTITY_KEYS:
+                value = [self._identity(v) for v in value] if isinstance(value, list) else self._identity(value)
+            elif key in ("text", "caption") and isinstance(value, str):
+                value = self._text(value)
+            elif key == "location" and isinstance(value, dict):
+                value = {k: round(v, 3) if k in ("latitude", "longitude") else v for k, v in value.items()
+                         if k in ("latitude", "longitude")}
+            else:
+                value = self.anonymise(value)
+            result[key] = value
+        if isinstance(data.get("entities"), list) and isinstance(result.get("text"), str):
+            entities = self._command_entities(data["entities"], result["text"])
+            if entities:
+                result["entities"] = entities
+        return result
+
+    def _write(self, entry: dict):
+        if self._file is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._file = open(self.path, "a", encoding="utf-8")
+            # A header each time the file is opened, so replay knows who the owner is
+            header = {"recording": 1, "started": time.time()}
+            if self._owner_id is not None:
+                header["owner_id"] = self.pseudonym(self._owner_id)
+            self._file.write(json.dumps(header) + "\n")
+        self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self._file.flush()
+
+    async def record(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handler (run before all others) that records the update."""
+        try:
+            self._bot_username = self._bot_username or context.bot.username
+            self._write({"time": time.time(), "update": self.anonymise(update.to_dict())})
+        except Exception as e:
+            logger.warning(f"Failed to record update: {e}")
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,293 @@
+"""
+Replay recorded (or synthetic) Telegram traffic through the bot offline.
+
+Updates recorded with RECORD_UPDATES_PATH are fed to the bot's handlers at
+1x, 10x or 100x their original pace, with fakes standing in for the Telegram
+API, the LLM, LTA DataMall and Google. Reports turn latency percentiles,
+throughput and memory growth (resident set size, so the timed run isn't
+slowed by allocation tracing), and checks each sticker reply was based on
+that chat's own sticker:
+
+    python replay.py updates.jsonl --speed 10
+    python replay.py --synthetic 20 --speed 100 --llm-latency 0.5 --no-limits
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+
+import fakes
+from benchmark import REPO_DIR, git_commit, summarize
+
+Event = Tuple[float, dict]
+
+OWNER_ID = 1000
+
+
+def load_session(path: str) -> Tuple[Optional[int], List[Event]]:
+    """Read a recording. Returns the owner's (pseudonymous) id and the (time, update) events."""
+    owner_id, events = None, []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if "recording" in entry:
+                owner_id = entry.get("owner_id", owner_id)
+            else:
+                events.append((entry["time"], entry["update"]))
+    return owner_id, sorted(events, key=lambda event: event[0])
+
+
+def synthetic_session(chats: int, messages_per_chat: int = 10, interval: float = 20.0,
+                      sticker_share: float = 0.15, seed: int = 0) -> Tuple[int, List[Event]]:
+    """
+    Generate a session shaped like a recording: the owner's private chat plus
+    groups, each sending a mix of bus questions, chit-chat, quick follow-ups
+    and stickers, with exponentially distributed gaps averaging `interval` seconds.
+    """
+    rng = random.Random(seed)
+    codes = [stop["BusStopCode"] for stop in fakes.fake_bus_stops(50)]
+    texts = ["@replay_bot hi!", "@replay_bot what can you do?", "@replay_bot tell me a joke",
+             "@replay_bot when is the next bus at {code}?", "@replay_bot bus timings for {code} please"]
+    events: List[Event] = []
+    update_ids = iter(range(1, 10 ** 9))
+    start = time.time()
+    for index in range(chats):
+        chat_id = OWNER_ID if index == 0 else -(2000 + index)
+        members = [OWNER_ID] if index == 0 else [OWNER_ID] + [3000 + index * 10 + i for i in range(3)]
+        now = start
+        for message_id in range(1, messages_per_chat + 1):
+            # One in five messages is a quick follow-up to the previous one
+            now += rng.uniform(0.2, 1.0) if rng.random() < 0.2 else rng.expovariate(1 / interval)
+            message = {
+                "message_id": message_id,
+                "date": int(now),
+                "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "group"},
+                "from": {"id": rng.choice(members), "is_bot": False, "first_name": "User"},
+            }
+            if rng.random() < sticker_share:
+                file_id = f"sticker-{chat_id}-{message_id}"
+                message["sticker"] = {"file_id": file_id, "file_unique_id": file_id, "width": 512, "height": 512,
+                                      "is_animated": False, "is_video": False, "type": "regular"}
+            else:
+                message["text"] = rng.choice(texts).format(code=rng.choice(codes))
+            events.append((now, {"update_id": next(update_ids), "message": message}))
+    return OWNER_ID, sorted(events, key=lambda event: event[0])
+
+
+def rss_mb() -> float:
+    """Resident set size of this process in MB (the peak so far where the current size isn't available)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize() / 2 ** 20
+    except OSError:
+        return peak_rss_mb()
+
+
+def peak_rss_mb() -> float:
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes elsewhere
+    return maxrss / 2 ** 20 if sys.platform == "darwin" else maxrss / 2 ** 10
+
+
+def setup(workdir: str, lta_url: str, owner_id: int, llm_latency: float, no_limits: bool):
+    """Point the bot at fakes and import it."""
+    os.environ["TELEGRAM_BOT_TOKEN"] = "123456:replay"
+    os.environ["AUTHORIZED_USER_ID"] = str(owner_id)
+    os.environ.pop("RECORD_UPDATES_PATH", None)
+    os.environ.pop("STATE_DB_PATH", None)
+    os.environ["METRICS_PORT"] = "0"
+    if no_limits:
+        for name in ("CHAT_RATE_PER_MINUTE", "GLOBAL_RATE_PER_MINUTE", "CHAT_BURST", "GLOBAL_BURST", "AGENT_QUEUE_SIZE"):
+            os.environ[name] = "1000000"
+    fakes.install_fakes(workdir, lta_url)
+
+    import agent
+    import image_tool
+    agent.llm = fakes.FakeChatModel(latency=llm_latency)
+    image_tool.get_photo_description = fakes.fake_photo_description
+    import bot
+    logging.getLogger().setLevel(logging.WARNING)
+    return bot
+
+
+async def wait_until_idle(application, bot, quiet: float = 0.2, timeout: float = 600):
+    """Wait until no updates are queued or being handled, and no debounced messages are pending."""
+    from update_processor import UPDATES_IN_FLIGHT
+
+    deadline = time.monotonic() + timeout
+    idle_since = None
+    while time.monotonic() < deadline:
+        if bot.coalescer:
+            await bot.coalescer.drain()
+        if application.update_queue.empty() and not UPDATES_IN_FLIGHT.value():
+            idle_since = idle_since or time.monotonic()
+            if time.monotonic() - idle_since >= quiet:
+                return
+        else:
+            idle_since = None
+        await asyncio.sleep(0.01)
+    raise TimeoutError("Replay did not finish in time")
+
+
+async def replay(bot, events: List[Event], speed: float, telegram_latency: float) -> dict:
+    from debounce import MERGED
+    from telegram import Update
+    from telegram.ext import Defaults
+
+    telegram_api = fakes.FakeTelegramRequest(latency=telegram_latency)
+    # Quote in private chats too, so every reply can be matched to its message
+    application = bot.build_application(request=telegram_api, defaults=Defaults(quote=True))
+    for _, data in events:
+        chat_id = data.get("message", {}).get("chat", {}).get("id", 0)
+        if chat_id < 0:
+            bot.AUTHORIZED_GROUPS.add(chat_id)
+
+    await application.initialize()
+    await bot.post_init(application)
+    await application.start()
+
+    memory_start = rss_mb()
+    merged_start = MERGED.value()
+    sent = {}
+    stickers = {}
+    start = time.perf_counter()
+    first = events[0][0]
+    for timestamp, data in events:
+        delay = (timestamp - first) / speed - (time.perf_counter() - start)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        data = json.loads(json.dumps(data))
+        message = data.get("message")
+        if message:
+            message["date"] = int(time.time())
+            key = (message["chat"]["id"], message["message_id"])
+            sent[key] = time.perf_counter()
+            if "sticker" in message:
+                stickers[key] = message["sticker"]["file_id"]
+        await application.update_queue.put(Update.de_json(data, application.bot))
+
+    await wait_until_idle(application, bot)
+    duration = time.perf_counter() - start
+    memory_end, memory_peak = rss_mb(), peak_rss_mb()
+
+    await application.stop()
+    await bot.post_shutdown(application)
+    await application.shutdown()
+
+    latencies, busy, errors, mismatches = [], 0, 0, 0
+    replied = set()
+    for reply in telegram_api.sent:
+        key = (int(reply.get("chat_id", 0)), reply.get("reply_to_message_id"))
+        if reply["method"] != "sendMessage" or key not in sent:
+            continue
+        replied.add(key)
+        text = reply.get("text", "")
+        if text == bot.BUSY_MESSAGE:
+            busy += 1
+        elif text.startswith("Sorry, I encountered an error"):
+            errors += 1
+        else:
+            latencies.append(reply["time"] - sent[key])
+            if key in stickers and f"file:{stickers[key]}" not in text:
+                mismatches += 1
+
+    merged = int(MERGED.value() - merged_start)
+    return {
+        "turn_latency": summarize(latencies) if latencies else None,
+        "updates": len(events),
+        "replies": len(latencies),
+        "busy": busy,
+        "errors": errors,
+        "merged": merged,
+        "unanswered": len(sent) - len(replied) - merged,
+        "sticker_mismatches": mismatches,
+        "duration_s": duration,
+        "throughput_updates_per_s": len(events) / duration,
+        "throughput_replies_per_s": len(latencies) / duration,
+        "memory": {
+            "rss_start_mb": memory_start,
+            "growth_mb": memory_end - memory_start,
+            "peak_mb": max(memory_peak - memory_start, 0.0),
+        },
+    }
+
+
+def run_replay(events: List[Event], owner_id: int, speed: float, llm_latency: float, lta_latency: float,
+               telegram_latency: float, no_limits: bool) -> dict:
+    sys.path.insert(0, REPO_DIR)
+    workdir = tempfile.mkdtemp(prefix="giannabot-replay-")
+    bus_stops = fakes.fake_bus_stops()
+    fakes.write_fake_data(workdir, bus_stops)
+
+    with fakes.FakeLTAServer(latency=lta_latency, bus_stops=bus_stops) as lta:
+        bot = setup(workdir, lta.url, owner_id, llm_latency, no_limits)
+        results = asyncio.run(replay(bot, events, speed, telegram_latency))
+        results["lta_requests"] = lta.request_count
+
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "speed": speed,
+            "chats": len({data.get("message", {}).get("chat", {}).get("id") for _, data in events}),
+            "session_s": events[-1][0] - events[0][0],
+            "llm_latency_s": llm_latency,
+            "lta_latency_s": lta_latency,
+            "telegram_latency_s": telegram_latency,
+            "no_limits": no_limits,
+        },
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay Telegram traffic through the bot against fakes.")
+    parser.add_argument("session", nargs="?", help="Recording made with RECORD_UPDATES_PATH")
+    parser.add_argument("--synthetic", type=int, metavar="CHATS", help="Replay a generated session with this many chats")
+    parser.add_argument("--messages", type=int, default=10, help="Messages per chat in a synthetic session")
+    parser.add_argument("--speed", type=float, default=1.0, help="Replay speed multiplier, e.g. 1, 10 or 100")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="Injected fake LLM latency in seconds")
+    parser.add_argument("--lta-latency", type=float, default=0.05, help="Injected fake LTA latency in seconds")
+    parser.add_argument("--telegram-latency", type=float, default=0.05, help="Injected fake Telegram API latency in seconds")
+    parser.add_argument("--no-limits", action="store_true", help="Disable rate limiting and load shedding")
+    parser.add_argument("--output", help="Write results JSON to this path (default: stdout)")
+    args = parser.parse_args()
+
+    if args.session:
+        owner_id, events = load_session(args.session)
+        if owner_id is None:
+            parser.error("The recording has no owner id; it must be made with AUTHORIZED_USER_ID set")
+    elif args.synthetic:
+        owner_id, events = synthetic_session(args.synthetic, args.messages)
+    else:
+        parser.error("Pass a recording or --synthetic CHATS")
+    if not events:
+        parser.error("No updates to replay")
+    if args.output:
+        args.output = os.path.abspath(args.output)
+
+    # Tools print debugging output; keep stdout clean for the JSON report
+    with contextlib.redirect_stdout(sys.stderr):
+        report = run_replay(events, owner_id, args.speed, args.llm_latency, args.lta_latency,
+                            args.telegram_latency, args.no_limits)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
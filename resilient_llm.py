@@ -0,0 +1,169 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, List, Optional
+
+from dotenv import load_dotenv
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from pydantic import PrivateAttr
+
+from metrics import REGISTRY
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Give up on the primary model after this many seconds
+LLM_DEADLINE_SECONDS = float(os.getenv('LLM_DEADLINE_SECONDS', '45'))
+# Send a duplicate request once a call is slower than this percentile of recent calls (0 disables)
+LLM_HEDGE_PERCENTILE = float(os.getenv('LLM_HEDGE_PERCENTILE', '95'))
+# Recent calls needed before hedging starts, and the earliest a hedge is sent
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv('LLM_HEDGE_MIN_SAMPLES', '20'))
+LLM_HEDGE_MIN_SECONDS = float(os.getenv('LLM_HEDGE_MIN_SECONDS', '2'))
+# Alternate model (and OpenAI-compatible endpoint) used when the primary fails or misses the deadline
+FALLBACK_MODEL = os.getenv('FALLBACK_MODEL')
+FALLBACK_BASE_URL = os.getenv('FALLBACK_BASE_URL')
+FALLBACK_API_KEY = os.getenv('FALLBACK_API_KEY')
+
+LLM_HEDGES = REGISTRY.counter("llm_hedged_requests_total", "Duplicate LLM requests sent for slow calls", ["outcome"])
+LLM_FALLBACKS = REGISTRY.counter("llm_fallbacks_total", "LLM calls answered by the fallback model", ["reason"])
+
+# Calls run on these pools so a slow one can be raced or abandoned; abandoned
+# calls finish in the background. Hedges and the fallback have pools of their
+# own, so they never queue behind primary calls hung in an outage.
+LLM_MAX_CONCURRENT_CALLS = int(os.getenv('LLM_MAX_CONCURRENT_CALLS', '16'))
+_primary_executor = ThreadPoolExecutor(max_workers=LLM_MAX_CONCURRENT_CALLS, thread_name_prefix="llm")
+_hedge_executor = ThreadPoolExecutor(max_workers=LLM_MAX_CONCURRENT_CALLS, thread_name_prefix="llm-hedge")
+_fallback_executor = ThreadPoolExecutor(max_workers=LLM_MAX_CONCURRENT_CALLS, thread_name_prefix="llm-fallback")
+
+
+class LLMDeadlineExceeded(TimeoutError):
+    """Raised when no model answered before the deadline."""
+
+
+class ResilientChatModel(BaseChatModel):
+    """
+    Chat model wrapper that bounds tail latency.
+
+    Each call to the primary model gets a deadline. If it is still running
+    after the hedge_percentile of recent call latencies, an identical request
+    is sent and whichever reply arrives first is used. If the primary fails or
+    misses the deadline, the fallback model (if any) is asked instead, with a
+    deadline of its own.
+
+    Build the models with max_retries=0 and a request_timeout of about the
+    deadline, so calls abandoned in the background don't outlive it by much.
+    """
+    primary: BaseChatModel
+    fallback: Optional[BaseChatModel] = None
+    deadline: float = LLM_DEADLINE_SECONDS
+    hedge_percentile: float = LLM_HEDGE_PERCENTILE
+    hedge_min_samples: int = LLM_HEDGE_MIN_SAMPLES
+    hedge_min_seconds: float = LLM_HEDGE_MIN_SECONDS
+    latency_window: int = 200
+
+    _latencies: deque = PrivateAttr(default=None)
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    def model_post_init(self, __context: Any):
+        self._latencies = deque(maxlen=self.latency_window)
+
+    @property
+    def _llm_type(self) -> str:
+        return f"resilient-{self.primary._llm_type}"
+
+    def _get_ls_params(self, stop: Optional[List[str]] = None, **kwargs: Any):
+        # Report the primary model, so metrics stay labelled by the real model name
+        return self.primary._get_ls_params(stop=stop, **kwargs)
+
+    def bind_tools(self, tools, **kwargs):
+        return self.bind(tools=[convert_to_openai_tool(tool) for tool in tools], **kwargs)
+
+    def hedge_delay(self) -> Optional[float]:
+        """Seconds after which a call is hedged, or None if hedging is off or there's too little history."""
+        if not self.hedge_percentile:
+            return None
+        with self._lock:
+            if len(self._latencies) < self.hedge_min_samples:
+                return None
+            ordered = sorted(self._latencies)
+        index = min(len(ordered) - 1, int(self.hedge_percentile / 100 * len(ordered)))
+        return max(self.hedge_min_seconds, ordered[index])
+
+    def _record(self, latency: float):
+        with self._lock:
+            self._latencies.append(latency)
+
+    def _call(self, model: BaseChatModel, messages, stop, kwargs, primary: bool) -> ChatResult:
+        start = time.monotonic()
+        result = model._generate(messages, stop=stop, **kwargs)
+        if primary:
+            self._record(time.monotonic() - start)
+        return result
+
+    def _race(self, messages, stop, kwargs) -> ChatResult:
+        """Call the primary, hedging once if it's slow. Raises the last error or LLMDeadlineExceeded."""
+        start = time.monotonic()
+        hedge_at = self.hedge_delay()
+        pending = {_primary_executor.submit(self._call, self.primary, messages, stop, kwargs, True)}
+        hedge = None
+        error: Optional[BaseException] = None
+        while pending:
+            now = time.monotonic()
+            remaining = start + self.deadline - now
+            if remaining <= 0:
+                break
+            timeout = remaining if hedge_at is None or hedge else min(remaining, max(0.0, start + hedge_at - now))
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        LLM_HEDGES.inc(outcome="won")
+                    return future.result()
+                error = future.exception()
+                logger.warning(f"LLM call failed: {error}")
+            if hedge_at is not None and hedge is None and pending and time.monotonic() - start >= hedge_at:
+                hedge = _hedge_executor.submit(self._call, self.primary, messages, stop, kwargs, True)
+                pending.add(hedge)
+                LLM_HEDGES.inc(outcome="sent")
+        if pending:
+            raise LLMDeadlineExceeded(f"No reply from the model within {self.deadline}s")
+        raise error
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        try:
+            return self._race(messages, stop, kwargs)
+        except Exception as e:
+            if self.fallback is None:
+                raise
+            reason = "deadline" if isinstance(e, LLMDeadlineExceeded) else "error"
+            logger.warning(f"Falling back to the alternate model ({reason}): {e}")
+            LLM_FALLBACKS.inc(reason=reason)
+
+        future = _fallback_executor.submit(self._call, self.fallback, messages, stop, kwargs, False)
+        done, _ = wait({future}, timeout=self.deadline)
+        if not done:
+            raise LLMDeadlineExceeded(f"No reply from the fallback model within {self.deadline}s")
+        return future.result()
+
+
+def build_fallback(**kwargs) -> Optional[BaseChatModel]:
+    """The fallback chat model configured by FALLBACK_MODEL / FALLBACK_BASE_URL, if any."""
+    if not FALLBACK_MODEL:
+        return None
+    from langchain_openai import ChatOpenAI
+    kwargs.setdefault("max_retries", 0)
+    kwargs.setdefault("request_timeout", LLM_DEADLINE_SECONDS)
+    return ChatOpenAI(
+        model=FALLBACK_MODEL,
+        base_url=FALLBACK_BASE_URL,
+        api_key=FALLBACK_API_KEY or os.environ.get("OPENAI_API_KEY"),
+        **kwargs,
+    )
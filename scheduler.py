@@ -0,0 +1,188 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+QUEUE_DEPTH = REGISTRY.gauge("agent_queue_depth", "Agent turns waiting for a worker")
+DROPPED = REGISTRY.counter("agent_requests_dropped_total", "Agent turns rejected by the scheduler", ["reason"])
+SCHEDULER_WAIT_SECONDS = REGISTRY.histogram("agent_scheduler_wait_seconds", "Time an agent turn waited in the scheduler queue")
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+
+
+class SchedulerBusy(Exception):
+    """Raised when a request is shed instead of queued."""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, holding at most `capacity`."""
+
+    def __init__(self, rate: float, capacity: float, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self._clock = clock
+        self._tokens = capacity
+        self._updated = clock()
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens: float = 1) -> bool:
+        self._refill()
+        if self._tokens >= tokens:
+            self._tokens -= tokens
+            return True
+        return False
+
+    def time_until_available(self, tokens: float = 1) -> float:
+        """Seconds until `tokens` can be acquired."""
+        self._refill()
+        if self._tokens >= tokens:
+            return 0.0
+        return (tokens - self._tokens) / self.rate if self.rate else float("inf")
+
+    @property
+    def is_full(self) -> bool:
+        self._refill()
+        return self._tokens >= self.capacity
+
+
+class _Job:
+    __slots__ = ("priority", "seq", "fn", "args", "future", "enqueued")
+
+    def __init__(self, priority, seq, fn, args, future):
+        self.priority = priority
+        self.seq = seq
+        self.fn = fn
+        self.args = args
+        self.future = future
+        self.enqueued = time.perf_counter()
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class AgentScheduler:
+    """
+    Admission control in front of agent turns.
+
+    Each chat has its own token bucket and all chats share a global one. Turns
+    that pass the per-chat limit wait in a bounded priority queue, and workers
+    take them off the queue as global tokens become available. High-priority
+    turns (the bot owner) jump the queue and, when it is full, displace the
+    newest normal-priority turn. Anything that can't be admitted raises
+    SchedulerBusy straight away so the caller can reply quickly.
+    """
+
+    def __init__(self, workers: int = 4, max_queue: int = 20,
+                 chat_rate: float = 0.1, chat_burst: float = 3,
+                 global_rate: float = 0.5, global_burst: float = 10):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="agent")
+        self._chat_buckets: Dict[Any, TokenBucket] = {}
+        self._queue: List[_Job] = []
+        self._seq = itertools.count()
+        self._not_empty: Optional[asyncio.Condition] = None
+        self._worker_tasks: List[asyncio.Task] = []
+
+    @property
+    def depth(self) -> int:
+        return len(self._queue)
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        # Drop idle buckets so the map doesn't grow with every chat ever seen
+        if len(self._chat_buckets) > 1000:
+            for key in [k for k, b in self._chat_buckets.items() if b.is_full and k != chat_id]:
+                del self._chat_buckets[key]
+        return bucket
+
+    def _ensure_workers(self):
+        if self._worker_tasks:
+            return
+        self._not_empty = asyncio.Condition()
+        self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    def _drop(self, reason: str) -> SchedulerBusy:
+        DROPPED.inc(reason=reason)
+        return SchedulerBusy(reason)
+
+    async def submit(self, chat_id, fn: Callable, *args, priority: int = PRIORITY_NORMAL):
+        """Queue fn(*args) to run on a worker thread and wait for its result."""
+        self._ensure_workers()
+
+        if priority != PRIORITY_HIGH and not self._chat_bucket(chat_id).try_acquire():
+            logger.info(f"Rate limited chat {chat_id}")
+            raise self._drop("rate_limited")
+
+        if len(self._queue) >= self.max_queue:
+            newest_normal = max((job for job in self._queue if job.priority != PRIORITY_HIGH), default=None)
+            if priority != PRIORITY_HIGH or newest_normal is None:
+                logger.info(f"Queue full, shedding request from chat {chat_id}")
+                raise self._drop("queue_full")
+            self._queue.remove(newest_normal)
+            heapq.heapify(self._queue)
+            newest_normal.future.set_exception(self._drop("evicted"))
+
+        job = _Job(priority, next(self._seq), fn, args, asyncio.get_running_loop().create_future())
+        heapq.heappush(self._queue, job)
+        QUEUE_DEPTH.set(len(self._queue))
+        async with self._not_empty:
+            self._not_empty.notify()
+        return await job.future
+
+    async def shutdown(self):
+        """Stop the worker tasks. Queued turns are abandoned."""
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            async with self._not_empty:
+                await self._not_empty.wait_for(lambda: self._queue)
+
+            # Wait for global capacity, then take a token only if a job is still waiting for it
+            # (another worker may have taken it, or its caller gone away, while we slept)
+            while (wait := self.global_bucket.time_until_available()) > 0:
+                await asyncio.sleep(wait)
+            while self._queue and self._queue[0].future.done():
+                heapq.heappop(self._queue)
+            QUEUE_DEPTH.set(len(self._queue))
+            if not self._queue:
+                continue
+            job = heapq.heappop(self._queue)
+            QUEUE_DEPTH.set(len(self._queue))
+            self.global_bucket.try_acquire()
+            SCHEDULER_WAIT_SECONDS.observe(time.perf_counter() - job.enqueued)
+
+            try:
+                result = await loop.run_in_executor(self.executor, job.fn, *job.args)
+            except Exception as e:
+                if not job.future.done():
+                    job.future.set_exception(e)
+            else:
+                if not job.future.done():
+                    job.future.set_result(result)
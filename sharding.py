@@ -0,0 +1,172 @@
+import asyncio
+import importlib
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import zlib
+from typing import List, Optional, Set
+
+from telegram import Update
+from telegram.ext import ApplicationHandlerStop, ContextTypes
+
+from metrics import REGISTRY, start_metrics_server
+from store import connect
+
+logger = logging.getLogger(__name__)
+
+SHARD_RESTARTS = REGISTRY.counter("shard_worker_restarts_total", "Shard worker processes restarted after exiting", ["shard"])
+SHARD_ROUTED = REGISTRY.counter("shard_updates_routed_total", "Updates forwarded to shard workers", ["shard"])
+SHARD_REPLAYED = REGISTRY.counter("shard_updates_replayed_total", "Unfinished updates handled again by a restarted worker", ["shard"])
+
+
+def shard_for(chat_id: Optional[int], workers: int) -> int:
+    """Stable chat -> worker assignment, so a chat's updates always land on the same worker."""
+    if chat_id is None:
+        return 0
+    return zlib.crc32(str(chat_id).encode()) % workers
+
+
+class UpdateJournal:
+    """
+    Updates forwarded to shard workers and not yet handled, in the state database.
+
+    The front process adds each update before queueing it, and the worker
+    removes it once its handlers have finished. A worker that starts (or
+    restarts after a crash) handles whatever is left for its chats first, so
+    an update is handled at least once.
+    """
+
+    def __init__(self, conn=None):
+        self._conn = conn or connect()
+        self._conn.execute("CREATE TABLE IF NOT EXISTS shard_journal (update_id INTEGER PRIMARY KEY, chat_id INTEGER, data TEXT)")
+
+    def add(self, update_id: int, chat_id: Optional[int], data: dict):
+        self._conn.execute("INSERT OR REPLACE INTO shard_journal (update_id, chat_id, data) VALUES (?, ?, ?)",
+                           (update_id, chat_id, json.dumps(data)))
+
+    def done(self, update_id: int):
+        self._conn.execute("DELETE FROM shard_journal WHERE update_id = ?", (update_id,))
+
+    def pending(self, index: int, workers: int) -> List[dict]:
+        """Unfinished updates for a shard's chats, oldest first."""
+        rows = self._conn.execute("SELECT chat_id, data FROM shard_journal ORDER BY update_id").fetchall()
+        return [json.loads(data) for chat_id, data in rows if shard_for(chat_id, workers) == index]
+
+
+class ShardRouter:
+    """
+    Front-process side of sharded mode.
+
+    Owns one update queue and one worker process per shard. Updates are
+    serialized, journaled and put on the queue of the shard their chat hashes
+    to. Queues belong to the front process, so updates waiting for a worker
+    that crashes are picked up by its replacement, which also handles again
+    the updates the crashed worker had taken but not finished.
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._ctx = multiprocessing.get_context("spawn")
+        self.queues = [self._ctx.Queue() for _ in range(workers)]
+        self.processes: List[Optional[multiprocessing.Process]] = [None] * workers
+        self._supervisor: Optional[asyncio.Task] = None
+        self._stopping = False
+        self._journal = UpdateJournal()
+
+    def _spawn(self, index: int):
+        process = self._ctx.Process(target=worker_main, args=(index, self.workers, self.queues[index]), name=f"shard-{index}", daemon=True)
+        process.start()
+        self.processes[index] = process
+        logger.info(f"Started shard worker {index} (pid {process.pid})")
+
+    async def start(self):
+        for index in range(self.workers):
+            self._spawn(index)
+        self._supervisor = asyncio.create_task(self._supervise())
+
+    async def _supervise(self):
+        while not self._stopping:
+            await asyncio.sleep(1)
+            for index, process in enumerate(self.processes):
+                if not self._stopping and process is not None and not process.is_alive():
+                    logger.error(f"Shard worker {index} exited with code {process.exitcode}, restarting")
+                    SHARD_RESTARTS.inc(shard=index)
+                    self._spawn(index)
+
+    async def forward(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handler that sends every update to its shard instead of handling it here."""
+        chat = update.effective_chat
+        chat_id = chat.id if chat else None
+        index = shard_for(chat_id, self.workers)
+        data = update.to_dict()
+        self._journal.add(update.update_id, chat_id, data)
+        self.queues[index].put(data)
+        SHARD_ROUTED.inc(shard=index)
+        raise ApplicationHandlerStop
+
+    async def stop(self):
+        self._stopping = True
+        if self._supervisor:
+            self._supervisor.cancel()
+        for queue in self.queues:
+            queue.put(None)
+        loop = asyncio.get_running_loop()
+        for process in self.processes:
+            if process is not None:
+                await loop.run_in_executor(None, process.join, 10)
+                if process.is_alive():
+                    process.terminate()
+
+
+def worker_main(index: int, workers: int, queue):
+    """Entry point of a shard worker process."""
+    # Each worker serves its own metrics on the port after the front process's
+    base_port = int(os.getenv("METRICS_PORT", "9464"))
+    if base_port:
+        start_metrics_server(port=base_port + 1 + index)
+    asyncio.run(_serve(index, workers, queue))
+
+
+def _bot_module():
+    """
+    The bot module inside a worker. Spawned workers re-run the parent's entry
+    point as __mp_main__, so reuse it rather than importing bot.py a second time.
+    """
+    main = sys.modules.get("__mp_main__")
+    if hasattr(main, "build_application"):
+        return main
+    return importlib.import_module("bot")
+
+
+async def _serve(index: int, workers: int, queue):
+    bot = _bot_module()
+    bot.shard_index = index
+    application = bot.build_application()
+    journal = UpdateJournal()
+    # Acknowledge updates once their handlers have finished
+    application.update_processor.on_processed = lambda update: journal.done(update.update_id)
+    loop = asyncio.get_running_loop()
+    async with application:
+        await bot.post_init(application)
+        await application.start()
+
+        # Updates a previous worker took but didn't finish; any still queued are skipped when they come up
+        replayed: Set[int] = set()
+        for data in journal.pending(index, workers):
+            replayed.add(data["update_id"])
+            SHARD_REPLAYED.inc(shard=index)
+            await application.update_queue.put(Update.de_json(data, application.bot))
+        logger.info(f"Shard worker {index} ready ({len(replayed)} unfinished updates replayed)")
+
+        while True:
+            data = await loop.run_in_executor(None, queue.get)
+            if data is None:
+                break
+            if data["update_id"] in replayed:
+                replayed.discard(data["update_id"])
+                continue
+            await application.update_queue.put(Update.de_json(data, application.bot))
+        await application.stop()
+        await bot.post_shutdown(application)
@@ -19,7 +19,7 @@ class LTADataMallBus:
         if not self.api_key:
             raise ValueError("API key must be provided either directly or through LTA_API_KEY environment variable")
         
-        self.base_url = "http://datamall2.mytransport.sg/ltaodataservice"
+        self.base_url = os.getenv('LTA_BASE_URL', "http://datamall2.mytransport.sg/ltaodataservice")
         self.headers = {
             'AccountKey': self.api_key,
             'accept': 'application/json'
@@ -108,7 +108,22 @@ class LTADataMallBus:
             Dict: Response containing bus arrival information
         """
         services = self.get_bus_arrival(bus_stop_code)['Services']
-        return[(service['ServiceNo'], service['NextBus']['EstimatedArrival'], service['NextBus']['Load'], service['NextBus']['Type']) for service in services]
+        return self.concise_services(services, service_no)
+
+    @staticmethod
+    def concise_services(services: List[Dict], service_no: Optional[str] = None) -> List[tuple]:
+        """
+        Reduce BusArrivalv2 services to (service_no, estimated_arrival, load, type) of the next bus.
+        
+        Args:
+            services (List[Dict]): The 'Services' list of a bus arrival response
+            service_no (str, optional): Only keep this bus service.
+        
+        Returns:
+            List[tuple]: One tuple per service
+        """
+        return [(service['ServiceNo'], service['NextBus']['EstimatedArrival'], service['NextBus']['Load'], service['NextBus']['Type'])
+                for service in services if not service_no or service['ServiceNo'] == service_no]
     
 
 
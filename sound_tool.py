@@ -1,9 +1,11 @@
 from typing import Optional
 from langchain.tools import BaseTool
 from langchain_core.pydantic_v1 import BaseModel, Field
+from langchain_core.runnables import RunnableConfig
 import requests
 import os
 from dotenv import load_dotenv
+from outbound import OutboundMedia, outbound
 
 load_dotenv()
 
@@ -19,12 +21,19 @@ class SoundTool(BaseTool):
     description: str = "Convert text to speech using ElevenLabs API and send it to Telegram. Use this tool when you want to speak to the user verbally."
     args_schema: BaseModel = SoundToolInput
 
-    def _run(self, text: str, voice_id: Optional[str] = None) -> str:
+    def _run(self, text: str, voice_id: Optional[str] = None, config: RunnableConfig = None) -> str:
         """Convert text to speech and send to Telegram."""
         ELEVEN_LABS_API_KEY = os.getenv("ELEVEN_LABS_API_KEY")
         if not ELEVEN_LABS_API_KEY:
             raise ValueError("ELEVEN_LABS_API_KEY not found in environment variables")
 
+        # Voice messages go to the chat this turn belongs to
+        chat_id = (config or {}).get("configurable", {}).get("thread_id") or os.getenv("TELEGRAM_CHAT_ID")
+        if not chat_id:
+            raise ValueError("No chat to send the voice message to")
+        if not outbound.running:
+            raise RuntimeError("Voice messages can only be sent while the bot is running")
+
         # Set default voice if not provided
         voice_id = voice_id or "qJT4OuZyfpn7QbUnrLln"
 
@@ -47,30 +56,12 @@ class SoundTool(BaseTool):
         if response.status_code != 200:
             raise Exception(f"Failed to generate speech: {response.text}")
 
-        # Save to temporary file
-        speech_file = "data/output.mp3"
-        with open(speech_file, "wb") as f:
-            f.write(response.content)
-
-        # Send to Telegram
-        TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
-        CHAT_ID = os.getenv("TELEGRAM_CHAT_ID")
-        
-        if not TOKEN or not CHAT_ID:
-            raise ValueError("TELEGRAM_BOT_TOKEN or TELEGRAM_CHAT_ID not found in environment variables")
-
-        with open(speech_file, 'rb') as audio_file:
-            telegram_response = requests.post(
-                f'https://api.telegram.org/bot{TOKEN}/sendVoice',
-                data={'chat_id': CHAT_ID},
-                files={'voice': audio_file}
-            )
-
-        if telegram_response.status_code != 200:
-            raise Exception(f"Failed to send to Telegram: {telegram_response.text}")
+        # Hand the audio to the bot's outbound queue; it is sent to the chat
+        # without holding up the rest of the turn
+        outbound.submit(OutboundMedia(int(chat_id), "voice", response.content, filename="speech.mp3"))
 
-        return "Successfully generated and sent speech to Telegram"
+        return "Successfully generated speech; it is being sent to the chat as a voice message"
 
-    async def _arun(self, text: str, voice_id: Optional[str] = None) -> str:
+    async def _arun(self, text: str, voice_id: Optional[str] = None, config: RunnableConfig = None) -> str:
         """Async version of the tool."""
-        return self._run(text, voice_id) 
\ No newline at end of file
+        return self._run(text, voice_id, config=config) 
\ No newline at end of file
@@ -0,0 +1,217 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Iterator, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Durable state shared between processes. When STATE_DB_PATH is unset the bot
+# keeps everything in memory, as a single process always has.
+STATE_DB_PATH = os.getenv('STATE_DB_PATH')
+
+# How often caches sweep out expired entries (on write)
+CACHE_PRUNE_INTERVAL_SECONDS = 60
+
+_connections = {}
+_connections_lock = threading.Lock()
+# Threads share the transaction connection, so only one may have a transaction open on it at a time
+_transaction_lock = threading.Lock()
+
+
+def connect(path: Optional[str] = None, role: str = "shared") -> sqlite3.Connection:
+    """
+    Get this process's connection to the state database.
+
+    The database runs in WAL mode so several worker processes can read while
+    one writes. One connection is shared per process, path and role; explicit
+    transactions ("transactions") and the checkpointer ("checkpoints") get
+    their own, so nothing else commits or joins a transaction half way.
+    """
+    path = path or STATE_DB_PATH
+    with _connections_lock:
+        key = (os.getpid(), path, role)
+        if key not in _connections:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            conn = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            _connections[key] = conn
+        return _connections[key]
+
+
+class PersistentSet:
+    """A set of JSON-serializable values stored in SQLite, shared by all processes."""
+
+    def __init__(self, name: str, conn: Optional[sqlite3.Connection] = None):
+        self.name = name
+        self._conn = conn or connect()
+        self._conn.execute("CREATE TABLE IF NOT EXISTS sets (name TEXT, value TEXT, PRIMARY KEY (name, value))")
+
+    def add(self, value):
+        self._conn.execute("INSERT OR IGNORE INTO sets (name, value) VALUES (?, ?)", (self.name, json.dumps(value)))
+
+    def discard(self, value):
+        self._conn.execute("DELETE FROM sets WHERE name = ? AND value = ?", (self.name, json.dumps(value)))
+
+    def __contains__(self, value) -> bool:
+        row = self._conn.execute("SELECT 1 FROM sets WHERE name = ? AND value = ?", (self.name, json.dumps(value))).fetchone()
+        return row is not None
+
+    def __iter__(self) -> Iterator:
+        rows = self._conn.execute("SELECT value FROM sets WHERE name = ?", (self.name,)).fetchall()
+        return iter([json.loads(value) for (value,) in rows])
+
+    def __len__(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM sets WHERE name = ?", (self.name,)).fetchone()[0]
+
+
+class SharedCache:
+    """A namespaced key/value cache with optional expiry, stored in SQLite."""
+
+    def __init__(self, namespace: str, conn: Optional[sqlite3.Connection] = None):
+        self.namespace = namespace
+        self._conn = conn or connect()
+        self._path = self._conn.execute("PRAGMA database_list").fetchone()[2]
+        self._next_prune = 0.0
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache (namespace TEXT, key TEXT, value TEXT, expires REAL, "
+            "PRIMARY KEY (namespace, key))"
+        )
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self._get(self._conn, key, default)
+
+    def _get(self, conn: sqlite3.Connection, key: str, default: Any = None) -> Any:
+        row = conn.execute(
+            "SELECT value, expires FROM cache WHERE namespace = ? AND key = ?", (self.namespace, key)
+        ).fetchone()
+        if row is None or (row[1] is not None and row[1] < time.time()):
+            return default
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        self._set(self._conn, key, value, ttl)
+
+    def _set(self, conn: sqlite3.Connection, key: str, value: Any, ttl: Optional[float] = None):
+        now = time.time()
+        if now >= self._next_prune:
+            self._next_prune = now + CACHE_PRUNE_INTERVAL_SECONDS
+            conn.execute("DELETE FROM cache WHERE namespace = ? AND expires < ?", (self.namespace, now))
+        expires = now + ttl if ttl else None
+        conn.execute(
+            "INSERT OR REPLACE INTO cache (namespace, key, value, expires) VALUES (?, ?, ?, ?)",
+            (self.namespace, key, json.dumps(value), expires),
+        )
+
+    def update(self, key: str, fn: Callable[[Any], Any], ttl: Optional[float] = None) -> Any:
+        """Replace a value (None if missing) with fn(value) atomically, across threads and processes."""
+        conn = connect(self._path, "transactions")
+        with _transaction_lock:
+            # IMMEDIATE takes the database write lock up front, so no other process can interleave
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                value = fn(self._get(conn, key))
+                self._set(conn, key, value, ttl)
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+        return value
+
+    def delete(self, key: str):
+        self._conn.execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (self.namespace, key))
+
+
+class MemoryCache:
+    """
+    In-process stand-in for SharedCache when no state database is configured.
+
+    Holds at most max_entries (if set), dropping the oldest writes first.
+    """
+
+    def __init__(self, namespace: str = "", max_entries: Optional[int] = None):
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self._data = {}
+        self._next_prune = 0.0
+        self._lock = threading.RLock()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        value, expires = self._data.get(key, (default, None))
+        if expires is not None and expires < time.time():
+            return default
+        return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        now = time.time()
+        with self._lock:
+            if now >= self._next_prune:
+                self._next_prune = now + CACHE_PRUNE_INTERVAL_SECONDS
+                self._data = {k: v for k, v in self._data.items() if v[1] is None or v[1] >= now}
+            # Re-insert so the dict stays in write order
+            self._data.pop(key, None)
+            self._data[key] = (value, now + ttl if ttl else None)
+            while self.max_entries and len(self._data) > self.max_entries:
+                del self._data[next(iter(self._data))]
+
+    def update(self, key: str, fn: Callable[[Any], Any], ttl: Optional[float] = None) -> Any:
+        """Replace a value (None if missing) with fn(value) atomically."""
+        with self._lock:
+            value = fn(self.get(key))
+            self.set(key, value, ttl)
+        return value
+
+    def delete(self, key: str):
+        with self._lock:
+            self._data.pop(key, None)
+
+
+def get_set(name: str):
+    """A PersistentSet when a state database is configured, else a plain set."""
+    return PersistentSet(name) if STATE_DB_PATH else set()
+
+
+def get_cache(namespace: str, max_entries: Optional[int] = None):
+    """A SharedCache when a state database is configured, else an in-memory cache of at most max_entries."""
+    return SharedCache(namespace) if STATE_DB_PATH else MemoryCache(namespace, max_entries)
+
+
+_checkpointer = None
+
+
+def get_checkpointer():
+    """
+    Checkpointer for agent conversation state.
+
+    With a state database every process shares a SQLite checkpointer, so a
+    conversation survives a worker restart. Otherwise each graph gets its own
+    in-memory saver.
+    """
+    global _checkpointer
+    if not STATE_DB_PATH:
+        from langgraph.checkpoint.memory import MemorySaver
+        return MemorySaver()
+    if _checkpointer is None:
+        from langgraph.checkpoint.sqlite import SqliteSaver
+        _checkpointer = SqliteSaver(connect(role="checkpoints"))
+        _checkpointer.setup()
+    return _checkpointer
+
+
+def clear_thread(checkpointer, thread_id: str):
+    """Delete a conversation's checkpoints, so its next turn starts afresh."""
+    from langgraph.checkpoint.memory import MemorySaver
+    if isinstance(checkpointer, MemorySaver):
+        checkpointer.storage.pop(thread_id, None)
+        for store in (checkpointer.writes, checkpointer.blobs):
+            for key in [key for key in store if key[0] == thread_id]:
+                del store[key]
+        return
+    with checkpointer.lock:
+        checkpointer.conn.execute("DELETE FROM checkpoints WHERE thread_id = ?", (thread_id,))
+        checkpointer.conn.execute("DELETE FROM writes WHERE thread_id = ?", (thread_id,))
@@ -0,0 +1,135 @@
+import asyncio
+
+import pytest
+from telegram.error import RetryAfter, TimedOut
+
+import bus_watch
+import fakes
+from bus_watch import BusWatcher
+
+
+class FakeBot:
+    """Records the messages a watcher sends and edits."""
+
+    def __init__(self, errors=()):
+        self.sent = []
+        self.edits = []
+        self.errors = list(errors)
+
+    async def send_message(self, chat_id, text):
+        self.sent.append((chat_id, text))
+        return type('obj', (object,), {'message_id': len(self.sent)})
+
+    async def edit_message_text(self, text, chat_id, message_id):
+        if self.errors:
+            raise self.errors.pop(0)
+        self.edits.append((chat_id, message_id, text))
+
+
+@pytest.fixture
+def lta(monkeypatch):
+    """Fixture for a local fake LTA DataMall server."""
+    with fakes.FakeLTAServer() as server:
+        monkeypatch.setenv("LTA_API_KEY", "fake")
+        monkeypatch.setenv("LTA_BASE_URL", server.url)
+        yield server
+
+
+class TestBusWatcher:
+    """Test shared-poll bus arrival watches."""
+
+    @pytest.mark.asyncio
+    async def test_one_poll_per_stop(self, lta):
+        """Test a stop is polled once per interval however many chats watch it."""
+        watcher = BusWatcher(interval=0.2)
+        bot = FakeBot()
+        for chat_id in (1, 2, 3):
+            assert await watcher.add(bot, chat_id, "52071") is None
+        await asyncio.sleep(0.1)
+        polls_after_first_round = lta.request_count
+        await asyncio.sleep(0.2)
+        assert lta.request_count - polls_after_first_round == 1, "Watched stop should be polled once per interval"
+        assert {chat_id for chat_id, _, _ in bot.edits} == {1, 2, 3}
+        assert "Bus Stop 52071" in bot.edits[-1][2]
+        await watcher.stop()
+
+    @pytest.mark.asyncio
+    async def test_timeout_and_unwatch(self, lta):
+        """Test watches end on timeout and /unwatch removes them."""
+        watcher = BusWatcher(interval=0.05, timeout=0)
+        bot = FakeBot()
+        await watcher.add(bot, 1, "52071")
+        await asyncio.sleep(0.1)
+        assert "timed out" in bot.edits[-1][2]
+        assert not watcher.watches
+
+        watcher.timeout = 60
+        await watcher.add(bot, 1, "52071", "10")
+        assert watcher.remove(1) == 1
+        assert not watcher.watches
+        await watcher.stop()
+
+    @pytest.mark.asyncio
+    async def test_limit_per_chat(self, lta):
+        """Test a chat can't start more than max_per_chat watches."""
+        watcher = BusWatcher(max_per_chat=1)
+        bot = FakeBot()
+        assert await watcher.add(bot, 1, "52071") is None
+        assert await watcher.add(bot, 1, "52072") is not None
+        await watcher.stop()
+
+    @pytest.mark.asyncio
+    async def test_edit_errors_keep_polling(self, lta):
+        """Test a timed out edit is skipped and the watch keeps updating on later polls."""
+        watcher = BusWatcher(interval=0.1)
+        bot = FakeBot(errors=[TimedOut()])
+        await watcher.add(bot, 1, "52071")
+        await asyncio.sleep(0.25)
+        assert not watcher._task.done()
+        assert bot.edits, "Later polls should still edit the message"
+        await watcher.stop()
+
+    @pytest.mark.asyncio
+    async def test_flood_control_pauses_edits(self, lta):
+        """Test a flood wait skips that watch's edits until it has passed."""
+        watcher = BusWatcher(interval=0.05)
+        bot = FakeBot(errors=[RetryAfter(60)])
+        await watcher.add(bot, 1, "52071")
+        await asyncio.sleep(0.2)
+        assert not bot.edits
+        assert watcher.watches["52071"][0].retry_at > 0
+        await watcher.stop()
+
+    @pytest.mark.asyncio
+    async def test_timeout_while_polls_fail(self, lta, monkeypatch):
+        """Test watches still time out while DataMall is erroring."""
+        def fail(client, code):
+            raise ConnectionError("DataMall is down")
+
+        monkeypatch.setattr(bus_watch.arrival_cache, "refresh", fail)
+        watcher = BusWatcher(interval=0.05, timeout=0)
+        bot = FakeBot()
+        await watcher.add(bot, 1, "52071")
+        await asyncio.sleep(0.1)
+        assert "timed out" in bot.edits[-1][2]
+        assert not watcher.watches
+        await watcher.stop()
+
+    @pytest.mark.asyncio
+    async def test_new_subscriber_gets_last_poll(self, lta):
+        """Test joining a stop that is already watched shows its last poll without polling again."""
+        watcher = BusWatcher(interval=60)
+        bot = FakeBot()
+        await watcher.add(bot, 1, "52071")
+        await asyncio.sleep(0.1)
+        polls = lta.request_count
+
+        await watcher.add(bot, 2, "52071")
+        await asyncio.sleep(0.05)
+        assert lta.request_count == polls
+        assert bot.edits[-1][0] == 2 and "Bus Stop 52071" in bot.edits[-1][2]
+
+        await watcher.add(bot, 3, "52072")
+        await asyncio.sleep(0.1)
+        assert lta.request_count == polls + 1, "A newly watched stop is polled straight away"
+        await watcher.stop()
@@ -0,0 +1,64 @@
+import pytest
+
+import chinese_tool
+
+
+@pytest.fixture
+def memo(tmp_path, monkeypatch):
+    """Fixture for an empty translation memo and a counting fake translator."""
+    memo = chinese_tool.TranslationMemo(str(tmp_path / "memo.db"))
+    monkeypatch.setattr(chinese_tool, "_memo", memo)
+    calls = []
+
+    def fake_translate(phrase, direction):
+        calls.append((phrase, direction))
+        return {"en-zh": "你好", "zh-en": "Hello"}[direction]
+
+    monkeypatch.setattr(chinese_tool, "llm_translate", fake_translate)
+    return calls
+
+
+class TestPinyin:
+    """Test local pinyin generation."""
+
+    def test_tone_marks(self):
+        """Test Chinese text is romanized with tone marks."""
+        assert chinese_tool.to_pinyin("你好") == "nǐ hǎo"
+
+    def test_neutral_tone(self):
+        """Test everyday words with a neutral last syllable are romanized that way, inside longer text too."""
+        assert chinese_tool.to_pinyin("谢谢你！") == "xiè xie nǐ！"
+        assert chinese_tool.to_pinyin("我的好朋友") == "wǒ de hǎo péng you"
+
+    def test_mixed_text(self):
+        """Test punctuation attaches to the previous syllable and latin text is kept."""
+        assert chinese_tool.to_pinyin("我爱Python！") == "wǒ ài Python！"
+
+
+class TestTranslationMemo:
+    """Test memoized translations."""
+
+    def test_llm_only_called_on_miss(self, memo):
+        """Test a repeated phrase is answered from the memo."""
+        first = chinese_tool.translate("Hello!")
+        second = chinese_tool.translate("  hello ")
+        assert first.endswith("Chinese: 你好\nPinyin: nǐ hǎo")
+        assert second == "English: hello\nChinese: 你好\nPinyin: nǐ hǎo"
+        assert memo == [("Hello!", "en-zh")], "LLM should only be called once"
+
+    def test_quick_answer_pinyin(self, memo):
+        """Test pinyin-only requests never reach the LLM."""
+        assert chinese_tool.quick_answer("pinyin for 谢谢") == "谢谢\nPinyin: xiè xie"
+        assert memo == []
+
+    def test_quick_answer_translation(self, memo):
+        """Test translation requests are answered locally only after a memo entry exists."""
+        assert chinese_tool.quick_answer("How do I say hello in Chinese?") is None
+        chinese_tool.translate("hello")
+        answer = chinese_tool.quick_answer("How do I say hello in Chinese?")
+        assert answer is not None and "Chinese: 你好" in answer
+        assert len(memo) == 1
+
+    def test_quick_answer_ignores_other_messages(self, memo):
+        """Test unrelated messages go to the agent."""
+        assert chinese_tool.quick_answer("what's on my calendar tomorrow?") is None
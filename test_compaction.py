@@ -0,0 +1,138 @@
+import json
+import re
+import time
+
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langgraph.graph.message import add_messages
+
+import compaction
+from compaction import FetchToolOutputTool, clean_output, compact, compact_tool_outputs, release_fetched_outputs
+from store import MemoryCache
+
+
+@pytest.fixture(autouse=True)
+def output_store(monkeypatch):
+    """Fixture for an empty tool output store."""
+    store = compaction.ToolOutputStore()
+    store._cache = MemoryCache("tool_outputs")
+    monkeypatch.setattr(compaction, "output_store", store)
+    return store
+
+
+def email_body(paragraphs=40):
+    body = "<html><style>p {color: red}</style><p>Hi Nic,</p>"
+    body += "".join(f"<p>Paragraph {i} of the newsletter &amp; more.</p>\n" for i in range(paragraphs))
+    body += "\nOn Mon, 3 Jun 2024 at 10:00, Someone <someone@example.com> wrote:\n> older message\n> even older"
+    return body
+
+
+class TestCleanup:
+    """Test stripping HTML and quoted text from tool outputs."""
+
+    def test_strips_html_and_quoted_history(self):
+        """Test tags, styles and the quoted reply chain are removed."""
+        cleaned = clean_output(email_body(2))
+        assert "<" not in cleaned and "color: red" not in cleaned
+        assert "newsletter & more" in cleaned
+        assert "older message" not in cleaned and "wrote:" not in cleaned
+
+    def test_cleans_json_fields(self):
+        """Test JSON outputs are cleaned field by field and stay valid JSON."""
+        content = json.dumps([{"id": "1", "body": "<b>Hello</b>\n> quoted"}])
+        assert json.loads(clean_output(content)) == [{"id": "1", "body": "Hello"}]
+
+
+class TestCompact:
+    """Test capping tool outputs and fetching them back."""
+
+    def test_small_outputs_are_kept(self):
+        """Test outputs under the cap are not truncated."""
+        assert compact("Bus 21: 3 min", "bus_arrival_query") == "Bus 21: 3 min"
+
+    def test_large_output_is_fetchable_by_ref(self):
+        """Test a large output is truncated to its cap and the full output can be fetched."""
+        content = json.dumps([{"body": email_body()} for _ in range(5)])
+        compacted = compact(content, "search_gmail")
+        assert len(compacted) < compaction.TOOL_CAPS["search_gmail"] + 200
+        ref = re.search(r'ref="(\w+)"', compacted).group(1)
+
+        fetch = FetchToolOutputTool(page_size=len(content))
+        assert fetch.invoke({"ref": ref}) == content
+        assert "No stored output" in fetch.invoke({"ref": "missing"})
+
+    def test_fetch_pages_through_output(self):
+        """Test long outputs are fetched a page at a time."""
+        content = "x" * 250
+        ref = compaction.output_store.put(content)
+        fetch = FetchToolOutputTool(page_size=100)
+        assert "offset=100" in fetch.invoke({"ref": ref})
+        assert fetch.invoke({"ref": ref, "offset": 200}) == "x" * 50
+
+    def test_exempt_tools_are_untouched(self):
+        """Test fetched outputs aren't compacted again."""
+        content = "<p>" + "y" * 10000 + "</p>"
+        assert compact(content, compaction.FETCH_TOOL_NAME) == content
+
+
+class TestCompactNode:
+    """Test the graph node that compacts tool messages."""
+
+    def test_replaces_only_latest_tool_messages(self):
+        """Test the node compacts this step's tool messages in place, keeping ids and order."""
+        big = email_body()
+        messages = add_messages([], [
+            HumanMessage(content="check my mail"),
+            AIMessage(content="", tool_calls=[{"name": "search_gmail", "args": {}, "id": "call_1"}]),
+            ToolMessage(content=big, name="search_gmail", tool_call_id="call_1"),
+            AIMessage(content="", tool_calls=[
+                {"name": "get_gmail_message", "args": {}, "id": "call_2"},
+                {"name": "bus_arrival_query", "args": {}, "id": "call_3"},
+            ]),
+            ToolMessage(content=big, name="get_gmail_message", tool_call_id="call_2"),
+            ToolMessage(content="Bus 21: 3 min", name="bus_arrival_query", tool_call_id="call_3"),
+        ])
+
+        update = compact_tool_outputs({"messages": messages})
+        assert [m.tool_call_id for m in update["messages"]] == ["call_2"]
+
+        merged = add_messages(messages, update["messages"])
+        assert len(merged) == len(messages)
+        assert merged[2].content == big, "Earlier steps were already compacted when they ran"
+        assert len(merged[4].content) < len(big)
+        assert merged[5].content == "Bus 21: 3 min"
+
+    def test_fetched_pages_are_released_next_turn(self):
+        """Test pages read with fetch_tool_output are replaced by a note once a new turn starts."""
+        page = "z" * 8000
+        messages = add_messages([], [
+            HumanMessage(content="read the rest of that email"),
+            AIMessage(content="", tool_calls=[
+                {"name": compaction.FETCH_TOOL_NAME, "args": {"ref": "abc123", "offset": 1500}, "id": "call_1"}]),
+            ToolMessage(content=page, name=compaction.FETCH_TOOL_NAME, tool_call_id="call_1"),
+            AIMessage(content="It says..."),
+            HumanMessage(content="thanks"),
+        ])
+
+        update = release_fetched_outputs({"messages": messages})
+        merged = add_messages(messages, update["messages"])
+        assert len(merged) == len(messages)
+        assert 'ref="abc123" offset=1500' in merged[2].content
+        assert len(merged[2].content) < 200
+        assert release_fetched_outputs({"messages": merged}) == {"messages": []}
+
+
+class TestOutputStore:
+    """Test the in-memory tool output store stays bounded."""
+
+    def test_expired_and_oldest_outputs_are_dropped(self, monkeypatch):
+        """Test expired outputs are pruned on write and the store holds at most max_stored outputs."""
+        store = compaction.ToolOutputStore(ttl_hours=1, max_stored=3)
+        store._cache = MemoryCache("tool_outputs", max_entries=3)
+        refs = [store.put(f"output {i}") for i in range(5)]
+        assert [store.get(ref) for ref in refs] == [None, None, "output 2", "output 3", "output 4"]
+
+        now = time.time()
+        monkeypatch.setattr("store.time.time", lambda: now + 7200)
+        store.put("fresh")
+        assert len(store._cache._data) == 1
@@ -0,0 +1,120 @@
+import asyncio
+
+import pytest
+
+import store
+from debounce import MERGED, MessageCoalescer, PendingMessage, merge
+from sharding import UpdateJournal, shard_for
+from update_processor import ChatOrderedUpdateProcessor
+
+
+class TestMessageCoalescer:
+    """Test per-chat debouncing of message bursts."""
+
+    @pytest.mark.asyncio
+    async def test_burst_becomes_one_turn(self):
+        """Test messages within the window are flushed together, in order."""
+        flushed = []
+
+        async def flush(chat_id, batch):
+            flushed.append((chat_id, merge(batch)))
+
+        coalescer = MessageCoalescer(0.05, flush)
+        merged_before = MERGED.value()
+        for text in ("hey", "what's my calendar", "tomorrow"):
+            coalescer.add(1, PendingMessage(None, text))
+            await asyncio.sleep(0.01)
+        coalescer.add(2, PendingMessage(None, "hi", "replied-to message"))
+        await coalescer.drain()
+
+        assert sorted(flushed) == [
+            (1, ("hey\nwhat's my calendar\ntomorrow", None)),
+            (2, ("hi", "replied-to message")),
+        ]
+        assert MERGED.value() == merged_before + 2
+
+    @pytest.mark.asyncio
+    async def test_separate_windows_stay_ordered(self):
+        """Test a chat's batches are flushed one at a time, in order."""
+        flushed = []
+
+        async def flush(chat_id, batch):
+            await asyncio.sleep(0.05 if batch[0].text == "first" else 0)
+            flushed.append(batch[0].text)
+
+        coalescer = MessageCoalescer(0.01, flush)
+        coalescer.add(1, PendingMessage(None, "first"))
+        await asyncio.sleep(0.03)
+        coalescer.add(1, PendingMessage(None, "second"))
+        await coalescer.drain()
+        assert flushed == ["first", "second"]
+
+    @pytest.mark.asyncio
+    async def test_window_open_for_sender(self):
+        """Test a window is open to the sender who started it, and locks are dropped once flushed."""
+        async def flush(chat_id, batch):
+            pass
+
+        coalescer = MessageCoalescer(0.01, flush)
+        assert not coalescer.is_open(1, 42)
+        coalescer.add(1, PendingMessage(None, "hey", sender=42))
+        assert coalescer.is_open(1, 42)
+        assert not coalescer.is_open(1, 43)
+        await coalescer.drain()
+        assert not coalescer.is_open(1, 42)
+        assert not coalescer._locks
+
+    @pytest.mark.asyncio
+    async def test_flush_now_answers_earlier_messages_first(self):
+        """Test flush_now answers the buffered batch, and waits for one already being answered."""
+        flushed = []
+
+        async def flush(chat_id, batch):
+            await asyncio.sleep(0.02)
+            flushed.append(merge(batch)[0])
+
+        coalescer = MessageCoalescer(10, flush)
+        coalescer.add(1, PendingMessage(None, "hey"))
+        coalescer.add(1, PendingMessage(None, "tomorrow"))
+        await coalescer.flush_now(1)
+        flushed.append("sticker")
+
+        coalescer.window = 0
+        coalescer.add(1, PendingMessage(None, "again"))
+        await asyncio.sleep(0.005)
+        await coalescer.flush_now(1)
+        flushed.append("sticker")
+        await coalescer.drain()
+        assert flushed == ["hey\ntomorrow", "sticker", "again", "sticker"]
+
+
+class TestShardAcknowledgement:
+    """Test buffered messages stay journaled until they are answered."""
+
+    @pytest.mark.asyncio
+    async def test_crash_before_flush_loses_nothing(self, tmp_path):
+        """Test a message still in its debounce window is handed to a replacement worker if its worker crashes."""
+        conn = store.connect(str(tmp_path / "state.db"))
+        journal = UpdateJournal(conn)
+        processor = ChatOrderedUpdateProcessor(8)
+        processor.on_processed = lambda update: journal.done(update.update_id)
+        answered = []
+
+        async def flush(chat_id, batch):
+            answered.extend(item.text for item in batch)
+
+        coalescer = MessageCoalescer(0.05, flush)
+        update = type("obj", (object,), {"update_id": 7, "effective_chat": type("obj", (object,), {"id": 1})})
+        journal.add(7, 1, {"update_id": 7})
+
+        async def handle():
+            coalescer.add(1, PendingMessage(update, "hi", done=processor.hold(update)))
+
+        await processor.process_update(update, handle())
+        # The worker crashing now, between add and flush, leaves the update for its replacement
+        replacement = UpdateJournal(conn)
+        assert [data["update_id"] for data in replacement.pending(shard_for(1, 2), 2)] == [7]
+
+        await coalescer.drain()
+        assert answered == ["hi"]
+        assert replacement.pending(shard_for(1, 2), 2) == []
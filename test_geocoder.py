@@ -0,0 +1,96 @@
+import pandas as pd
+import pytest
+
+from geocoder import PlaceIndex, tokenize
+
+STOPS = [
+    ("53009", "Bishan Int", "Bishan Rd", 1.35067, 103.85118),
+    ("53011", "Opp Bishan Int", "Bishan Rd", 1.35105, 103.85084),
+    ("52071", "Bishan Stn Exit D", "Bishan Rd", 1.35139, 103.84870),
+    ("09047", "Ngee Ann City", "Orchard Rd", 1.30270, 103.83327),
+    ("09048", "Opp Ngee Ann City", "Orchard Blvd", 1.30250, 103.83290),
+    ("08057", "Dhoby Ghaut Stn", "Orchard Rd", 1.29953, 103.84702),
+    ("40189", "Blk 123", "Serangoon Nth Ave 1", 1.36480, 103.87210),
+    ("84031", "Blk 123", "Bedok Nth St 2", 1.32910, 103.93690),
+    ("01012", "Hotel Grand Pacific", "Victoria St", 1.29684, 103.85253),
+    ("50038", "Aft Braddell Rd", "Thomson Rd", 1.34120, 103.84410),
+]
+
+
+@pytest.fixture(scope="module")
+def index():
+    """Fixture for a place index over a handful of real stops."""
+    return PlaceIndex(pd.DataFrame(STOPS, columns=["BusStopCode", "Description", "RoadName", "Latitude", "Longitude"]))
+
+
+class TestTokenize:
+    """Test query normalization."""
+
+    def test_abbreviates_like_lta(self):
+        """Test typed words map to the abbreviations used in the dataset, and filler is dropped."""
+        assert tokenize("Nearest bus stop to Bishan MRT station") == ["bishan", "stn", "stn"]
+        assert tokenize("opposite Block 123, Serangoon North Avenue 1") == ["blk", "123", "serangoon", "nth", "ave", "1"]
+
+
+class TestPlaceIndex:
+    """Test offline place name lookups."""
+
+    def test_landmark_groups_stops_on_both_sides(self, index):
+        """Test a landmark and the stop opposite it are one place."""
+        best, _ = index.geocode("Bishan Interchange")
+        assert best.place.name == "Bishan Int"
+        assert sorted(best.place.stop_codes) == ["53009", "53011"]
+        assert best.place.latitude == pytest.approx(1.35086)
+
+    def test_fuzzy_match(self, index):
+        """Test misspelt names still resolve."""
+        best, _ = index.geocode("ngee an city")
+        assert best.place.name == "Ngee Ann City"
+        best, _ = index.geocode("Dhobby Gaut MRT")
+        assert best.place.stop_codes == ["08057"]
+
+    def test_road(self, index):
+        """Test a road name resolves to the road."""
+        best, _ = index.geocode("Victoria Street")
+        assert best.place.road is None and best.place.name == "Victoria St"
+
+    def test_ambiguous_name_returns_candidates(self, index):
+        """Test a name shared by places far apart is not resolved, but both are offered."""
+        best, candidates = index.geocode("blk 123")
+        assert best is None
+        assert {c.place.road for c in candidates[:2]} == {"Serangoon Nth Ave 1", "Bedok Nth St 2"}
+
+        best, _ = index.geocode("blk 123 bedok north")
+        assert best.place.stop_codes == ["84031"]
+
+    def test_no_match(self, index):
+        """Test unrelated names find nothing."""
+        assert index.geocode("zzzz qqqq") == (None, [])
+
+
+class TestPlaceBusStopQueryTool:
+    """Test the agent tool built on the index."""
+
+    @pytest.fixture(autouse=True)
+    def data(self, index, tmp_path, monkeypatch):
+        """Fixture for the stop dataset in the working directory and the index built from it."""
+        import geocoder
+        (tmp_path / "data").mkdir()
+        pd.DataFrame(STOPS, columns=["BusStopCode", "Description", "RoadName", "Latitude", "Longitude"]) \
+            .to_csv(tmp_path / "data" / "all_busstops.csv", index=False)
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setattr(geocoder, "_index", index)
+
+    def test_place_name_to_nearest_stops(self):
+        """Test a place name goes straight to the nearest stops."""
+        from bus_tool import PlaceBusStopQueryTool
+        result = PlaceBusStopQueryTool().invoke({"place_name": "ngee ann city"})
+        assert result.startswith("Matched 'ngee ann city' to Ngee Ann City (Orchard Rd)")
+        assert "Nearest Bus Stops" in result and "`09047`" in result
+
+    def test_ambiguous_place_lists_candidates(self):
+        """Test an ambiguous name lists ranked candidates with coordinates."""
+        from bus_tool import PlaceBusStopQueryTool
+        result = PlaceBusStopQueryTool().invoke({"place_name": "blk 123"})
+        assert "could be one of these places" in result
+        assert "1. Blk 123" in result and "2. Blk 123" in result and "latitude 1.3" in result
@@ -0,0 +1,88 @@
+import json
+import logging
+import threading
+import urllib.request
+from uuid import uuid4
+
+import pytest
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, LLMResult
+
+import metrics
+
+
+@pytest.fixture
+def registry():
+    """Fixture for an empty metrics registry."""
+    return metrics.Registry()
+
+
+class TestMetrics:
+    """Test metric primitives and Prometheus rendering."""
+
+    def test_histogram_buckets(self, registry):
+        """Test histogram bucket counts are cumulative in the rendered output."""
+        histogram = registry.histogram("latency_seconds", "Latency", ["node"], buckets=(0.1, 1))
+        histogram.observe(0.05, node="a")
+        histogram.observe(0.5, node="a")
+        histogram.observe(5, node="a")
+        output = registry.render()
+        assert 'latency_seconds_bucket{node="a",le="0.1"} 1' in output
+        assert 'latency_seconds_bucket{node="a",le="1"} 2' in output
+        assert 'latency_seconds_bucket{node="a",le="+Inf"} 3' in output
+        assert histogram.count(node="a") == 3
+
+    def test_counter_labels(self, registry):
+        """Test counters are tracked separately per label set."""
+        counter = registry.counter("calls_total", "Calls", ["status"])
+        counter.inc(status="ok")
+        counter.inc(status="ok")
+        counter.inc(status="error")
+        assert counter.value(status="ok") == 2
+        assert counter.value(status="error") == 1
+
+    def test_metrics_endpoint(self):
+        """Test the /metrics endpoint serves the global registry."""
+        server = metrics.ThreadingHTTPServer(("127.0.0.1", 0), metrics._MetricsHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            metrics.TURN_SECONDS.observe(0.2, route="agent")
+            url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+            body = urllib.request.urlopen(url).read().decode()
+            assert "# TYPE agent_turn_seconds histogram" in body
+        finally:
+            server.shutdown()
+
+
+class TestTurnTracer:
+    """Test per-turn tracing callbacks."""
+
+    def test_llm_tokens_and_tool_errors(self):
+        """Test LLM usage and tool outcomes are recorded for the turn."""
+        tracer = metrics.TurnTracer("123")
+        llm_run, ok_run, error_run = uuid4(), uuid4(), uuid4()
+
+        tracer.on_chat_model_start({}, [[]], run_id=llm_run, metadata={"ls_model_name": "test-model"})
+        message = AIMessage(content="hi", usage_metadata={"input_tokens": 120, "output_tokens": 8, "total_tokens": 128})
+        tracer.on_llm_end(LLMResult(generations=[[ChatGeneration(message=message)]]), run_id=llm_run)
+
+        tracer.on_tool_start({"name": "flaky_tool"}, "", run_id=ok_run)
+        tracer.on_tool_end("done", run_id=ok_run)
+        tracer.on_tool_start({"name": "flaky_tool"}, "", run_id=error_run)
+        tracer.on_tool_error(ValueError("boom"), run_id=error_run)
+        tracer.finish()
+
+        assert tracer.llm_calls == 1
+        assert tracer.prompt_tokens == 120
+        assert tracer.completion_tokens == 8
+        assert [call["status"] for call in tracer.tool_calls] == ["ok", "error"]
+        assert metrics.TOOL_CALLS.value(tool="flaky_tool", status="error") >= 1
+
+    def test_fast_path_route(self, caplog):
+        """Test turns answered without the graph are counted under their own route."""
+        before = metrics.TURN_SECONDS.count(route="fast_path")
+        with caplog.at_level(logging.INFO, logger="metrics"):
+            metrics.TurnTracer("123", route="fast_path").finish()
+        assert metrics.TURN_SECONDS.count(route="fast_path") == before + 1
+        turn = next(json.loads(r.getMessage()) for r in caplog.records if "agent_turn" in r.getMessage())
+        assert turn["route"] == "fast_path" and turn["llm_calls"] == 0
@@ -0,0 +1,101 @@
+import asyncio
+import time
+
+import pytest
+from telegram.error import BadRequest, NetworkError, RetryAfter
+
+import outbound as outbound_module
+from outbound import OUTBOUND_SENT, OutboundMedia, OutboundQueue
+
+
+class FakeBot:
+    """Records sends, failing with the queued errors first."""
+
+    def __init__(self, errors=()):
+        self.errors = list(errors)
+        self.sent = []
+
+    async def send_voice(self, chat_id, voice, caption=None, filename=None):
+        if self.errors:
+            raise self.errors.pop(0)
+        self.sent.append((chat_id, voice, time.monotonic()))
+
+
+class TestOutboundQueue:
+    """Test sending tool media through the bot."""
+
+    @pytest.mark.asyncio
+    async def test_submit_from_thread_keeps_chat_order(self):
+        """Test media submitted from worker threads is sent to its chat, in order."""
+        bot = FakeBot()
+        queue = OutboundQueue(chat_rate=1000, chat_burst=10, global_rate=1000)
+        queue.start(bot)
+
+        def tool_thread():
+            for i in range(3):
+                queue.submit(OutboundMedia(1, "voice", f"a{i}".encode()))
+                queue.submit(OutboundMedia(2, "voice", f"b{i}".encode()))
+
+        await asyncio.to_thread(tool_thread)
+        await queue.stop()
+        assert [voice for chat, voice, _ in bot.sent if chat == 1] == [b"a0", b"a1", b"a2"]
+        assert [voice for chat, voice, _ in bot.sent if chat == 2] == [b"b0", b"b1", b"b2"]
+        with pytest.raises(RuntimeError):
+            queue.submit(OutboundMedia(1, "voice", b"late"))
+
+    @pytest.mark.asyncio
+    async def test_chat_rate_limit(self):
+        """Test a chat's sends are spaced out by its token bucket."""
+        bot = FakeBot()
+        queue = OutboundQueue(chat_rate=20, chat_burst=1, global_rate=1000)
+        queue.start(bot)
+        for i in range(3):
+            await queue.put(OutboundMedia(1, "voice", b"x"))
+        await queue.stop()
+        times = [sent_at for _, _, sent_at in bot.sent]
+        assert times[2] - times[0] >= 0.09
+
+    @pytest.mark.asyncio
+    async def test_retries_transient_errors(self):
+        """Test flood waits and network errors are retried, and bad requests are not."""
+        bot = FakeBot([RetryAfter(0), NetworkError("connection reset")])
+        queue = OutboundQueue(chat_rate=1000, chat_burst=10, global_rate=1000, backoff=0)
+        queue.start(bot)
+        retries = OUTBOUND_SENT.value(kind="voice", status="retry")
+        await queue.put(OutboundMedia(1, "voice", b"x"))
+        await queue.stop()
+        assert len(bot.sent) == 1
+        assert OUTBOUND_SENT.value(kind="voice", status="retry") == retries + 2
+
+        bot = FakeBot([BadRequest("Chat not found")])
+        queue.start(bot)
+        await queue.put(OutboundMedia(1, "voice", b"x"))
+        await queue.stop()
+        assert bot.sent == [] and bot.errors == []
+
+
+class TestSoundTool:
+    """Test the text to speech tool hands its audio to the outbound queue."""
+
+    @pytest.mark.asyncio
+    async def test_sends_to_originating_chat(self, monkeypatch):
+        """Test the voice message goes to the chat of the turn, not a fixed chat."""
+        import sound_tool
+
+        class Response:
+            status_code = 200
+            content = b"mp3 bytes"
+
+        monkeypatch.setenv("ELEVEN_LABS_API_KEY", "fake")
+        monkeypatch.setenv("TELEGRAM_CHAT_ID", "999")
+        monkeypatch.setattr(sound_tool.requests, "post", lambda *args, **kwargs: Response())
+        bot = FakeBot()
+        queue = OutboundQueue(chat_rate=1000, chat_burst=10, global_rate=1000)
+        monkeypatch.setattr(sound_tool, "outbound", queue)
+        queue.start(bot)
+
+        tool = sound_tool.SoundTool()
+        result = await asyncio.to_thread(tool.invoke, {"text": "hello"}, {"configurable": {"thread_id": "-1234"}})
+        await queue.stop()
+        assert "being sent" in result
+        assert [(chat, voice) for chat, voice, _ in bot.sent] == [(-1234, b"mp3 bytes")]
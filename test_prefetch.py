@@ -0,0 +1,98 @@
+import asyncio
+import threading
+from datetime import datetime
+
+import pytest
+
+import fakes
+import prefetch
+import store
+from store import MemoryCache
+
+
+@pytest.fixture
+def profile(monkeypatch):
+    """Fixture for an empty usage profile and arrival cache."""
+    profile = prefetch.UsageProfile()
+    profile._cache = MemoryCache("bus_usage")
+    cache = prefetch.ArrivalCache()
+    cache._cache = MemoryCache("bus_arrivals")
+    monkeypatch.setattr(prefetch, "usage_profile", profile)
+    monkeypatch.setattr(prefetch, "arrival_cache", cache)
+    return profile
+
+
+class TestUsageProfile:
+    """Test the time-of-day usage profile."""
+
+    def test_likely_stops_follow_commute(self, profile):
+        """Test stops used at a time of day are predicted just before that time."""
+        for day in range(5, 10):
+            profile.record("52071", datetime(2026, 10, day, 8, 10))
+        profile.record("11111", datetime(2026, 10, 5, 8, 10))
+        profile.record("22222", datetime(2026, 10, 5, 18, 30))
+
+        assert profile.likely_stops(datetime(2026, 10, 12, 8, 0)) == ["52071"]
+        assert profile.likely_stops(datetime(2026, 10, 12, 13, 0)) == []
+        assert profile.likely_stops(datetime(2026, 10, 11, 8, 0)) == [], "Weekday usage shouldn't predict weekends"
+
+    @pytest.mark.parametrize("backend", ["memory", "sqlite"])
+    def test_concurrent_records_are_all_counted(self, profile, backend, tmp_path):
+        """Test queries recorded from many threads at once are all counted."""
+        if backend == "sqlite":
+            profile._cache = store.SharedCache("bus_usage", store.connect(str(tmp_path / "state.db")))
+        when = datetime(2026, 10, 5, 8, 10)
+
+        def record():
+            for _ in range(50):
+                profile.record("52071", when)
+
+        threads = [threading.Thread(target=record) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert profile._cache.get("usage:52071") == {prefetch.slot_key(when): 400}
+        assert profile.stops() == ["52071"]
+
+    def test_usage_failure_still_answers(self, profile, monkeypatch):
+        """Test a query is answered even when recording its usage fails."""
+        import bus_tool
+
+        def fail(code):
+            raise store.sqlite3.OperationalError("database is locked")
+
+        with fakes.FakeLTAServer() as lta:
+            monkeypatch.setenv("LTA_API_KEY", "fake")
+            monkeypatch.setenv("LTA_BASE_URL", lta.url)
+            monkeypatch.setattr(bus_tool, "arrival_cache", prefetch.arrival_cache)
+            monkeypatch.setattr(profile, "record", fail)
+            monkeypatch.setattr(bus_tool, "usage_profile", profile)
+
+            answer = bus_tool.BusQueryTool()._run("52071")
+        assert not answer.startswith("Error")
+        assert lta.request_count == 1
+
+
+class TestPrefetcher:
+    """Test warming the arrival cache."""
+
+    @pytest.mark.asyncio
+    async def test_prefetch_warms_cache(self, profile, monkeypatch):
+        """Test likely stops are fetched ahead of time so queries hit the cache."""
+        with fakes.FakeLTAServer() as lta:
+            monkeypatch.setenv("LTA_API_KEY", "fake")
+            monkeypatch.setenv("LTA_BASE_URL", lta.url)
+            monkeypatch.setattr(profile, "likely_stops", lambda: ["52071"])
+
+            prefetcher = prefetch.Prefetcher(interval=60)
+            prefetcher.start()
+            await asyncio.sleep(0.2)
+            await prefetcher.stop()
+
+            assert lta.request_count == 1
+            arrival = prefetch.arrival_cache.get_or_fetch(None, "52071")
+            assert arrival["BusStopCode"] == "52071"
+            assert lta.request_count == 1, "Query should be answered from the warm cache"
+
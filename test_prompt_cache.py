@@ -0,0 +1,89 @@
+import json
+import logging
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from langchain_core.tools import tool
+from langchain_openai import ChatOpenAI
+
+import metrics
+from fakes import FakeOpenAIServer
+from prompt_cache import PREFIX_CHANGES, PrefixMonitor, dynamic_context, prefix_hash, sort_tools
+
+
+@tool
+def bus_arrival_query(bus_stop_code: str) -> str:
+    """Next buses at a stop."""
+    return bus_stop_code
+
+
+@tool
+def chinese_pinyin(text: str) -> str:
+    """Pinyin for Chinese text."""
+    return text
+
+
+PERSONA = "You are Gianna, a helpful assistant. " * 300
+
+
+class TestPrefix:
+    """Test the static prompt prefix is byte-stable."""
+
+    def test_hash_ignores_tool_order(self):
+        """Test tools passed in any order give the same prefix once sorted."""
+        forward = prefix_hash(PERSONA, sort_tools([bus_arrival_query, chinese_pinyin]))
+        backward = prefix_hash(PERSONA, sort_tools([chinese_pinyin, bus_arrival_query]))
+        assert forward == backward
+
+    def test_hash_changes_with_prompt(self):
+        """Test any change to the system prompt changes the prefix hash."""
+        tools = sort_tools([bus_arrival_query, chinese_pinyin])
+        assert prefix_hash(PERSONA, tools) != prefix_hash(PERSONA + " ", tools)
+
+    def test_monitor_reports_changes(self, caplog):
+        """Test the monitor accepts a repeated prefix and warns when it changes."""
+        monitor = PrefixMonitor()
+        monitor._cache.delete("hash")
+        changes = PREFIX_CHANGES.value()
+
+        assert monitor.check("aaaa")
+        assert monitor.check("aaaa")
+        with caplog.at_level(logging.WARNING):
+            assert not monitor.check("bbbb")
+        assert PREFIX_CHANGES.value() == changes + 1
+        assert "aaaa -> bbbb" in caplog.text
+
+    def test_dynamic_context(self):
+        """Test per-turn context carries the current time."""
+        now = datetime(2026, 10, 19, 8, 5, tzinfo=ZoneInfo("Asia/Singapore"))
+        assert dynamic_context(now) == "Current time: Monday 19 October 2026, 08:05 (Asia/Singapore time, UTC+0800)"
+
+    def test_dynamic_context_uses_bot_timezone(self):
+        """Test the current time is given in the bot's time zone, not the server's."""
+        assert dynamic_context().endswith("(Asia/Singapore time, UTC+0800)")
+
+
+class TestCachedTokens:
+    """Test prompt cache hits are measured per turn."""
+
+    def test_stable_prefix_is_cached(self, caplog):
+        """Test a follow-up request reuses the cached prefix and the turn logs its hit ratio."""
+        with FakeOpenAIServer() as server:
+            model = ChatOpenAI(model="gpt-4o-mini", base_url=server.url, api_key="fake", max_retries=0)
+            model = model.bind_tools(sort_tools([bus_arrival_query, chinese_pinyin]))
+            history = [HumanMessage("hi")]
+            model.invoke([SystemMessage(PERSONA)] + history + [SystemMessage(dynamic_context())])
+
+            history += [AIMessage("Hello!"), HumanMessage("any buses at 52071?")]
+            tracer = metrics.TurnTracer("123")
+            with caplog.at_level(logging.INFO, logger="metrics"):
+                model.invoke([SystemMessage(PERSONA)] + history + [SystemMessage(dynamic_context())],
+                             config={"callbacks": [tracer]})
+                tracer.finish()
+
+        assert tracer.cached_tokens >= 1024
+        assert tracer.cached_tokens < tracer.prompt_tokens
+        turn = next(json.loads(r.getMessage()) for r in caplog.records if "agent_turn" in r.getMessage())
+        assert turn["cache_hit_ratio"] == round(tracer.cached_tokens / tracer.prompt_tokens, 3)
+        assert turn["cache_hit_ratio"] > 0.8
@@ -0,0 +1,109 @@
+import json
+import os
+import subprocess
+import sys
+from types import SimpleNamespace
+
+import pytest
+from telegram import Update
+
+from recorder import BOT_MENTION, UpdateRecorder
+from replay import load_session, synthetic_session
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def group_update(text):
+    return {
+        "update_id": 7,
+        "message": {
+            "message_id": 42,
+            "date": 1760000000,
+            "chat": {"id": -100123, "type": "supergroup", "title": "Family"},
+            "from": {"id": 555, "is_bot": False, "first_name": "Alice", "last_name": "Tan", "username": "alice"},
+            "text": text,
+            "entities": [{"type": "mention", "offset": 0, "length": 11}],
+            "reply_to_message": {
+                "message_id": 41,
+                "date": 1759999990,
+                "chat": {"id": -100123, "type": "supergroup", "title": "Family"},
+                "from": {"id": 777, "is_bot": False, "first_name": "Bob"},
+                "location": {"latitude": 1.3306381, "longitude": 103.8426682, "horizontal_accuracy": 5},
+            },
+        },
+    }
+
+
+class TestUpdateRecorder:
+    """Test anonymised recording of updates."""
+
+    def test_anonymise(self):
+        """Test ids are pseudonymised consistently and personal details are removed."""
+        recorder = UpdateRecorder("unused", salt="secret")
+        recorder._bot_username = "GiannaBot"
+        data = recorder.anonymise(group_update("@GiannaBot email alice@example.com or call +65 9123 4567"))
+        message = data["message"]
+
+        assert message["chat"] == {"id": recorder.pseudonym(-100123), "type": "supergroup"}
+        assert message["chat"]["id"] < 0
+        assert message["from"] == {"id": recorder.pseudonym(555), "is_bot": False, "first_name": "User"}
+        assert message["reply_to_message"]["chat"]["id"] == message["chat"]["id"]
+        assert message["text"] == f"{BOT_MENTION} email <email> or call <phone>"
+        assert "entities" not in message
+        assert message["reply_to_message"]["location"] == {"latitude": 1.331, "longitude": 103.843}
+        assert "Alice" not in json.dumps(data) and "555" not in json.dumps(data)
+        assert UpdateRecorder("unused", salt="other").pseudonym(555) != recorder.pseudonym(555)
+
+    def test_commands_keep_their_entity(self):
+        """Test a recorded /command still parses as a command, with the bot's username swapped."""
+        recorder = UpdateRecorder("unused", salt="secret")
+        recorder._bot_username = "GiannaBot"
+        update = group_update("/watch@GiannaBot 52071 or call +65 9123 4567")
+        update["message"]["entities"] = [{"type": "bot_command", "offset": 0, "length": 16}]
+        message = Update.de_json(recorder.anonymise(update), None).message
+
+        assert message.text == "/watch@replay_bot 52071 or call <phone>"
+        assert message.parse_entities() == {message.entities[0]: "/watch@replay_bot"}
+
+    @pytest.mark.asyncio
+    async def test_recording_replays(self, tmp_path):
+        """Test a recording loads back with the owner's pseudonym and parseable updates."""
+        path = tmp_path / "updates.jsonl"
+        recorder = UpdateRecorder(str(path), salt="secret", owner_id=555)
+        context = SimpleNamespace(bot=SimpleNamespace(username="GiannaBot"))
+        await recorder.record(Update.de_json(group_update("@GiannaBot hi"), None), context)
+        await recorder.record(Update.de_json(group_update("@GiannaBot again"), None), context)
+        recorder.close()
+
+        owner_id, events = load_session(str(path))
+        assert owner_id == recorder.pseudonym(555)
+        assert [Update.de_json(data, None).message.text for _, data in events] == [
+            f"{BOT_MENTION} hi", f"{BOT_MENTION} again"]
+        assert Update.de_json(events[0][1], None).effective_user.id == owner_id
+
+
+class TestReplay:
+    """Test the replay harness."""
+
+    def test_synthetic_session(self):
+        """Test generated sessions are ordered in time and deterministic."""
+        owner_id, events = synthetic_session(3, 5)
+        assert len(events) == 15
+        assert [t for t, _ in events] == sorted(t for t, _ in events)
+        assert [data for _, data in events] == [data for _, data in synthetic_session(3, 5)[1]]
+
+    def test_replay_synthetic_session(self, tmp_path):
+        """Test a fast replay answers every message, with each sticker reply based on its own sticker."""
+        output = tmp_path / "replay.json"
+        subprocess.run(
+            [sys.executable, "replay.py", "--synthetic", "4", "--messages", "6", "--speed", "100",
+             "--llm-latency", "0.05", "--no-limits", "--output", str(output)],
+            cwd=REPO_DIR, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=300,
+        )
+        results = json.loads(output.read_text())["results"]
+        assert results["updates"] == 24
+        assert results["replies"] + results["merged"] == 24
+        assert results["unanswered"] == 0 and results["errors"] == 0
+        assert results["sticker_mismatches"] == 0
+        assert results["turn_latency"]["p99_ms"] >= results["turn_latency"]["p50_ms"]
+        assert results["memory"]["rss_start_mb"] > 0
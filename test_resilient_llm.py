@@ -0,0 +1,118 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from langchain_core.messages import HumanMessage
+from langchain_core.tools import tool
+from langchain_openai import ChatOpenAI
+
+import resilient_llm
+from fakes import FakeOpenAIServer
+from resilient_llm import LLM_FALLBACKS, LLM_HEDGES, LLMDeadlineExceeded, ResilientChatModel
+
+
+def openai_model(server):
+    return ChatOpenAI(model="gpt-4o-mini", base_url=server.url, api_key="fake", max_retries=0, temperature=0)
+
+
+@pytest.fixture
+def primary_server():
+    with FakeOpenAIServer(reply="primary") as server:
+        yield server
+
+
+@pytest.fixture
+def fallback_server():
+    with FakeOpenAIServer(reply="fallback") as server:
+        yield server
+
+
+class TestResilientChatModel:
+    """Test deadlines, hedging and fallback against a local OpenAI-compatible server."""
+
+    def test_fast_primary(self, primary_server, fallback_server):
+        """Test a healthy primary answers without hedging or falling back."""
+        model = ResilientChatModel(primary=openai_model(primary_server), fallback=openai_model(fallback_server))
+
+        assert model.invoke([HumanMessage("hi")]).content == "primary"
+        assert len(primary_server.requests) == 1
+        assert not fallback_server.requests
+
+    def test_slow_call_is_hedged(self, primary_server):
+        """Test a call slower than the recent tail gets a duplicate request, and the first reply wins."""
+        model = ResilientChatModel(primary=openai_model(primary_server), deadline=10,
+                                   hedge_min_samples=5, hedge_min_seconds=0.1)
+        model._latencies.extend([0.05] * 10)
+        primary_server.inject(delays=[3])
+        won = LLM_HEDGES.value(outcome="won")
+
+        start = time.monotonic()
+        assert model.invoke([HumanMessage("hi")]).content == "primary"
+        assert time.monotonic() - start < 2
+        assert len(primary_server.requests) == 2
+        assert LLM_HEDGES.value(outcome="won") == won + 1
+
+    def test_no_hedging_without_history(self, primary_server):
+        """Test calls aren't hedged until there are enough samples to know the tail."""
+        model = ResilientChatModel(primary=openai_model(primary_server), hedge_min_samples=5, hedge_min_seconds=0.1)
+        primary_server.inject(delays=[0.5])
+
+        assert model.hedge_delay() is None
+        assert model.invoke([HumanMessage("hi")]).content == "primary"
+        assert len(primary_server.requests) == 1
+
+    def test_deadline_falls_back(self, primary_server, fallback_server):
+        """Test a primary that misses the deadline is abandoned for the fallback."""
+        model = ResilientChatModel(primary=openai_model(primary_server), fallback=openai_model(fallback_server),
+                                   deadline=0.5, hedge_percentile=0)
+        primary_server.inject(delays=[3])
+        fallbacks = LLM_FALLBACKS.value(reason="deadline")
+
+        start = time.monotonic()
+        assert model.invoke([HumanMessage("hi")]).content == "fallback"
+        assert time.monotonic() - start < 2
+        assert LLM_FALLBACKS.value(reason="deadline") == fallbacks + 1
+
+    def test_error_falls_back(self, primary_server, fallback_server):
+        """Test a failing primary is answered by the fallback straight away."""
+        model = ResilientChatModel(primary=openai_model(primary_server), fallback=openai_model(fallback_server))
+        primary_server.inject(statuses=[500])
+        fallbacks = LLM_FALLBACKS.value(reason="error")
+
+        assert model.invoke([HumanMessage("hi")]).content == "fallback"
+        assert LLM_FALLBACKS.value(reason="error") == fallbacks + 1
+
+    def test_deadline_without_fallback(self, primary_server):
+        """Test missing the deadline with no fallback raises instead of waiting."""
+        model = ResilientChatModel(primary=openai_model(primary_server), deadline=0.3, hedge_percentile=0)
+        primary_server.inject(delays=[3])
+
+        start = time.monotonic()
+        with pytest.raises(LLMDeadlineExceeded):
+            model.invoke([HumanMessage("hi")])
+        assert time.monotonic() - start < 2
+
+    def test_bind_tools_sends_schemas(self, primary_server):
+        """Test bound tools reach the model in the request."""
+        @tool
+        def lookup(code: str) -> str:
+            """Look up a bus stop."""
+            return code
+
+        model = ResilientChatModel(primary=openai_model(primary_server))
+        model.bind_tools([lookup]).invoke([HumanMessage("hi")])
+
+        tools = primary_server.requests[0]["tools"]
+        assert [t["function"]["name"] for t in tools] == ["lookup"]
+
+    def test_fallback_not_blocked_by_hung_primaries(self, primary_server, fallback_server, monkeypatch):
+        """Test the fallback answers even when every primary worker is stuck on a hung call."""
+        monkeypatch.setattr(resilient_llm, "_primary_executor", ThreadPoolExecutor(max_workers=1))
+        model = ResilientChatModel(primary=openai_model(primary_server), fallback=openai_model(fallback_server),
+                                   deadline=0.5, hedge_percentile=0)
+        primary_server.inject(delays=[3, 3])
+
+        assert model.invoke([HumanMessage("hi")]).content == "fallback"
+        start = time.monotonic()
+        assert model.invoke([HumanMessage("hi")]).content == "fallback"
+        assert time.monotonic() - start < 1.5
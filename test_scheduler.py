@@ -0,0 +1,91 @@
+import asyncio
+import time
+
+import pytest
+
+from scheduler import AgentScheduler, SchedulerBusy, TokenBucket, PRIORITY_HIGH, DROPPED
+
+
+class FakeClock:
+    """Manually advanced clock for token bucket tests."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTokenBucket:
+    """Test token bucket refill and limits."""
+
+    def test_burst_then_refill(self):
+        """Test a bucket allows its burst, then refills at its rate."""
+        clock = FakeClock()
+        bucket = TokenBucket(rate=1, capacity=2, clock=clock)
+        assert bucket.try_acquire()
+        assert bucket.try_acquire()
+        assert not bucket.try_acquire(), "Bucket should be empty after its burst"
+        assert bucket.time_until_available() == pytest.approx(1.0)
+        clock.now = 1.0
+        assert bucket.try_acquire(), "Bucket should refill one token per second"
+
+
+class TestAgentScheduler:
+    """Test admission control in front of agent turns."""
+
+    @pytest.mark.asyncio
+    async def test_runs_on_worker_thread(self):
+        """Test submitted functions run and return their result."""
+        scheduler = AgentScheduler(workers=2, global_rate=100, global_burst=100, chat_rate=100, chat_burst=100)
+        assert await scheduler.submit(1, lambda a, b: a + b, 2, 3) == 5
+        await scheduler.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_per_chat_rate_limit(self):
+        """Test a chat over its burst is shed with SchedulerBusy."""
+        scheduler = AgentScheduler(workers=2, chat_rate=0.001, chat_burst=1, global_rate=100, global_burst=100)
+        await scheduler.submit(1, lambda: None)
+        with pytest.raises(SchedulerBusy) as excinfo:
+            await scheduler.submit(1, lambda: None)
+        assert excinfo.value.reason == "rate_limited"
+        # Other chats are unaffected
+        await scheduler.submit(2, lambda: None)
+        await scheduler.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_queue_full_sheds_and_priority_evicts(self):
+        """Test a full queue sheds normal requests but admits the owner by evicting."""
+        scheduler = AgentScheduler(workers=1, max_queue=2, chat_rate=100, chat_burst=100, global_rate=100, global_burst=100)
+        dropped_before = DROPPED.value(reason="queue_full")
+
+        blocker = asyncio.create_task(scheduler.submit(0, time.sleep, 0.2))
+        await asyncio.sleep(0.05)
+        queued = [asyncio.create_task(scheduler.submit(i, lambda i=i: i)) for i in (1, 2)]
+        await asyncio.sleep(0)
+        assert scheduler.depth == 2
+
+        with pytest.raises(SchedulerBusy):
+            await scheduler.submit(3, lambda: 3)
+        assert DROPPED.value(reason="queue_full") == dropped_before + 1
+
+        owner = asyncio.create_task(scheduler.submit(4, lambda: "owner", priority=PRIORITY_HIGH))
+        await asyncio.sleep(0)
+        results = await asyncio.gather(blocker, owner, *queued, return_exceptions=True)
+        assert results[1] == "owner"
+        assert results[2] == 1
+        assert isinstance(results[3], SchedulerBusy) and results[3].reason == "evicted"
+        await scheduler.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_no_global_token_spent_on_abandoned_job(self):
+        """Test a job whose caller gave up doesn't use up a global token meant for the next one."""
+        scheduler = AgentScheduler(workers=2, chat_rate=100, chat_burst=100, global_rate=0.001, global_burst=1)
+        scheduler._ensure_workers()
+        abandoned = asyncio.create_task(scheduler.submit(1, lambda: "abandoned"))
+        await asyncio.sleep(0)
+        abandoned.cancel()
+
+        assert await asyncio.wait_for(scheduler.submit(2, lambda: "served"), timeout=1) == "served"
+        assert scheduler.depth == 0
+        await scheduler.shutdown()
@@ -0,0 +1,134 @@
+import time
+
+import pytest
+from langchain_core.messages import HumanMessage
+
+import store
+from sharding import UpdateJournal, shard_for
+
+
+@pytest.fixture
+def conn(tmp_path):
+    """Fixture for a fresh state database."""
+    return store.connect(str(tmp_path / "state.db"))
+
+
+class TestStore:
+    """Test durable state shared between processes."""
+
+    def test_persistent_set(self, conn):
+        """Test set membership survives reopening the set."""
+        groups = store.PersistentSet("authorized_groups", conn)
+        groups.add(-12345)
+        groups.add(-12345)
+        assert -12345 in groups
+        assert -999 not in groups
+        assert len(groups) == 1
+        assert list(store.PersistentSet("authorized_groups", conn)) == [-12345]
+        groups.discard(-12345)
+        assert -12345 not in groups
+
+    def test_shared_cache_expiry(self, conn, monkeypatch):
+        """Test cached values expire after their TTL."""
+        cache = store.SharedCache("test", conn)
+        cache.set("a", {"x": 1}, ttl=10)
+        cache.set("b", [1, 2])
+        assert cache.get("a") == {"x": 1}
+        now = store.time.time()
+        monkeypatch.setattr(store.time, "time", lambda: now + 11)
+        assert cache.get("a") is None
+        assert cache.get("b") == [1, 2]
+
+    def test_sqlite_checkpointer(self, tmp_path, monkeypatch):
+        """Test the SQLite checkpointer stores and reloads conversation state."""
+        from langgraph.graph import StateGraph, START, END, MessagesState
+
+        monkeypatch.setattr(store, "STATE_DB_PATH", str(tmp_path / "state.db"))
+        monkeypatch.setattr(store, "_checkpointer", None)
+        builder = StateGraph(MessagesState)
+        builder.add_node("echo", lambda state: {"messages": []})
+        builder.add_edge(START, "echo")
+        builder.add_edge("echo", END)
+
+        config = {"configurable": {"thread_id": "42"}}
+        builder.compile(checkpointer=store.get_checkpointer()).invoke({"messages": [HumanMessage(content="hi")]}, config)
+
+        monkeypatch.setattr(store, "_checkpointer", None)
+        reloaded = builder.compile(checkpointer=store.get_checkpointer())
+        assert reloaded.get_state(config).values["messages"][0].content == "hi"
+
+    def test_update_alongside_checkpoint_writes(self, tmp_path, monkeypatch):
+        """Test atomic cache updates and checkpoint writes on other threads don't end each other's transactions."""
+        from concurrent.futures import ThreadPoolExecutor
+        from langgraph.graph import StateGraph, START, END, MessagesState
+
+        monkeypatch.setattr(store, "STATE_DB_PATH", str(tmp_path / "state.db"))
+        monkeypatch.setattr(store, "_checkpointer", None)
+        builder = StateGraph(MessagesState)
+        builder.add_node("echo", lambda state: {"messages": []})
+        builder.add_edge(START, "echo")
+        builder.add_edge("echo", END)
+        graph = builder.compile(checkpointer=store.get_checkpointer())
+        cache = store.SharedCache("test")
+
+        def increment(n):
+            time.sleep(0.001)  # hold the transaction open while checkpoints are written
+            return (n or 0) + 1
+
+        def count(_):
+            for _ in range(50):
+                cache.update("n", increment)
+
+        def chat(thread_id):
+            for _ in range(10):
+                graph.invoke({"messages": [HumanMessage(content="hi")]}, {"configurable": {"thread_id": thread_id}})
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            futures = [pool.submit(count, i) for i in range(4)] + [pool.submit(chat, str(i)) for i in range(4)]
+            for future in futures:
+                future.result()
+        assert cache.get("n") == 200
+        assert len(graph.get_state({"configurable": {"thread_id": "0"}}).values["messages"]) == 10
+
+    @pytest.mark.parametrize("backend", ["memory", "sqlite"])
+    def test_clear_thread(self, backend, tmp_path, monkeypatch):
+        """Test clearing a thread deletes its checkpoints and leaves other threads alone."""
+        from langgraph.graph import StateGraph, START, END, MessagesState
+
+        monkeypatch.setattr(store, "STATE_DB_PATH", str(tmp_path / "state.db") if backend == "sqlite" else None)
+        monkeypatch.setattr(store, "_checkpointer", None)
+        builder = StateGraph(MessagesState)
+        builder.add_node("echo", lambda state: {"messages": []})
+        builder.add_edge(START, "echo")
+        builder.add_edge("echo", END)
+        graph = builder.compile(checkpointer=store.get_checkpointer())
+        for thread_id in ("42", "43"):
+            graph.invoke({"messages": [HumanMessage(content="hi")]}, {"configurable": {"thread_id": thread_id}})
+
+        store.clear_thread(graph.checkpointer, "42")
+        assert not graph.get_state({"configurable": {"thread_id": "42"}}).values
+        assert graph.get_state({"configurable": {"thread_id": "43"}}).values["messages"][0].content == "hi"
+
+
+class TestSharding:
+    """Test chat to worker assignment."""
+
+    def test_shard_for_is_stable(self):
+        """Test a chat always maps to the same shard and shards are used evenly enough."""
+        assignments = {chat_id: shard_for(chat_id, 4) for chat_id in range(-500, 500)}
+        assert all(shard_for(chat_id, 4) == shard for chat_id, shard in assignments.items())
+        assert set(assignments.values()) == {0, 1, 2, 3}
+
+    def test_journal_keeps_unfinished_updates(self, conn):
+        """Test updates stay journaled until handled and are replayed to their own shard, oldest first."""
+        journal = UpdateJournal(conn)
+        chats = {1: 100, 2: 200, 3: 100, 4: None}
+        for update_id, chat_id in chats.items():
+            journal.add(update_id, chat_id, {"update_id": update_id})
+        journal.done(1)
+
+        reopened = UpdateJournal(conn)
+        pending = {index: [data["update_id"] for data in reopened.pending(index, 2)] for index in range(2)}
+        assert sorted(pending[0] + pending[1]) == [2, 3, 4]
+        assert pending[shard_for(100, 2)][:1] == [3]
+        assert 4 in pending[0]
@@ -0,0 +1,123 @@
+import asyncio
+
+import pytest
+
+import update_processor
+from update_processor import ChatOrderedUpdateProcessor, queue_wait
+
+
+def create_mock_update(chat_id: int, update_id: int = 0):
+    """Create a mock update object."""
+    return type('obj', (object,), {
+        'update_id': update_id,
+        'effective_chat': type('obj', (object,), {'id': chat_id})
+    })
+
+
+class TestChatOrderedUpdateProcessor:
+    """Test per-chat ordering with cross-chat concurrency."""
+
+    @pytest.mark.asyncio
+    async def test_same_chat_in_order(self):
+        """Test updates from one chat are handled one at a time, in arrival order."""
+        processor = ChatOrderedUpdateProcessor(8)
+        handled = []
+
+        async def handle(i, delay):
+            await asyncio.sleep(delay)
+            handled.append(i)
+
+        update = create_mock_update(-100)
+        await asyncio.gather(*(
+            processor.process_update(update, handle(i, delay))
+            for i, delay in enumerate([0.05, 0.01, 0.03, 0])
+        ))
+        assert handled == [0, 1, 2, 3], "Same-chat updates should finish in arrival order"
+
+    @pytest.mark.asyncio
+    async def test_different_chats_in_parallel(self):
+        """Test updates from different chats overlap."""
+        processor = ChatOrderedUpdateProcessor(8)
+        running = 0
+        peak = 0
+
+        async def handle():
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.02)
+            running -= 1
+
+        await asyncio.gather(*(
+            processor.process_update(create_mock_update(chat_id), handle())
+            for chat_id in (1, 2, 3, 4)
+        ))
+        assert peak == 4, "Different chats should be processed concurrently"
+        assert not processor._chats, "Per-chat locks should be released when idle"
+
+    @pytest.mark.asyncio
+    async def test_burst_does_not_stall_other_chats(self):
+        """Test a burst from one chat bigger than the concurrency limit doesn't hold up another chat."""
+        processor = ChatOrderedUpdateProcessor(2)
+        assert processor.max_concurrent_updates == 2
+        finished = {}
+        start = asyncio.get_running_loop().time()
+
+        async def handle(name):
+            await asyncio.sleep(0.05)
+            finished[name] = asyncio.get_running_loop().time() - start
+
+        burst = [processor.process_update(create_mock_update(-100, i), handle(i)) for i in range(5)]
+        other = processor.process_update(create_mock_update(-200, 99), handle("other"))
+        await asyncio.gather(*burst, other)
+        assert finished["other"] < 0.09, "The other chat should run alongside the burst's first update"
+        assert [name for name in finished if name != "other"] == [0, 1, 2, 3, 4]
+
+    @pytest.mark.asyncio
+    async def test_concurrency_limit(self):
+        """Test no more than max_concurrent_updates updates run at once across chats."""
+        processor = ChatOrderedUpdateProcessor(2)
+        running = 0
+        peak = 0
+
+        async def handle():
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+
+        await asyncio.gather(*(processor.process_update(create_mock_update(-i), handle()) for i in range(1, 6)))
+        assert peak == 2
+
+    @pytest.mark.asyncio
+    async def test_queue_wait_counts_time_behind_chat(self):
+        """Test an update's queue wait includes the time spent behind its chat's earlier update."""
+        processor = ChatOrderedUpdateProcessor(8)
+        waits = {}
+
+        async def handle(update, delay):
+            waits[update.update_id] = queue_wait(update)
+            await asyncio.sleep(delay)
+
+        first, second = create_mock_update(-100, 1), create_mock_update(-100, 2)
+        await asyncio.gather(processor.process_update(first, handle(first, 0.05)),
+                             processor.process_update(second, handle(second, 0)))
+        assert waits[1] < 0.01
+        assert waits[2] >= 0.04
+        assert not update_processor._received, "Stamps are dropped once updates are handled"
+
+    @pytest.mark.asyncio
+    async def test_on_processed_after_handling(self):
+        """Test updates are reported as processed only once their handlers have finished."""
+        processor = ChatOrderedUpdateProcessor(8)
+        processed = []
+        processor.on_processed = lambda update: processed.append(update.update_id)
+
+        async def handle():
+            await asyncio.sleep(0.02)
+            assert not processed
+
+        await processor.process_update(create_mock_update(-100, update_id=7), handle())
+        await processor.process_update(create_mock_update(None, update_id=8), asyncio.sleep(0))
+        assert processed == [7, 8]
@@ -0,0 +1,122 @@
+import asyncio
+import logging
+import sys
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+
+from telegram.ext import BaseUpdateProcessor
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+UPDATES_IN_FLIGHT = REGISTRY.gauge("updates_in_flight", "Updates currently being handled or waiting on their chat")
+
+# When each update being processed was handed to the processor (perf_counter), by update id
+_received: Dict[int, float] = {}
+
+
+def queue_wait(update: object) -> Optional[float]:
+    """Seconds since the update was handed to the processor, or None if it wasn't."""
+    received = _received.get(getattr(update, "update_id", None))
+    return None if received is None else time.perf_counter() - received
+
+
+class ChatLock:
+    """A per-chat lock, counting the tasks holding or waiting on it so it can be dropped when unused."""
+
+    __slots__ = ("lock", "users")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.users = 0
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Process updates concurrently while keeping each chat's updates in order.
+
+    Updates for different chats run in parallel (up to max_concurrent_updates).
+    Updates for the same chat are serialized behind a per-chat lock, in the
+    order they arrived, so replies in one conversation never overtake each other.
+    An update only takes one of the max_concurrent_updates slots once it holds
+    its chat's lock, so a burst from one chat can't occupy every slot while it
+    waits on itself and stall the other chats.
+
+    on_processed, if set, is called with each update once its handlers have
+    finished, or once the work they left behind is done for held updates
+    (shard workers use it to acknowledge updates).
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        # PTB sizes its own semaphore from max_concurrent_updates and takes it before
+        # do_process_update, i.e. before the per-chat wait, so that one is left
+        # unbounded and _slots does the limiting
+        if max_concurrent_updates < 1:
+            raise ValueError("`max_concurrent_updates` must be a positive integer!")
+        self._limit = sys.maxsize
+        super().__init__(max_concurrent_updates)
+        self._limit = max_concurrent_updates
+        self._slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self._chats: Dict[Any, ChatLock] = {}
+        self.on_processed: Optional[Callable[[object], None]] = None
+        self._held: Set[int] = set()
+
+    def hold(self, update) -> Callable[[], None]:
+        """
+        Keep an update from counting as processed when its handlers return, for
+        handlers that leave work to finish later (a debounced message). Returns
+        the callable that reports it processed once that work is done.
+        """
+        self._held.add(update.update_id)
+        return lambda: self._processed(update)
+
+    def _processed(self, update: object):
+        if self.on_processed is not None:
+            self.on_processed(update)
+
+    @property
+    def max_concurrent_updates(self) -> int:
+        return self._limit
+
+    @staticmethod
+    def chat_key(update: object) -> Optional[int]:
+        chat = getattr(update, "effective_chat", None)
+        return chat.id if chat else None
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = self.chat_key(update)
+        update_id = getattr(update, "update_id", None)
+        if update_id is not None:
+            _received[update_id] = time.perf_counter()
+        UPDATES_IN_FLIGHT.inc()
+        try:
+            if key is None:
+                async with self._slots:
+                    await coroutine
+            else:
+                chat_lock = self._chats.get(key)
+                if chat_lock is None:
+                    chat_lock = self._chats[key] = ChatLock()
+                chat_lock.users += 1
+                try:
+                    async with chat_lock.lock, self._slots:
+                        await coroutine
+                finally:
+                    chat_lock.users -= 1
+                    if not chat_lock.users:
+                        del self._chats[key]
+            if update_id in self._held:
+                self._held.discard(update_id)
+            else:
+                self._processed(update)
+        finally:
+            UPDATES_IN_FLIGHT.dec()
+            _received.pop(update_id, None)
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        if self._chats:
+            logger.info(f"Shutting down with {len(self._chats)} chats still processing")